@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from django.conf import settings
+        if settings.CHAT_WARMUP_ON_START:
+            # Load the models in this (server) process without blocking startup
+            from .components import register_components
+            register_components().start_warmup(settings.CHAT_WARMUP_COMPONENTS)
@@ -0,0 +1,176 @@
+# chat/archive.py
+"""
+Streaming NDJSON export and batched import of a user's conversations.
+
+An archive has one JSON object per line, each conversation line followed by
+its messages in order:
+
+    {"type": "conversation", "id": 12, "title": "...", "summary": "...", "last_activity": "..."}
+    {"type": "message", "conversation": 12, "user_response": "...", "ai_response": "...",
+     "timestamp": "...", "summarized": true}
+
+`summarized` marks the messages already folded into the rolling summary, so
+the summary survives the new IDs an import assigns. Both directions work a
+chunk at a time, so memory stays flat however large the archive is.
+"""
+import json
+import zlib
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatMessage, Conversation, PREVIEW_LENGTH
+
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+
+
+def _line(data):
+    return (json.dumps(data) + '\n').encode('utf-8')
+
+
+def export_lines(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the user's conversations and messages as NDJSON lines (bytes).
+
+    Rows are read with server-side cursors (`.iterator(chunk_size=...)`), one
+    conversation at a time along `chat_msg_conv_ts_idx`.
+    """
+    conversations = (
+        Conversation.objects.filter(user=user).order_by('id')
+        .values('id', 'title', 'summary', 'summarized_through', 'last_activity')
+    )
+    for conversation in conversations.iterator(chunk_size=chunk_size):
+        summarized_through = conversation.pop('summarized_through')
+        # Full precision, unlike DjangoJSONEncoder's milliseconds
+        conversation['last_activity'] = conversation['last_activity'].isoformat()
+        yield _line({'type': 'conversation', **conversation})
+
+        messages = (
+            ChatMessage.objects.filter(conversation_id=conversation['id'])
+            .order_by('timestamp', 'id')
+            .values_list('id', 'user_response', 'ai_response', 'timestamp')
+        )
+        for message_id, user_response, ai_response, timestamp in messages.iterator(chunk_size=chunk_size):
+            yield _line({
+                'type': 'message',
+                'conversation': conversation['id'],
+                'user_response': user_response,
+                'ai_response': ai_response,
+                'timestamp': timestamp.isoformat(),
+                'summarized': message_id <= summarized_through,
+            })
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Gzip an iterable of byte chunks on the fly.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _Importer:
+    def __init__(self, user, batch_size):
+        self.user = user
+        self.batch_size = batch_size
+        self.taken_titles = set(Conversation.objects.filter(user=user).values_list('title', flat=True))
+        # Messages follow their conversation line, so only the current one is kept
+        self.current_id = None
+        self.current = None
+        self.pending_conversations = []
+        self.pending_messages = []
+        self.conversation_count = 0
+        self.message_count = 0
+
+    def add(self, record):
+        if record.get('type') == 'conversation':
+            self._add_conversation(record)
+        elif record.get('type') == 'message':
+            self._add_message(record)
+        else:
+            raise ValueError(f"Unknown archive record: {record}")
+        if len(self.pending_conversations) + len(self.pending_messages) >= self.batch_size:
+            self.flush()
+
+    def _unique_title(self, title):
+        candidate, n = title, 1
+        while candidate in self.taken_titles:
+            n += 1
+            suffix = f" ({n})"
+            candidate = title[:Conversation._meta.get_field('title').max_length - len(suffix)] + suffix
+        self.taken_titles.add(candidate)
+        return candidate
+
+    def _add_conversation(self, record):
+        conversation = Conversation(
+            user=self.user,
+            title=self._unique_title(record['title']),
+            summary=record.get('summary') or '',
+        )
+        last_activity = parse_datetime(record['last_activity']) if record.get('last_activity') else None
+        if last_activity:
+            conversation.last_activity = last_activity
+        self.current_id, self.current = record['id'], conversation
+        self.pending_conversations.append(conversation)
+
+    def _add_message(self, record):
+        if record['conversation'] != self.current_id:
+            raise ValueError(f"Message for conversation {record['conversation']} outside its conversation")
+        message = ChatMessage(
+            conversation=self.current,
+            user_response=record.get('user_response'),
+            ai_response=record.get('ai_response'),
+            timestamp=parse_datetime(record['timestamp']),
+        )
+        message.summarized = record.get('summarized', False)
+        self.pending_messages.append(message)
+
+    def flush(self):
+        with transaction.atomic():
+            if self.pending_conversations:
+                Conversation.objects.bulk_create(self.pending_conversations)
+                self.conversation_count += len(self.pending_conversations)
+            if self.pending_messages:
+                # bulk_create picks up the new conversation IDs from the instances
+                ChatMessage.objects.bulk_create(self.pending_messages)
+                self.message_count += len(self.pending_messages)
+                self._update_list_fields()
+        self.pending_conversations = []
+        self.pending_messages = []
+
+    def _update_list_fields(self):
+        touched = {}
+        for message in self.pending_messages:
+            conversation = message.conversation
+            conversation.message_count += bool(message.user_response) + bool(message.ai_response)
+            conversation.last_message_at = message.timestamp
+            conversation.last_message_preview = (message.ai_response or message.user_response or '')[:PREVIEW_LENGTH]
+            if message.summarized:
+                conversation.summarized_through = message.id
+            touched[conversation.id] = conversation
+        Conversation.objects.bulk_update(
+            touched.values(),
+            ['message_count', 'last_message_at', 'last_message_preview', 'summarized_through'],
+        )
+
+
+def import_lines(user, lines, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import an NDJSON archive (an iterable of lines) into the user's account.
+    Rows are written with `bulk_create`, one transaction per batch. Titles the
+    user already has get a " (2)", " (3)", ... suffix.
+
+    Returns:
+        tuple: (conversations imported, messages imported).
+    """
+    importer = _Importer(user, batch_size)
+    for line in lines:
+        if line.strip():
+            importer.add(json.loads(line))
+    importer.flush()
+    return importer.conversation_count, importer.message_count
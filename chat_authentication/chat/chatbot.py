@@ -1,50 +1,107 @@
+import asyncio
+import contextvars
+import logging
 import os
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI
-from .custom_chat_history import DjangoChatMessageHistory
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_astradb import AstraDBVectorStore
-from astrapy import DataAPIClient
-from langchain.chains import create_retrieval_chain, create_history_aware_retriever
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.document_loaders import WebBaseLoader
+from .components import registry
 
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 ASTRA_TOKEN = os.getenv('ASTRA_TOKEN')
 ASTRA_ENDPOINT = os.getenv('ASTRA_ENDPOINT')
 ASTRA_NAMESPACE = os.getenv('ASTRA_NAMESPACE')
 
-COLLECTION = 'text_qa_pdf'
 
-load_dotenv()
-llm = ChatOpenAI(model="gpt-3.5-turbo-1106", temperature=0, streaming=True)
+# LLM clients, the vector store and the chains built on them are created on
+# first use through the component registry (see chat.components), so importing
+# this module stays cheap and works without network access. They are still
+# reachable as module attributes, e.g. `chatbot.runnable_with_history`.
 
 
-embedding = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+def _chat_model(spec, timeout):
+    """
+    Build a chat model from a "model" or "provider:model" spec (OpenAI when no
+    provider is given). Retries are left to ResilientChatModel; `timeout`
+    bounds each network read, so attempts it abandons end soon after.
+    """
+    provider, _, model = spec.rpartition(':')
+    if provider in ('', 'openai'):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model=model, temperature=0, streaming=True, timeout=timeout, max_retries=0)
+    from langchain.chat_models import init_chat_model
+    return init_chat_model(model, model_provider=provider, temperature=0, timeout=timeout, max_retries=0)
 
-client = DataAPIClient(ASTRA_TOKEN)
-db = client.get_database_by_api_endpoint(ASTRA_ENDPOINT, namespace=ASTRA_NAMESPACE)
 
-vstore = AstraDBVectorStore(
-    embedding=embedding,
-    namespace=ASTRA_NAMESPACE,
-    collection_name=COLLECTION,
-    token=ASTRA_TOKEN,
-    api_endpoint=ASTRA_ENDPOINT
-)
+def _build_llm():
+    # Primary model plus fallbacks, with deadlines, hedging and retries (see chat.resilience)
+    from .resilience import ResilientChatModel
+    config = settings.CHAT_LLM
+    if settings.CHAT_FAKE_MODELS:
+        from .fakes import fake_chat_model
+        models = [fake_chat_model(settings.CHAT_FAKE_MODELS)]
+    else:
+        models = [_chat_model(spec, config['FIRST_TOKEN_TIMEOUT']) for spec in [config['MODEL'], *config['FALLBACK_MODELS']]]
+    return ResilientChatModel(
+        models,
+        timeout=config['TIMEOUT'],
+        first_token_timeout=config['FIRST_TOKEN_TIMEOUT'],
+        hedge_delay=config['HEDGE_DELAY'],
+        max_retries=config['MAX_RETRIES'],
+        backoff_base=config['BACKOFF_BASE'],
+        backoff_max=config['BACKOFF_MAX'],
+    )
 
-# Define the retriever with similarity search
-retriever = vstore.as_retriever(
-    search_type="similarity_score_threshold",
-    search_kwargs={"k": 3, "score_threshold": 0.5},
-)
+
+def _build_embedding():
+    if settings.CHAT_FAKE_MODELS:
+        from .fakes import HashEmbeddings
+        embedding = HashEmbeddings(settings.CHAT_EMBEDDING_DIM)
+    else:
+        from langchain_openai import OpenAIEmbeddings
+        embedding = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+    cache = settings.CHAT_EMBEDDING_CACHE
+    if not cache:
+        return embedding
+    # Repeated queries and re-ingested chunks are served without an API call
+    from .embedding_cache import CachedEmbeddings, SqliteEmbeddingStore
+    return CachedEmbeddings(
+        embedding,
+        store=SqliteEmbeddingStore(cache['PATH']) if cache.get('PATH') else None,
+        max_entries=cache['MAX_ENTRIES'],
+    )
+
+
+def _build_vstore():
+    # CHAT_VECTOR_STORE picks the backend; only 'astra' leaves the local database
+    if settings.CHAT_VECTOR_STORE != 'astra':
+        from .retrievers import DjangoVectorStore
+        return DjangoVectorStore(registry.get('embedding'), settings.CHAT_RAG_COLLECTION)
+
+    from langchain_astradb import AstraDBVectorStore
+    return AstraDBVectorStore(
+        embedding=registry.get('embedding'),
+        namespace=ASTRA_NAMESPACE,
+        collection_name=settings.CHAT_RAG_COLLECTION,
+        token=ASTRA_TOKEN,
+        api_endpoint=ASTRA_ENDPOINT
+    )
+
+
+def _build_retriever():
+    # Define the retriever with similarity search
+    return registry.get('vstore').as_retriever(
+        search_type="similarity_score_threshold",
+        search_kwargs={"k": settings.CHAT_RAG_TOP_K, "score_threshold": settings.CHAT_RAG_SCORE_THRESHOLD},
+    )
 
 
 contextualize_q_system_prompt = """Given a chat history and the latest user question \
@@ -58,9 +115,15 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
         ("human", "{input}"),
     ]
 )
-history_aware_retriever = create_history_aware_retriever(
-    llm, retriever, contextualize_q_prompt
-)
+
+
+def _build_history_aware_retriever():
+    # Like create_history_aware_retriever, but skips the rewrite LLM call for
+    # self-contained questions (see chat.rewrite)
+    from .rewrite import build_history_aware_retriever
+    return build_history_aware_retriever(
+        registry.get('llm'), registry.get('retriever'), contextualize_q_prompt
+    )
 
 ########### RAG PROMPT ###############
 
@@ -99,39 +162,208 @@ qa_prompt = ChatPromptTemplate.from_messages(
 
 prompt_template = ChatPromptTemplate.from_messages([
     ("system", "You're an assistant knowledgeable in AI and algorithms. Answer clearly and concisely."),
+    # Relevant turns from the user's other conversations (chat.memory)
+    MessagesPlaceholder(variable_name="memory", optional=True),
     MessagesPlaceholder(variable_name="history"),
     ("human", "{input}"),
 ])
 
 
-# now initialize the conversation chain
-runnable = prompt_template | llm
+########### SUMMARY PROMPT ###############
+
+# Folds turns that left the history window into the conversation's running summary.
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", "Progressively summarize the lines of conversation provided, adding onto the \
+previous summary and returning a new summary. Keep names, facts, decisions and open \
+questions; drop pleasantries. Answer with the summary only."),
+    ("human", "Current summary:\n{summary}\n\nNew lines of conversation:\n{new_lines}\n\nNew summary:"),
+])
+
+
+def _with_memory(inputs, config):
+    """
+    Add the user's relevant past turns to the chain inputs as `memory`. The
+    conversation comes from the runnable config (see `history_config`).
+    """
+    conversation = config.get("configurable", {}).get("conversation")
+    if not settings.CHAT_MEMORY_ENABLED or conversation is None:
+        return inputs
+    try:
+        turns = memory.recall(conversation, inputs["input"], window=inputs.get("history", []))
+    except Exception:
+        # Memory is an extra; answer without it rather than fail the turn
+        logger.exception(f"Memory recall failed for conversation {conversation.id}")
+        return inputs
+    return {**inputs, "memory": memory.memory_messages(turns)}
+
+
+async def _awith_memory(inputs, config):
+    return await sync_to_async(_with_memory)(inputs, config)
+
+
+def _build_runnable():
+    # now initialize the conversation chain
+    return RunnableLambda(_with_memory, afunc=_awith_memory) | prompt_template | CachedChatModel(registry.get('llm'))
+
+
+def _build_question_answer_chain():
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    return create_stuff_documents_chain(CachedChatModel(registry.get('llm')), rag_prompt)
+
+
+def _build_rag_chain():
+    # Like langchain's create_retrieval_chain, but retrieval is a plain
+    # RunnableLambda: a RunnableParallel would run it on a worker thread, away
+    # from the request's database connection
+    from langchain_core.runnables import RunnablePassthrough
+    retriever = registry.get('history_aware_retriever')
+
+    def with_context(inputs, config):
+        return {**inputs, "context": retriever.invoke(inputs, config)}
+
+    async def awith_context(inputs, config):
+        return {**inputs, "context": await retriever.ainvoke(inputs, config)}
 
-question_answer_chain = create_stuff_documents_chain(llm, rag_prompt)
-rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    return (
+        RunnableLambda(with_context, afunc=awith_context)
+        | RunnablePassthrough.assign(answer=registry.get('question_answer_chain'))
+    ).with_config(run_name="retrieval_chain")
 
 
 
-from .custom_chat_history import DjangoChatMessageHistory
+from .custom_chat_history import AsyncDjangoChatMessageHistory
+from . import memory
+from .response_cache import CachedChatModel
+
+# The Conversation the view already fetched, for `get_session_history`
+_prefetched_conversation = contextvars.ContextVar('chat_prefetched_conversation', default=None)
+
 
 def get_session_history(session_id):
     """
     Retrieves the message history for a given session ID.
+
+    Reuses the Conversation the view already fetched (see `history_config`),
+    which saves the history a lookup of its own.
     """
+    conversation = _prefetched_conversation.get()
+    if conversation is not None and str(conversation.id) != str(session_id):
+        conversation = None
     try:
         # Make sure `session_id` is converted to integer if required
         conversation_id = int(session_id)  # Ensure that session_id is correctly converted or used
-        return DjangoChatMessageHistory(conversation_id=conversation_id)
+        # The async subclass also serves sync chains, and lets `ainvoke`/`astream`
+        # read and write history on the async ORM without thread hops.
+        history = AsyncDjangoChatMessageHistory(conversation_id=conversation_id, conversation=conversation)
     except ValueError:
         raise ValueError(f"Invalid session ID format: {session_id}")
 
+    if not _in_event_loop():
+        # Sync chains read history from a throwaway worker thread; load it here
+        # instead, in one query on the request's own connection.
+        history.prefetch()
+    return history
 
-runnable_with_history = RunnableWithMessageHistory(
-    runnable,
-    get_session_history,
-    input_messages_key="input",
-    history_messages_key="history",
-    #output_messages_key="answer",
-)
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def history_config(conversation):
+    """
+    Runnable config for `runnable_with_history` for the given conversation.
+    """
+    return {"configurable": {"session_id": str(conversation.id), "conversation": conversation}}
+
+
+class ChatHistoryRunnable(RunnableWithMessageHistory):
+    """
+    RunnableWithMessageHistory keyed by `session_id` only. An optional,
+    undeclared `conversation` config key is handed to `get_session_history`,
+    so callers that pass just the session ID keep working.
+    """
+
+    def _merge_configs(self, *configs):
+        conversation = None
+        for config in configs:
+            conversation = ((config or {}).get("configurable") or {}).get("conversation", conversation)
+        token = _prefetched_conversation.set(conversation)
+        try:
+            return super()._merge_configs(*configs)
+        finally:
+            _prefetched_conversation.reset(token)
+
+
+def _build_runnable_with_history():
+    return ChatHistoryRunnable(
+        registry.get('runnable'),
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="history",
+    )
+
+
+def _build_rag_chain_with_history():
+    # Same history as `runnable_with_history`; the chain returns a dict whose
+    # "answer" is stored and whose "context" holds the retrieved documents
+    return ChatHistoryRunnable(
+        registry.get('rag_chain'),
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+        output_messages_key="answer",
+    )
+
+
+def chain_for(use_rag):
+    """
+    The chain answering a request: `rag_chain_with_history` when `use_rag`,
+    otherwise `runnable_with_history`. Both take {"input": ...} and
+    `history_config(conversation)`; read their output with `answer_text`.
+    """
+    return registry.get('rag_chain_with_history' if use_rag else 'runnable_with_history')
+
+
+def answer_text(output):
+    """
+    The answer text of a `chain_for` output or streamed chunk.
+    """
+    if isinstance(output, dict):
+        return output.get("answer", "")
+    return output.content
+
+
+def answer_sources(output):
+    """
+    Sources of the documents a RAG answer was based on (empty otherwise).
+    """
+    if not isinstance(output, dict):
+        return []
+    return [doc.metadata.get("source") for doc in output.get("context", [])]
+
+
+_LAZY_COMPONENTS = {
+    'llm': _build_llm,
+    'embedding': _build_embedding,
+    'vstore': _build_vstore,
+    'retriever': _build_retriever,
+    'history_aware_retriever': _build_history_aware_retriever,
+    'question_answer_chain': _build_question_answer_chain,
+    'rag_chain': _build_rag_chain,
+    'runnable': _build_runnable,
+    'runnable_with_history': _build_runnable_with_history,
+    'rag_chain_with_history': _build_rag_chain_with_history,
+}
+for _name, _factory in _LAZY_COMPONENTS.items():
+    registry.register(_name, _factory)
 
 
+def __getattr__(name):
+    # Keep `chatbot.llm`, `chatbot.runnable_with_history`, ... working as before
+    if name in _LAZY_COMPONENTS:
+        return registry.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
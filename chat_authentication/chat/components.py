@@ -0,0 +1,148 @@
+# chat/components.py
+"""
+Lazy registry for expensive process-wide resources (LLM clients, vector
+stores, local models).
+
+Modules register a factory under a name at import time; nothing is built until
+the first `registry.get(name)`. Plain Django commands (`migrate`, test
+collection, ...) therefore never pay for model downloads or network clients.
+Server processes that want everything hot set CHAT_WARMUP_ON_START: the app
+then builds CHAT_WARMUP_COMPONENTS on a background thread at boot (see
+`start_warmup`), and `api/ready/` answers 200 once they are loaded. Without
+the warmup, components load on the first request and the probe passes.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentRegistry:
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+        # Not `_lock`, which a factory holds while it builds: the readiness
+        # probe must be able to read the warmup state meanwhile
+        self._warmup_lock = threading.Lock()
+        self._warmup = {'state': 'not started'}
+
+    def register(self, name, factory):
+        """
+        Register `factory` (a zero-argument callable) under `name`. An instance
+        already built or `set` under that name is kept until `reset`.
+        """
+        with self._lock:
+            self._factories[name] = factory
+
+    def get(self, name):
+        """
+        Return the component, building it on first use.
+        """
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        # RLock: factories may depend on other components
+        with self._lock:
+            if name not in self._instances:
+                try:
+                    factory = self._factories[name]
+                except KeyError:
+                    raise KeyError(f"Unknown component: {name}") from None
+                start = time.perf_counter()
+                self._instances[name] = factory()
+                logger.info(f"Loaded component '{name}' in {time.perf_counter() - start:.2f}s")
+            return self._instances[name]
+
+    def set(self, name, instance):
+        """
+        Replace a built component, e.g. with a fake in tests.
+        """
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, name=None):
+        """
+        Drop a built component (or all of them) so it is rebuilt on next use.
+        """
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def names(self):
+        return list(self._factories)
+
+    def status(self):
+        """
+        Returns:
+            dict: Component name -> whether it has been built.
+        """
+        return {name: self.is_loaded(name) for name in self._factories}
+
+    def warmup(self, names=None):
+        """
+        Build the given components (default: all registered ones).
+
+        Returns:
+            dict: Component name -> seconds spent building it (0 if already loaded).
+        """
+        timings = {}
+        for name in names or self.names():
+            start = time.perf_counter()
+            self.get(name)
+            timings[name] = time.perf_counter() - start
+        return timings
+
+
+    def start_warmup(self, names=None):
+        """
+        Run `warmup` on a daemon thread, so a server process can take
+        requests (and answer its readiness probe) while models load.
+
+        Returns:
+            threading.Thread: The started thread.
+        """
+        with self._warmup_lock:
+            self._warmup = {'state': 'running', 'components': list(names or self.names())}
+
+        def run():
+            try:
+                timings = self.warmup(names)
+            except Exception as e:
+                logger.exception("Component warmup failed")
+                with self._warmup_lock:
+                    self._warmup = {**self._warmup, 'state': 'failed', 'error': str(e)}
+            else:
+                with self._warmup_lock:
+                    self._warmup = {**self._warmup, 'state': 'done', 'seconds': timings}
+
+        thread = threading.Thread(target=run, name='chat-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def warmup_status(self):
+        """
+        Returns:
+            dict: The state of the boot warmup ('not started', 'running',
+                'done' or 'failed') and, when finished, timings or the error.
+        """
+        with self._warmup_lock:
+            return dict(self._warmup)
+
+
+registry = ComponentRegistry()
+
+
+def register_components():
+    """
+    Import the modules that register components. Their imports are cheap:
+    heavy libraries are only imported inside the factories.
+    """
+    from . import chatbot, gateway, titles  # noqa: F401
+    return registry
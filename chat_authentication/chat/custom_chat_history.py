@@ -1,35 +1,294 @@
 # chat/custom_chat_history.py
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from django.db import transaction  # For atomic operations
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
-from .models import Conversation, ChatMessage
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, SystemMessage
+from typing import Sequence
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+import logging
+from .components import registry
+from .history_cache import get_history_cache
+from .models import Conversation, ChatMessage, PREVIEW_LENGTH
+
+logger = logging.getLogger(__name__)
+
+
+# Rows read per query when only a token budget bounds the window
+HISTORY_BATCH_SIZE = 50
+# Each turn is stored as one row holding both the human and the AI message
+ROWS_PER_TURN = 1
+
+_DEFAULT = object()
+
+
+def _build_history_tokenizer():
+    """
+    Token counter for the history budget. Falls back to ~4 characters per
+    token when the tiktoken encoding is unavailable (e.g. offline).
+    """
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(settings.CHAT_HISTORY_TOKEN_ENCODING)
+    except Exception:
+        logger.warning("tiktoken encoding unavailable, estimating history tokens from length")
+        return lambda text: len(text) // 4 + 1
+    return lambda text: len(encoding.encode(text))
+
+
+registry.register('history_tokenizer', _build_history_tokenizer)
+
+
+class HistoryWindow:
+    """
+    Accumulates rows newest-first until the turn or token budget is reached,
+    then yields the kept messages in chronological order.
+    """
+
+    def __init__(self, max_turns=None, max_tokens=None):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.count_tokens = registry.get('history_tokenizer') if max_tokens else None
+        self.turns = 0
+        self.tokens = 0
+        self.full = False
+        self._newest_first = []
+
+    def feed(self, rows):
+        """
+        Consume (id, user_response, ai_response) rows in newest-first order.
+
+        Returns:
+            bool: True once the window is full and no older rows are needed.
+        """
+        for row_id, user_response, ai_response in rows:
+            # Walking backwards, a row's AI reply comes before its user message
+            for message in (
+                AIMessage(content=ai_response) if ai_response else None,
+                HumanMessage(content=user_response) if user_response else None,
+            ):
+                if message is None:
+                    continue
+                if self.max_tokens:
+                    cost = self.count_tokens(message.content)
+                    if self.tokens + cost > self.max_tokens:
+                        self.full = True
+                        return True
+                    self.tokens += cost
+                self._newest_first.append((row_id, message))
+                if isinstance(message, HumanMessage):
+                    self.turns += 1
+                    if self.max_turns and self.turns >= self.max_turns:
+                        self.full = True
+                        return True
+        return False
+
+    def batch_size(self):
+        """
+        Rows to fetch per query, or None to read everything in one go.
+        """
+        if self.max_turns:
+            return self.max_turns * ROWS_PER_TURN
+        if self.max_tokens:
+            return HISTORY_BATCH_SIZE
+        return None
+
+    def _kept(self):
+        kept = self._newest_first[::-1]
+        # Never start the window with a reply whose question was cut off
+        while kept and not isinstance(kept[0][1], HumanMessage):
+            kept.pop(0)
+        return kept
+
+    def messages(self):
+        return [message for _, message in self._kept()]
+
+    def rows(self):
+        """
+        The kept rows as chronological (id, user_response, ai_response) tuples,
+        the form the history cache stores.
+        """
+        rows = {}
+        for row_id, message in self._kept():
+            user_response, ai_response = rows.get(row_id, (None, None))
+            if isinstance(message, HumanMessage):
+                user_response = message.content
+            else:
+                ai_response = message.content
+            rows[row_id] = (user_response, ai_response)
+        return [(row_id, user, ai) for row_id, (user, ai) in rows.items()]
+
+    def start_row_id(self):
+        """
+        ID of the oldest row in the window, or None if the window is empty.
+        Older rows are what the rolling summary folds in.
+        """
+        kept = self._kept()
+        return kept[0][0] if kept else None
+
 
 class DjangoChatMessageHistory(BaseChatMessageHistory):
-    def __init__(self, conversation_id: int):
+    def __init__(self, conversation_id: int, conversation: Conversation = None,
+                 max_turns=_DEFAULT, max_tokens=_DEFAULT):
+        """
+        Args:
+            conversation_id (int): The conversation whose messages are stored.
+            conversation (Conversation, optional): The already-fetched
+                conversation. Saves a query for its rolling summary.
+            max_turns (int, optional): Most recent turns to load. Defaults to
+                CHAT_HISTORY_MAX_TURNS; None loads every turn.
+            max_tokens (int, optional): Token budget for loaded messages.
+                Defaults to CHAT_HISTORY_MAX_TOKENS; None disables the budget.
+        """
+        # Only keep the ID: the history is built by `get_session_history`, which
+        # RunnableWithMessageHistory also calls on the event loop for `ainvoke`,
+        # where sync ORM queries are not allowed.
         self.conversation_id = conversation_id
-        self.conversation = Conversation.objects.get(id=conversation_id)
+        self.conversation = conversation
+        self._prefetched = None
+        self.max_turns = settings.CHAT_HISTORY_MAX_TURNS if max_turns is _DEFAULT else max_turns
+        self.max_tokens = settings.CHAT_HISTORY_MAX_TOKENS if max_tokens is _DEFAULT else max_tokens
+
+    def _recent_rows(self):
+        """
+        Newest-first (id, user_response, ai_response) rows, sliced by the
+        caller so only the rows the window needs are fetched.
+        """
+        return (
+            ChatMessage.objects
+            .filter(conversation_id=self.conversation_id)
+            .order_by('-timestamp', '-id')
+            .values_list('id', 'user_response', 'ai_response')
+        )
+
+    def _summary_query(self):
+        return Conversation.objects.filter(id=self.conversation_id).values_list('summary', flat=True)
+
+    def _summary(self):
+        if not settings.CHAT_SUMMARY_ENABLED:
+            return None
+        if self.conversation is not None:
+            return self.conversation.summary
+        return self._summary_query().first()
+
+    def _to_rows(self, messages):
+        """
+        Pair each human message with the AI reply that follows it into one row.
+        An unpaired message gets a row of its own with the other column NULL.
+        """
+        rows = []
+        for message in messages:
+            if isinstance(message, HumanMessage):
+                rows.append(ChatMessage(conversation_id=self.conversation_id, user_response=message.content))
+            elif isinstance(message, AIMessage):
+                if rows and rows[-1].ai_response is None:
+                    rows[-1].ai_response = message.content
+                else:
+                    rows.append(ChatMessage(conversation_id=self.conversation_id, ai_response=message.content))
+        return rows
+
+    @staticmethod
+    def _with_summary(messages, summary):
+        """
+        Prepend the rolling summary of turns that fell out of the window.
+        """
+        if not summary:
+            return messages
+        return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + messages
+
+    @staticmethod
+    def _rows_to_messages(rows):
+        messages = []
+        for _, user_response, ai_response in rows:
+            if user_response:
+                messages.append(HumanMessage(content=user_response))
+            if ai_response:
+                messages.append(AIMessage(content=ai_response))
+        return messages
+
+    def _cache_entry(self, rows, summary):
+        """
+        Cache entry for the given window rows. The window limits are stored so
+        an entry built under other limits is never served.
+        """
+        return {'rows': rows, 'summary': summary, 'limits': (self.max_turns, self.max_tokens)}
+
+    def _usable(self, entry):
+        return entry is not None and entry.get('limits') == (self.max_turns, self.max_tokens)
+
+    def _entry_summary(self, entry):
+        # The conversation the view just fetched is at least as fresh as the cache
+        if not settings.CHAT_SUMMARY_ENABLED:
+            return None
+        if self.conversation is not None:
+            return self.conversation.summary
+        return entry['summary']
+
+    def _extend_entry(self, entry, rows):
+        """
+        Append newly stored rows to a cached window and trim it back to the
+        turn and token limits, without reading the database.
+        """
+        window = HistoryWindow(self.max_turns, self.max_tokens)
+        new_rows = [(row.id, row.user_response, row.ai_response) for row in rows]
+        window.feed(reversed(entry['rows'] + new_rows))
+        return self._cache_entry(window.rows(), entry['summary'])
 
     @property
     def messages(self) -> list[BaseMessage]:
         """
-        Retrieve all messages for the conversation from the database.
+        Retrieve the most recent messages of the conversation from the history
+        cache or the database, limited by the turn and token window and preceded
+        by the rolling summary of older turns.
         
         Returns:
-            List[BaseMessage]: A list of chat messages.
+            List[BaseMessage]: A list of chat messages, oldest first.
         """
-        # Fetch all messages related to this conversation from the database
-        messages = ChatMessage.objects.filter(conversation=self.conversation).order_by('timestamp')
-        chat_history = []
+        if self._prefetched is not None:
+            return list(self._prefetched)
+        cache = get_history_cache()
+        entry = cache.get(self.conversation_id)
+        if not self._usable(entry):
+            entry = self._cache_entry(self.load_window().rows(), self._summary())
+            cache.set(self.conversation_id, entry)
+        return self._with_summary(self._rows_to_messages(entry['rows']), self._entry_summary(entry))
 
-        for message in messages:
-            print(f"Message ID: {message.id}, Conversation ID: {message.conversation.id}, User: {message.user_response}, AI: {message.ai_response}")
-            if message.user_response:
-                chat_history.append(HumanMessage(content=message.user_response))
-            if message.ai_response:
-                chat_history.append(AIMessage(content=message.ai_response))
+    def prefetch(self) -> None:
+        """
+        Load the messages now, on the calling thread's DB connection.
 
-        return chat_history
+        RunnableWithMessageHistory reads `messages` from a worker thread of its
+        own, which would otherwise open a new DB connection every turn (and not
+        see the caller's open transaction).
+        """
+        self._prefetched = None
+        self._prefetched = self.messages
+
+    def load_window(self) -> HistoryWindow:
+        """
+        Read only the rows that fit the turn and token window.
+        """
+        window = HistoryWindow(self.max_turns, self.max_tokens)
+        rows = self._recent_rows()
+        batch_size = window.batch_size()
+        offset = 0
+        while True:
+            batch = list(rows[offset:offset + batch_size] if batch_size else rows)
+            if window.feed(batch) or not batch_size or len(batch) < batch_size:
+                break
+            offset += batch_size
+        return window
+
+    def window_start_row_id(self):
+        """
+        ID of the oldest row in the history window, or None if it is empty.
+        Served from the history cache when it holds a usable entry.
+        """
+        entry = get_history_cache().get(self.conversation_id)
+        if self._usable(entry):
+            return entry['rows'][0][0] if entry['rows'] else None
+        return self.load_window().start_row_id()
 
     def add_message(self, message: BaseMessage) -> None:
         """
@@ -38,15 +297,130 @@ class DjangoChatMessageHistory(BaseChatMessageHistory):
         Args:
             message (BaseMessage): A message object, either from the human or the AI.
         """
-        if isinstance(message, HumanMessage):
-            print(f"Storing User Message: {message.content}")  # Debugging print statement
-            ChatMessage.objects.create(conversation=self.conversation, user_response=message.content)
-        elif isinstance(message, AIMessage):
-            print(f"Storing AI Message: {message.content}")  # Debugging print statement
-            ChatMessage.objects.create(conversation=self.conversation, ai_response=message.content)
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Store the messages with a single INSERT; a complete turn is one row.
+
+        Args:
+            messages (Sequence[BaseMessage]): Human and/or AI messages, in order.
+        """
+        rows = self._to_rows(messages)
+        self._prefetched = None
+        if not rows:
+            return
+        self._store_rows(rows)
+
+        # Write through: drop the entry now so nothing in this transaction reads
+        # it, and store the extended window once the rows are committed.
+        cache = get_history_cache()
+        entry = cache.get(self.conversation_id)
+        cache.delete(self.conversation_id)
+        if self._usable(entry) and all(row.id is not None for row in rows):
+            entry = self._extend_entry(entry, rows)
+            transaction.on_commit(lambda: cache.set(self.conversation_id, entry))
+
+    def _store_rows(self, rows):
+        """
+        Insert the rows and update the conversation's list fields in one
+        transaction. Inside an outer transaction no savepoint is needed: a
+        failure here aborts that transaction anyway.
+        """
+        now = timezone.now()
+        last = rows[-1]
+        with transaction.atomic(savepoint=False):
+            ChatMessage.objects.bulk_create(rows)
+            Conversation.objects.filter(id=self.conversation_id).update(
+                last_activity=now,
+                last_message_at=now,
+                message_count=F('message_count') + sum(
+                    bool(row.user_response) + bool(row.ai_response) for row in rows
+                ),
+                last_message_preview=(last.ai_response or last.user_response or '')[:PREVIEW_LENGTH],
+            )
+
+    def _clear_rows(self):
+        with transaction.atomic(savepoint=False):
+            ChatMessage.objects.filter(conversation_id=self.conversation_id).delete()
+            Conversation.objects.filter(id=self.conversation_id).update(
+                summary='', summarized_through=0, last_activity=timezone.now(),
+                last_message_at=None, message_count=0, last_message_preview='',
+            )
 
     def clear(self) -> None:
         """
         Clear all messages from the conversation history in the database.
         """
-        ChatMessage.objects.filter(conversation=self.conversation).delete()
+        self._prefetched = None
+        self._clear_rows()
+        get_history_cache().delete(self.conversation_id)
+
+
+class AsyncDjangoChatMessageHistory(DjangoChatMessageHistory):
+    """
+    DjangoChatMessageHistory with native async methods on Django's async ORM.
+
+    Without these, LangChain's async chains (`ainvoke`, `astream`) run the sync
+    methods in a thread executor. Only the writes, which need a transaction,
+    still hop to a thread.
+    """
+
+    async def aget_messages(self) -> list[BaseMessage]:
+        """
+        Retrieve the windowed messages and rolling summary without leaving the
+        event loop.
+
+        Returns:
+            List[BaseMessage]: A list of chat messages, oldest first.
+        """
+        cache = get_history_cache()
+        entry = await cache.aget(self.conversation_id)
+        if self._usable(entry):
+            return self._with_summary(self._rows_to_messages(entry['rows']), self._entry_summary(entry))
+
+        if settings.CHAT_SUMMARY_ENABLED and self.conversation is None:
+            summary = await self._summary_query().afirst()
+        else:
+            summary = self._summary()
+        if self.max_tokens and not registry.is_loaded('history_tokenizer'):
+            # Building it loads the tiktoken encoding (file or network I/O)
+            await sync_to_async(registry.get, thread_sensitive=False)('history_tokenizer')
+        window = HistoryWindow(self.max_turns, self.max_tokens)
+        rows = self._recent_rows()
+        batch_size = window.batch_size()
+        offset = 0
+        while True:
+            batch = [row async for row in (rows[offset:offset + batch_size] if batch_size else rows)]
+            if window.feed(batch) or not batch_size or len(batch) < batch_size:
+                break
+            offset += batch_size
+        await cache.aset(self.conversation_id, self._cache_entry(window.rows(), summary))
+        return self._with_summary(window.messages(), summary)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Store the messages with a single INSERT; a complete turn is one row.
+
+        Args:
+            messages (Sequence[BaseMessage]): Human and/or AI messages, in order.
+        """
+        rows = self._to_rows(messages)
+        if not rows:
+            return
+        # The async ORM has no transactions; run the two writes in one on a thread
+        await sync_to_async(self._store_rows)(rows)
+
+        cache = get_history_cache()
+        entry = await cache.aget(self.conversation_id)
+        if self._usable(entry) and all(row.id is not None for row in rows):
+            await cache.aset(self.conversation_id, self._extend_entry(entry, rows))
+        else:
+            await cache.adelete(self.conversation_id)
+
+    async def aclear(self) -> None:
+        """
+        Clear all messages from the conversation history in the database.
+        """
+        await sync_to_async(self._clear_rows)()
+        await get_history_cache().adelete(self.conversation_id)
@@ -0,0 +1,195 @@
+# chat/embedding_cache.py
+"""
+Persistent cache in front of an embedding model.
+
+CachedEmbeddings wraps any LangChain `Embeddings` (OpenAIEmbeddings by default,
+see chat.chatbot) and is itself one, so vector stores, retrievers and
+`manage.py ingest` use it unchanged. Vectors are keyed by model name and the
+SHA-256 of the text and looked up in two tiers:
+
+    memory - a per-process LRU of recent vectors, held as float32 arrays
+    disk   - a local SQLite file shared by the processes on the host
+
+Only the texts found in neither are sent to the model, deduplicated, in one
+batched request.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .vectors import from_bytes, to_bytes
+
+
+class SqliteEmbeddingStore:
+    """
+    Key -> float32 vector table in a SQLite file, one connection per thread.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            # Readers don't block the writer (several workers share the file)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get_many(self, keys):
+        """
+        Returns:
+            dict: Key -> float32 vector (np.ndarray) for the keys that are stored.
+        """
+        found = {}
+        db = self._connection()
+        keys = list(keys)
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch,
+            )
+            found.update((key, from_bytes(vector)) for key, vector in rows)
+        return found
+
+    def set_many(self, items):
+        with self._connection() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, to_bytes(vector)) for key, vector in items.items()],
+            )
+
+    def clear(self):
+        with self._connection() as db:
+            db.execute("DELETE FROM embeddings")
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embedding, store=None, max_entries=10000, model_name=None):
+        """
+        Args:
+            embedding (Embeddings): The model to call on cache misses.
+            store (SqliteEmbeddingStore): The disk tier, or None for memory only.
+            max_entries (int): Size of the in-memory LRU.
+            model_name (str): Part of every key; defaults to the wrapped
+                model's `model` attribute or class name.
+        """
+        self.embedding = embedding
+        self.store = store
+        self.max_entries = max_entries
+        self.model_name = model_name or getattr(embedding, 'model', None) or type(embedding).__name__
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, kind, text):
+        # Query and document embeddings may differ (instruction-tuned models)
+        return f"{self.model_name}:{kind}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, items):
+        # float32 arrays take about a ninth of the memory of lists of floats
+        with self._lock:
+            for key, vector in items.items():
+                self._memory[key] = np.asarray(vector, dtype=np.float32)
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """
+        Returns:
+            dict: Key -> float32 vector for the keys found in memory or on disk.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.memory_hits += len(found)
+        missing = [key for key in keys if key not in found]
+        if missing and self.store is not None:
+            on_disk = self.store.get_many(missing)
+            self._remember(on_disk)
+            found.update(on_disk)
+            with self._lock:
+                self.disk_hits += len(on_disk)
+        return found
+
+    def _save(self, computed):
+        self._remember(computed)
+        if self.store is not None:
+            self.store.set_many(computed)
+        with self._lock:
+            self.misses += len(computed)
+
+    def _misses(self, keys, texts, found):
+        # Each distinct missing text once
+        return {key: text for key, text in zip(keys, texts) if key not in found}
+
+    def embed_documents(self, texts):
+        keys = [self._key('doc', text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        misses = self._misses(keys, texts, found)
+        if misses:
+            computed = dict(zip(misses, self.embedding.embed_documents(list(misses.values()))))
+            self._save(computed)
+            found.update(computed)
+        return [np.asarray(found[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_query(self, text):
+        key = self._key('query', text)
+        found = self._lookup([key])
+        if key not in found:
+            found[key] = self.embedding.embed_query(text)
+            self._save({key: found[key]})
+        return np.asarray(found[key], dtype=np.float32).tolist()
+
+    async def aembed_documents(self, texts):
+        keys = [self._key('doc', text) for text in texts]
+        found = await asyncio.to_thread(self._lookup, list(dict.fromkeys(keys)))
+        misses = self._misses(keys, texts, found)
+        if misses:
+            computed = dict(zip(misses, await self.embedding.aembed_documents(list(misses.values()))))
+            await asyncio.to_thread(self._save, computed)
+            found.update(computed)
+        return [np.asarray(found[key], dtype=np.float32).tolist() for key in keys]
+
+    async def aembed_query(self, text):
+        key = self._key('query', text)
+        found = await asyncio.to_thread(self._lookup, [key])
+        if key not in found:
+            found[key] = await self.embedding.aembed_query(text)
+            await asyncio.to_thread(self._save, {key: found[key]})
+        return np.asarray(found[key], dtype=np.float32).tolist()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counts and the overall hit rate.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+            }
@@ -0,0 +1,159 @@
+# chat/fakes.py
+"""
+Local stand-ins for the hosted models, for tests, latency experiments and
+`manage.py loadtest`. With CHAT_FAKE_MODELS set, the chat model, embeddings
+and title generator all come from here (see chat.chatbot and chat.titles).
+
+`LatencyFakeChatModel` answers from a list of canned responses, streamed word
+by word, after an injected delay before the first token (and optionally
+between tokens). Calls can be scripted to fail, so timeouts, hedging, retries
+and fallbacks (see chat.resilience) can be exercised without the network.
+`HashEmbeddings` and `fake_title` are deterministic and instant.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from typing import Any, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class FakeLLMError(Exception):
+    """
+    Error raised by a scripted fake failure; `status_code` mimics an HTTP error.
+    """
+
+    def __init__(self, message="fake upstream error", status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LatencyFakeChatModel(BaseChatModel):
+    """
+    Fake chat model with injected latency.
+
+    Call N (counting from 0 across invoke/stream, sync and async) uses
+    `responses[N % len]`, waits `first_token_latency[N % len]` seconds before
+    its first token and `token_latency` seconds between tokens, and raises
+    `failures[N % len]` instead when that entry is not None.
+    """
+
+    responses: List[str] = ["This is a fake answer."]
+    first_token_latency: List[float] = [0.0]
+    token_latency: float = 0.0
+    failures: List[Any] = [None]
+    model_name: str = "fake-latency"
+    _calls: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return "latency-fake"
+
+    @property
+    def calls(self):
+        return self._calls
+
+    def _next_call(self):
+        with self._lock:
+            index = self._calls
+            self._calls += 1
+
+        def pick(values):
+            return values[index % len(values)]
+
+        return pick(self.responses), pick(self.first_token_latency), pick(self.failures)
+
+    @staticmethod
+    def _tokens(response):
+        words = response.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        response = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        parts = [chunk.message.content async for chunk in self._astream(messages, stop, run_manager, **kwargs)]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(parts)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        response, latency, failure = self._next_call()
+        time.sleep(latency)
+        if failure is not None:
+            raise failure
+        for i, token in enumerate(self._tokens(response)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        response, latency, failure = self._next_call()
+        await asyncio.sleep(latency)
+        if failure is not None:
+            raise failure
+        for i, token in enumerate(self._tokens(response)):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+DEFAULT_RESPONSE = (
+    "This is a canned answer from the fake chat model. It streams one word at "
+    "a time so that time to first token and tokens per second can be tuned "
+    "to match the hosted model without calling it."
+)
+
+
+def fake_chat_model(config):
+    """
+    Build the fake chat model described by CHAT_FAKE_MODELS.
+    """
+    tokens_per_second = config.get('TOKENS_PER_SECOND')
+    return LatencyFakeChatModel(
+        responses=config.get('RESPONSES') or [DEFAULT_RESPONSE],
+        first_token_latency=[config.get('TTFT', 0.0)],
+        token_latency=1 / tokens_per_second if tokens_per_second else 0.0,
+    )
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Fake embeddings: each word is hashed to a signed dimension and the sum is
+    normalized, so texts that share words are similar.
+    """
+
+    def __init__(self, size=1536):
+        self.size = size
+        self.model = "fake-hash"
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.size] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if not norm:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def fake_title(prompt):
+    """
+    The first few words of the prompt, title-cased.
+    """
+    words = re.findall(r"\w+", prompt)[:6]
+    return " ".join(words).title() or "New Conversation"
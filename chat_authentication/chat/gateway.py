@@ -0,0 +1,265 @@
+# chat/gateway.py
+"""
+Admission control for chat turns, which each make one or more LLM calls.
+
+The gateway caps how many turns a process runs at once (MAX_CONCURRENCY).
+Turns beyond the cap wait in per-user queues that are served round-robin, so
+a burst from one user cannot starve the others. A turn is refused at once,
+with a Retry-After estimate, when the queues are full (MAX_QUEUE overall,
+MAX_QUEUE_PER_USER per user), and after QUEUE_TIMEOUT seconds of waiting.
+Views acquire a slot before touching the database, so a refused turn writes
+nothing.
+
+Sync (thread) and async (event loop) callers share the same slots.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from .components import registry
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayOverloaded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, user_id, loop=None):
+        self.user_id = user_id
+        self.granted = False
+        self.queued_at = time.perf_counter()
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency=8, max_queue=64, max_queue_per_user=2, queue_timeout=10):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queues = OrderedDict()  # user_id -> deque of _Waiter, in serving order
+        self._queued = 0
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._hold_average = 1.0  # seconds a turn holds its slot (moving average)
+
+    def _retry_after(self):
+        # Time for the queue ahead to drain through the available slots
+        return max(1, math.ceil(self._hold_average * (self._queued + 1) / max(1, self.max_concurrency)))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        retry_after = self._retry_after()
+        logger.warning(f"LLM gateway refused a turn ({reason}), retry after {retry_after}s")
+        return GatewayOverloaded(reason, retry_after)
+
+    def _enqueue(self, user_id, loop=None):
+        """
+        Take a free slot (returns None) or queue a waiter for one.
+
+        Raises:
+            GatewayOverloaded: If the queues are full.
+        """
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queued:
+                self._active += 1
+                self.admitted += 1
+                return None
+            queue = self._queues.get(user_id)
+            if self._queued >= self.max_queue:
+                raise self._reject("queue full")
+            if queue is not None and len(queue) >= self.max_queue_per_user:
+                raise self._reject("too many queued turns for this user")
+            waiter = _Waiter(user_id, loop)
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+            return waiter
+
+    def _granted(self, waiter):
+        with self._lock:
+            wait = time.perf_counter() - waiter.queued_at
+            self.admitted += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def _cancel(self, waiter):
+        """
+        Give up waiting. Returns False if the slot was granted meanwhile (the
+        caller then holds it).
+        """
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.user_id]
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.user_id]
+            self._queued -= 1
+            self.rejected += 1
+            return True
+
+    def acquire(self, user_id):
+        """
+        Wait for a slot for one of `user_id`'s turns.
+
+        Raises:
+            GatewayOverloaded: If the turn is refused or waited too long.
+        """
+        waiter = self._enqueue(user_id)
+        if waiter is None:
+            return
+        if not waiter.event.wait(self.queue_timeout) and self._cancel(waiter):
+            raise GatewayOverloaded("timed out waiting for a slot", self._retry_after())
+        self._granted(waiter)
+
+    async def aacquire(self, user_id):
+        """
+        Async `acquire`; waits on the event loop, not a thread.
+        """
+        waiter = self._enqueue(user_id, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._cancel(waiter):
+                raise GatewayOverloaded("timed out waiting for a slot", self._retry_after()) from None
+        except asyncio.CancelledError:
+            # Client went away: hand back the slot if it was already ours
+            if not self._cancel(waiter):
+                self.release()
+            raise
+        self._granted(waiter)
+
+    def release(self, held_for=None):
+        """
+        Free a slot, handing it to the next user in round-robin order.
+
+        Args:
+            held_for (float): Seconds the slot was held, for Retry-After estimates.
+        """
+        with self._lock:
+            if held_for is not None:
+                self._hold_average = 0.9 * self._hold_average + 0.1 * held_for
+            if not self._queues:
+                self._active -= 1
+                return
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            # The user goes to the back of the rotation
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            self._queued -= 1
+            waiter.granted = True
+        waiter.wake()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Slots in use, queue depth (now and peak), turns admitted and
+                refused, and queue wait times.
+        """
+        with self._lock:
+            waited = self.admitted or 1
+            return {
+                'active': self._active,
+                'max_concurrency': self.max_concurrency,
+                'queue_depth': self._queued,
+                'max_queue_depth': self.max_queue_depth,
+                'queued_users': len(self._queues),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'average_wait_seconds': self.total_wait / waited,
+                'max_wait_seconds': self.max_wait,
+            }
+
+
+class Slot:
+    """
+    A held gateway slot; release it once (more calls are ignored).
+    """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.gateway.release(time.perf_counter() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def acquire_slot(user):
+    """
+    Returns:
+        Slot: A held slot for one of the user's turns.
+
+    Raises:
+        GatewayOverloaded: If the turn is refused.
+    """
+    gateway = registry.get('llm_gateway')
+    gateway.acquire(user.id)
+    return Slot(gateway)
+
+
+async def aacquire_slot(user):
+    gateway = registry.get('llm_gateway')
+    await gateway.aacquire(user.id)
+    return Slot(gateway)
+
+
+def _build_llm_gateway():
+    config = settings.CHAT_LLM_GATEWAY
+    return LLMGateway(
+        max_concurrency=config['MAX_CONCURRENCY'],
+        max_queue=config['MAX_QUEUE'],
+        max_queue_per_user=config['MAX_QUEUE_PER_USER'],
+        queue_timeout=config['QUEUE_TIMEOUT'],
+    )
+
+
+registry.register('llm_gateway', _build_llm_gateway)
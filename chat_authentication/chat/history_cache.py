@@ -0,0 +1,193 @@
+# chat/history_cache.py
+"""
+Cache of loaded conversation histories, keyed by conversation ID.
+
+An entry holds the rows of the current history window (chronological
+`(id, user_response, ai_response)` tuples) and the rolling summary, so a hot
+conversation is served without reading Postgres. `DjangoChatMessageHistory`
+writes new turns through to the cached entry; `clear()`, summary updates and
+conversation deletes invalidate it.
+
+Backends (`CHAT_HISTORY_CACHE['BACKEND']`):
+    'null'   - no caching, every read goes to the database (the default).
+    'local'  - in-process LRU bounded by entry count and bytes. Only for a
+               single worker process: other workers' writes never reach it.
+    'django' - a Django cache alias (Redis, Memcached, ...) shared by workers.
+"""
+from collections import OrderedDict
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .components import registry
+
+# Rough per-row overhead of the tuple and its ints, on top of the text
+_ROW_OVERHEAD_BYTES = 100
+
+
+def entry_size(entry):
+    """
+    Approximate memory footprint of a cache entry in bytes.
+    """
+    size = len(entry.get('summary') or '')
+    for _, user_response, ai_response in entry['rows']:
+        size += len(user_response or '') + len(ai_response or '') + _ROW_OVERHEAD_BYTES
+    return size
+
+
+class LocalHistoryCache:
+    """
+    Thread-safe in-process LRU, bounded by entry count and total bytes.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation_id):
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return entry
+
+    def set(self, conversation_id, entry):
+        size = entry_size(entry)
+        with self._lock:
+            self._discard(conversation_id)
+            if size > self.max_bytes:
+                return
+            self._entries[conversation_id] = entry
+            self._sizes[conversation_id] = size
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._discard(conversation_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def _discard(self, conversation_id):
+        if self._entries.pop(conversation_id, None) is not None:
+            self._bytes -= self._sizes.pop(conversation_id)
+
+    # The local cache never blocks on I/O, so the async API is the sync one
+    async def aget(self, conversation_id):
+        return self.get(conversation_id)
+
+    async def aset(self, conversation_id, entry):
+        self.set(conversation_id, entry)
+
+    async def adelete(self, conversation_id):
+        self.delete(conversation_id)
+
+
+class DjangoHistoryCache:
+    """
+    Stores entries in a Django cache alias so every worker sees the same
+    write-through updates and invalidations.
+    """
+
+    def __init__(self, alias='default', timeout=3600, key_prefix='chat-history'):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, conversation_id):
+        return f"{self.key_prefix}:{conversation_id}"
+
+    def get(self, conversation_id):
+        return self.cache.get(self._key(conversation_id))
+
+    def set(self, conversation_id, entry):
+        self.cache.set(self._key(conversation_id), entry, self.timeout)
+
+    def delete(self, conversation_id):
+        self.cache.delete(self._key(conversation_id))
+
+    def clear(self):
+        # Entries expire on their own; never flush a shared cache alias
+        pass
+
+    async def aget(self, conversation_id):
+        return await self.cache.aget(self._key(conversation_id))
+
+    async def aset(self, conversation_id, entry):
+        await self.cache.aset(self._key(conversation_id), entry, self.timeout)
+
+    async def adelete(self, conversation_id):
+        await self.cache.adelete(self._key(conversation_id))
+
+
+class NullHistoryCache:
+    """
+    Used for the 'null' backend or when CHAT_HISTORY_CACHE is None: every read
+    goes to the database.
+    """
+
+    def get(self, conversation_id):
+        return None
+
+    def set(self, conversation_id, entry):
+        pass
+
+    def delete(self, conversation_id):
+        pass
+
+    def clear(self):
+        pass
+
+    async def aget(self, conversation_id):
+        return None
+
+    async def aset(self, conversation_id, entry):
+        pass
+
+    async def adelete(self, conversation_id):
+        pass
+
+
+def _build_history_cache():
+    options = settings.CHAT_HISTORY_CACHE
+    backend = options.get('BACKEND', 'null') if options else 'null'
+    if backend == 'null':
+        return NullHistoryCache()
+    if backend == 'local':
+        return LocalHistoryCache(
+            max_entries=options.get('MAX_ENTRIES', 1000),
+            max_bytes=options.get('MAX_BYTES', 64 * 1024 * 1024),
+        )
+    if backend == 'django':
+        return DjangoHistoryCache(
+            alias=options.get('ALIAS', 'default'),
+            timeout=options.get('TIMEOUT', 3600),
+        )
+    raise ValueError(f"Unknown CHAT_HISTORY_CACHE backend: {backend}")
+
+
+registry.register('history_cache', _build_history_cache)
+
+
+def get_history_cache():
+    return registry.get('history_cache')
@@ -0,0 +1,214 @@
+# chat/ingest.py
+"""
+Incremental document ingestion into a local retrieval collection
+(`manage.py ingest`).
+
+Sources stream through a pipeline of generators, so only a few batches are in
+memory at a time:
+
+    load (PDF pages, web pages, text files)
+    -> split (RecursiveCharacterTextSplitter)
+    -> skip chunks the collection already has (SHA-256 of the content)
+    -> batch -> embed (bounded number of batches in flight)
+    -> upsert (one INSERT per batch)
+
+Re-running on the same corpus embeds and writes only new or changed chunks,
+and removes the chunks of a source that it no longer contains, once the
+source's new chunks have been written. All database
+work stays on the calling thread; only embedding requests run in the pool.
+"""
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from .models import DocumentChunk
+from .retrievers import chunk_source, content_hash
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 256
+EMBED_CONCURRENCY = 4
+
+
+class IngestReport:
+    """
+    Counters of an ingestion run.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sources = 0
+        self.failed_sources = 0
+        self.chunks = 0
+        self.skipped = 0
+        self.embedded = 0
+        self.removed = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def rate(self):
+        """
+        Chunks processed (embedded or skipped) per second.
+        """
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.sources} source(s) ({self.failed_sources} failed), {self.chunks} chunk(s): "
+            f"{self.embedded} embedded, {self.skipped} unchanged, {self.removed} removed "
+            f"in {self.elapsed:.1f}s ({self.rate():.1f} chunks/s)"
+        )
+
+
+def expand_sources(sources):
+    """
+    Yield URLs and file paths, walking directories recursively.
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield source
+
+
+def load_source(source):
+    """
+    Yield the Documents of one source: one per page for PDFs and web pages,
+    one for any other file (read as UTF-8 text).
+    """
+    from langchain_core.documents import Document
+
+    if source.startswith(('http://', 'https://')):
+        from langchain_community.document_loaders import WebBaseLoader
+        yield from WebBaseLoader(source).lazy_load()
+    elif source.lower().endswith('.pdf'):
+        from pypdf import PdfReader
+        for number, page in enumerate(PdfReader(source).pages):
+            yield Document(page_content=page.extract_text() or '', metadata={'source': source, 'page': number})
+    else:
+        with open(source, encoding='utf-8', errors='replace') as f:
+            yield Document(page_content=f.read(), metadata={'source': source})
+
+
+def new_chunks(collection, sources, splitter, report, prunes=None):
+    """
+    Yield the chunks of `sources` that `collection` does not have yet. Once a
+    source has been read completely, its chunks that are gone are appended to
+    `prunes` (if given) as `(chunks yielded so far, source key, hashes)`, to
+    be deleted once those chunks are stored. A source that fails to load is
+    logged and skipped, and keeps its chunks.
+    """
+    yielded = 0
+    for source in expand_sources(sources):
+        report.sources += 1
+        key = chunk_source({'source': source})
+        # Served by chat_chunk_source_hash_uniq
+        stored = set(
+            DocumentChunk.objects.filter(collection=collection, source=key).values_list('content_hash', flat=True)
+        )
+        seen = set()
+        try:
+            for document in load_source(source):
+                for chunk in splitter.split_documents([document]):
+                    chunk.metadata['source'] = source
+                    digest = content_hash(chunk.page_content)
+                    report.chunks += 1
+                    if digest in stored or digest in seen:
+                        report.skipped += 1
+                        seen.add(digest)
+                        continue
+                    seen.add(digest)
+                    yielded += 1
+                    yield chunk
+        except Exception:
+            logger.exception(f"Failed to ingest {source}")
+            report.failed_sources += 1
+            continue
+
+        stale = stored - seen
+        if prunes is not None and stale:
+            prunes.append((yielded, key, stale))
+
+
+def prune_chunks(collection, prunes, stored, report):
+    """
+    Delete the stale chunks queued by `new_chunks` for sources whose new
+    chunks are all among the first `stored` ones, so a source whose upsert
+    fails keeps its old chunks.
+    """
+    while prunes and prunes[0][0] <= stored:
+        _, key, stale = prunes.popleft()
+        report.removed += DocumentChunk.objects.filter(
+            collection=collection, source=key, content_hash__in=stale,
+        ).delete()[0]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def embed_batches(batches, embedding, concurrency):
+    """
+    Embed batches in a thread pool with at most `concurrency` requests in
+    flight, yielding (batch, vectors) in input order.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chat-ingest') as executor:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append((batch, executor.submit(embedding.embed_documents, [c.page_content for c in batch])))
+            if len(in_flight) >= concurrency:
+                batch, future = in_flight.popleft()
+                yield batch, future.result()
+        while in_flight:
+            batch, future = in_flight.popleft()
+            yield batch, future.result()
+
+
+def ingest(vstore, sources, splitter=None, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+           prune=True, progress=None):
+    """
+    Ingest `sources` (file paths, directories, URLs) into a DjangoVectorStore.
+
+    Args:
+        vstore (DjangoVectorStore): Target collection and embedding model.
+        splitter (TextSplitter): Defaults to a RecursiveCharacterTextSplitter
+            with CHUNK_SIZE/CHUNK_OVERLAP.
+        batch_size (int): Chunks per embedding request and per INSERT.
+        concurrency (int): Embedding requests in flight at once.
+        prune (bool): Delete chunks that are no longer in their source.
+        progress (callable): Called with the report after every batch.
+
+    Returns:
+        IngestReport: What was done.
+    """
+    if splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    report = IngestReport()
+    prunes = deque() if prune else None
+    chunks = new_chunks(vstore.collection, sources, splitter, report, prunes=prunes)
+    for batch, vectors in embed_batches(batched(chunks, batch_size), vstore.embedding, concurrency):
+        vstore.upsert([c.page_content for c in batch], [c.metadata for c in batch], vectors)
+        report.embedded += len(batch)
+        if prune:
+            prune_chunks(vstore.collection, prunes, report.embedded, report)
+        if progress is not None:
+            progress(report)
+    if prune:
+        # Sources read after the last batch, or that had nothing new
+        prune_chunks(vstore.collection, prunes, report.embedded, report)
+    logger.info(f"Ingested into {vstore.collection}: {report}")
+    return report
@@ -0,0 +1,265 @@
+# chat/jobs.py
+"""
+DB-backed background job queue.
+
+Jobs are rows of `BackgroundJob`. They are picked up either by the in-process
+thread pool (`CHAT_JOB_WORKER_THREADS` > 0), which is kicked when the enqueuing
+transaction commits, or by a dedicated `manage.py run_jobs` worker process.
+Claiming is a conditional UPDATE, so any number of threads and processes can
+share the queue without processing a job twice. A failed job is retried with
+exponential backoff (its `run_after` moves into the future), and kinds listed
+in JOB_FAILURE_HANDLERS get a fallback once the last attempt has failed.
+Workers delete finished jobs after their retention period (`purge_finished`).
+"""
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+# Dotted paths keep handler modules (and the models they load) unimported
+# until a job of that kind actually runs.
+JOB_HANDLERS = {
+    BackgroundJob.KIND_TITLE: 'chat.titles.run_title_job',
+    BackgroundJob.KIND_SUMMARY: 'chat.summary.run_summary_job',
+    BackgroundJob.KIND_EMBED: 'chat.memory.run_embed_job',
+}
+# Called with the job after its final failed attempt
+JOB_FAILURE_HANDLERS = {
+    BackgroundJob.KIND_TITLE: 'chat.titles.fallback_title_job',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_purge = None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_JOB_WORKER_THREADS,
+                thread_name_prefix='chat-jobs',
+            )
+        return _executor
+
+
+def enqueue(conversation, kind, **payload):
+    """
+    Add a job to the queue and wake the in-process workers once the current
+    transaction commits.
+
+    Returns:
+        BackgroundJob: The created job.
+    """
+    job = BackgroundJob.objects.create(conversation=conversation, kind=kind, payload=payload)
+    transaction.on_commit(dispatch)
+    logger.info(f"Enqueued {kind} job {job.id} for conversation {conversation.id}")
+    return job
+
+
+def dispatch():
+    """
+    Ask the in-process thread pool to drain the queue. A no-op when jobs are
+    left to a dedicated `run_jobs` worker (`CHAT_JOB_WORKER_THREADS = 0`).
+    """
+    if settings.CHAT_JOB_WORKER_THREADS > 0:
+        _get_executor().submit(_run_pending_in_thread)
+
+
+def _dispatch_later(delay):
+    # In-process workers are only kicked by commits; wake them for the retry
+    if settings.CHAT_JOB_WORKER_THREADS > 0:
+        timer = threading.Timer(delay, dispatch)
+        timer.daemon = True
+        timer.start()
+
+
+def _run_pending_in_thread():
+    try:
+        run_pending()
+        maybe_purge()
+    except Exception:
+        logger.exception("Background job worker thread crashed")
+    finally:
+        # Executor threads outlive the request cycle, so nobody else closes these
+        connections.close_all()
+
+
+def claim_next():
+    """
+    Atomically take the pending job that has been due the longest.
+
+    Returns:
+        BackgroundJob or None: The claimed job, now marked running.
+    """
+    while True:
+        job = (
+            BackgroundJob.objects
+            .filter(status=BackgroundJob.STATUS_PENDING, run_after__lte=timezone.now())
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = BackgroundJob.objects.filter(id=job.id, status=BackgroundJob.STATUS_PENDING).update(
+            status=BackgroundJob.STATUS_RUNNING,
+            attempts=F('attempts') + 1,
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+        # Another worker got it first, try the next one
+
+
+def retry_delay(attempts):
+    """
+    Seconds before the next attempt of a job that failed `attempts` times:
+    exponential from CHAT_JOB_RETRY_DELAY up to CHAT_JOB_RETRY_MAX_DELAY, with
+    jitter so jobs that failed together don't retry together.
+    """
+    delay = min(settings.CHAT_JOB_RETRY_MAX_DELAY, settings.CHAT_JOB_RETRY_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run_job(job):
+    """
+    Run a claimed job. Failures are retried with backoff until
+    `CHAT_JOB_MAX_ATTEMPTS`, then the kind's failure handler (if any) runs.
+    """
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+        handler(job)
+    except Exception as e:
+        logger.exception(f"{job.kind} job {job.id} failed")
+        job.error = str(e)
+        if job.attempts >= settings.CHAT_JOB_MAX_ATTEMPTS:
+            job.status = BackgroundJob.STATUS_FAILED
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            _on_final_failure(job)
+        else:
+            delay = retry_delay(job.attempts)
+            job.status = BackgroundJob.STATUS_PENDING
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+            job.save(update_fields=['status', 'error', 'run_after', 'updated_at'])
+            _dispatch_later(delay)
+        return False
+
+    job.status = BackgroundJob.STATUS_DONE
+    job.save(update_fields=['status', 'updated_at'])
+    return True
+
+
+def _on_final_failure(job):
+    path = JOB_FAILURE_HANDLERS.get(job.kind)
+    if path is None:
+        return
+    try:
+        import_string(path)(job)
+    except Exception:
+        logger.exception(f"Failure handler of {job.kind} job {job.id} failed")
+
+
+def run_pending(limit=None):
+    """
+    Process due jobs until none are left or `limit` jobs have run. Jobs
+    waiting out a retry delay are left for a later call.
+
+    Returns:
+        int: The number of jobs processed.
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
+
+
+def requeue_stale(older_than=None):
+    """
+    Put back jobs left `running` by a worker that died mid-job. Jobs that
+    died in their last attempt fail instead, and get their kind's failure
+    handler, so a job that keeps killing its worker is not retried forever.
+
+    Returns:
+        int: The number of jobs requeued.
+    """
+    if older_than is None:
+        older_than = timedelta(seconds=settings.CHAT_JOB_STALE_AFTER)
+    now = timezone.now()
+    stale = BackgroundJob.objects.filter(status=BackgroundJob.STATUS_RUNNING, updated_at__lt=now - older_than)
+
+    for job in stale.filter(attempts__gte=settings.CHAT_JOB_MAX_ATTEMPTS).select_related('conversation'):
+        # Conditional, like claiming: another worker may get to it first
+        failed = BackgroundJob.objects.filter(id=job.id, status=BackgroundJob.STATUS_RUNNING).update(
+            status=BackgroundJob.STATUS_FAILED, error="Worker stopped during the last attempt", updated_at=now,
+        )
+        if failed:
+            logger.warning(f"{job.kind} job {job.id} failed: worker stopped during attempt {job.attempts}")
+            _on_final_failure(job)
+
+    return stale.filter(attempts__lt=settings.CHAT_JOB_MAX_ATTEMPTS).update(status=BackgroundJob.STATUS_PENDING)
+
+
+def purge_finished(now=None):
+    """
+    Delete done jobs older than CHAT_JOB_DONE_RETENTION and failed ones older
+    than CHAT_JOB_FAILED_RETENTION.
+
+    Returns:
+        int: The number of jobs deleted.
+    """
+    now = now or timezone.now()
+    deleted = 0
+    for status, retention in [
+        (BackgroundJob.STATUS_DONE, settings.CHAT_JOB_DONE_RETENTION),
+        (BackgroundJob.STATUS_FAILED, settings.CHAT_JOB_FAILED_RETENTION),
+    ]:
+        deleted += BackgroundJob.objects.filter(
+            status=status, created_at__lt=now - timedelta(seconds=retention),
+        ).delete()[0]
+    if deleted:
+        logger.info(f"Deleted {deleted} finished job(s)")
+    return deleted
+
+
+def maybe_purge():
+    """
+    `purge_finished`, at most once per CHAT_JOB_PURGE_INTERVAL in this process.
+
+    Returns:
+        int: The number of jobs deleted.
+    """
+    global _last_purge
+    now = timezone.now()
+    with _executor_lock:
+        if _last_purge is not None and now - _last_purge < timedelta(seconds=settings.CHAT_JOB_PURGE_INTERVAL):
+            return 0
+        _last_purge = now
+    return purge_finished(now)
+
+
+def is_pending(conversation, kind):
+    """
+    Whether a job of `kind` is still queued or running for the conversation.
+    """
+    return BackgroundJob.objects.filter(
+        conversation=conversation,
+        kind=kind,
+        status__in=[BackgroundJob.STATUS_PENDING, BackgroundJob.STATUS_RUNNING],
+    ).exists()
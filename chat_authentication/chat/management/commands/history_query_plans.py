@@ -0,0 +1,110 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+
+from chat.models import ChatMessage, Conversation
+
+BENCH_USERNAME = 'query-plan-bench'
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the query plans (and timings) of the hot chat queries against a "
+        "conversation with many messages, to check they use the composite indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1_000_000,
+                            help="Messages to seed into a throwaway conversation.")
+        parser.add_argument('--conversation', type=int,
+                            help="Explain against an existing conversation instead of seeding one.")
+        parser.add_argument('--window', type=int, default=40, help="Rows fetched by the history query.")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded conversation afterwards.")
+
+    def handle(self, *args, **options):
+        if options['conversation']:
+            conversation = Conversation.objects.get(id=options['conversation'])
+            seeded = False
+        else:
+            conversation = self._seed(options['messages'])
+            seeded = True
+
+        try:
+            self._explain_all(conversation, options['window'])
+        finally:
+            if seeded and not options['keep']:
+                # Cascades to the messages in a single DELETE
+                User.objects.filter(username=BENCH_USERNAME).delete()
+
+    def _seed(self, count):
+        user, _ = User.objects.get_or_create(username=BENCH_USERNAME)
+        conversation = Conversation.objects.create(user=user, title=f"Query plan benchmark {time.time():.0f}")
+        self.stdout.write(f"Seeding {count} messages into conversation {conversation.id}...")
+        start = time.perf_counter()
+
+        if connection.vendor == 'postgresql':
+            table = ChatMessage._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (conversation_id, user_response, ai_response, timestamp) "
+                    f"SELECT %s, 'Question ' || n, 'Answer ' || n, now() - (%s - n) * interval '1 second' "
+                    f"FROM generate_series(1, %s) AS n",
+                    [conversation.id, count, count],
+                )
+                # Index-only scans need an up-to-date visibility map
+                cursor.execute(f"VACUUM ANALYZE {table}")
+                cursor.execute(f"VACUUM ANALYZE {Conversation._meta.db_table}")
+        else:
+            batch = 10_000
+            for offset in range(0, count, batch):
+                ChatMessage.objects.bulk_create(
+                    ChatMessage(conversation=conversation, user_response=f"Question {n}", ai_response=f"Answer {n}")
+                    for n in range(offset, min(offset + batch, count))
+                )
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        self.stdout.write(f"Seeded in {time.perf_counter() - start:.1f}s")
+        return conversation
+
+    def _explain_all(self, conversation, window):
+        messages = ChatMessage.objects.filter(conversation=conversation).order_by('-timestamp', '-id')
+        queries = [
+            ("History window", messages.values_list('id', 'user_response', 'ai_response')[:window]),
+            ("Window boundary (timestamp, id)", messages.values_list('timestamp', 'id')[:window]),
+            ("Message count", ChatMessage.objects.filter(conversation=conversation)
+             .values('conversation_id').annotate(count=Count('id'))),
+            ("Conversation list",
+             Conversation.objects.filter(user_id=conversation.user_id).order_by('-last_activity')[:20]),
+        ]
+        for label, queryset in queries:
+            self._explain(label, queryset)
+
+    def _explain(self, label, queryset):
+        if connection.vendor == 'postgresql':
+            plan = queryset.explain(analyze=True, buffers=True)
+        else:
+            plan = queryset.explain()
+
+        start = time.perf_counter()
+        list(queryset)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{label} ({elapsed_ms:.2f} ms)"))
+        self.stdout.write(plan)
+        verdict = _scan_type(plan)
+        style = self.style.ERROR if verdict == 'sequential scan' else self.style.SUCCESS
+        self.stdout.write(style(f"-> {verdict}"))
+
+
+def _scan_type(plan):
+    if 'Index Only Scan' in plan or 'COVERING INDEX' in plan:
+        return 'index-only scan'
+    if 'Index Scan' in plan or 'USING INDEX' in plan:
+        return 'index scan'
+    if 'Seq Scan' in plan or 'SCAN ' in plan:
+        return 'sequential scan'
+    return 'unknown'
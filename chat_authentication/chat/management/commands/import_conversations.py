@@ -0,0 +1,32 @@
+import gzip
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.archive import IMPORT_BATCH_SIZE, import_lines
+
+
+class Command(BaseCommand):
+    help = "Import an NDJSON archive (plain or gzipped) written by export_conversations into a user's account."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('input', help="Archive file, '-' for stdin.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']}")
+
+        source = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        try:
+            # Detect gzip from its magic number rather than the file name
+            lines = gzip.GzipFile(fileobj=source) if source.peek(2)[:2] == b'\x1f\x8b' else source
+            conversations, messages = import_lines(user, lines, batch_size=options['batch_size'])
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        self.stdout.write(f"Imported {conversations} conversation(s) and {messages} message(s)")
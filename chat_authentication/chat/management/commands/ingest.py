@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.components import registry, register_components
+from chat.ingest import CHUNK_OVERLAP, CHUNK_SIZE, EMBED_BATCH_SIZE, EMBED_CONCURRENCY, ingest
+from chat.models import DocumentChunk
+from chat.retrievers import DjangoVectorStore
+from chat.vectors import build_vector_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Load PDFs, web pages and text files into a local retrieval collection. "
+        "Unchanged chunks are skipped, so re-runs only embed what changed. Works while "
+        "CHAT_VECTOR_STORE is still 'astra', so the collection can be loaded before switching."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+', help="Files, directories or http(s) URLs.")
+        parser.add_argument('--collection', default=settings.CHAT_RAG_COLLECTION)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP)
+        parser.add_argument('--batch-size', type=int, default=EMBED_BATCH_SIZE,
+                            help="Chunks per embedding request and per INSERT.")
+        parser.add_argument('--concurrency', type=int, default=EMBED_CONCURRENCY,
+                            help="Embedding requests in flight at once.")
+        parser.add_argument('--no-prune', action='store_true',
+                            help="Keep chunks that are no longer in their source.")
+        parser.add_argument('--store', choices=['auto', 'pgvector', 'numpy'],
+                            default=settings.CHAT_VECTOR_STORE if settings.CHAT_VECTOR_STORE != 'astra' else 'auto',
+                            help="Local vector store to write through (default: CHAT_VECTOR_STORE, or 'auto').")
+
+    def handle(self, *args, **options):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        register_components()
+        vstore = DjangoVectorStore(
+            registry.get('embedding'), options['collection'],
+            store=build_vector_store(options['store'], DocumentChunk, 'collection', 'id'),
+        )
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=options['chunk_size'], chunk_overlap=options['chunk_overlap'],
+        )
+
+        last_report = [0.0]
+
+        def progress(report):
+            # At most one line every couple of seconds
+            if time.perf_counter() - last_report[0] >= 2:
+                last_report[0] = time.perf_counter()
+                self.stdout.write(f"  {report}")
+
+        report = ingest(
+            vstore, options['sources'], splitter=splitter, batch_size=options['batch_size'],
+            concurrency=options['concurrency'], prune=not options['no_prune'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Ingested into '{options['collection']}': {report}"))
+        if hasattr(vstore.embedding, 'stats'):
+            self.stdout.write(f"Embedding cache: {vstore.embedding.stats()}")
@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from chat.components import register_components
+from chat.models import BackgroundJob
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+
+class VirtualUser:
+    """
+    One authenticated client sending a mix of chat turns and history reads.
+    """
+
+    def __init__(self, user, token, requests, history_ratio, seed):
+        self.user = user
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.requests = requests
+        self.history_ratio = history_ratio
+        self.random = random.Random(seed)
+        self.conversation_id = None
+        self.samples = []  # (endpoint, status, seconds, queries)
+
+    def _request(self, endpoint, send):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = send()
+        self.samples.append((endpoint, response.status_code, time.perf_counter() - start, queries[0]))
+        return response
+
+    def run(self):
+        try:
+            for turn in range(self.requests):
+                if self.conversation_id and self.random.random() < self.history_ratio:
+                    self._request('chat-history', lambda: self.client.get(
+                        reverse('chat-history', args=[self.conversation_id]),
+                    ))
+                    continue
+                data = {'input_message': f"Question {turn} from {self.user.username}: how does this work?"}
+                if self.conversation_id:
+                    data['conversation_id'] = self.conversation_id
+                response = self._request('handle-message', lambda: self.client.post(
+                    reverse('handle_message'), data, content_type='application/json',
+                ))
+                if response.status_code == 200:
+                    self.conversation_id = response.json()['conversation_id']
+        finally:
+            # Worker threads have their own connection
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent authenticated handle-message and chat-history traffic through the "
+        "full Django stack in this process and report throughput, latency percentiles and "
+        "database queries per request. Meant to run with CHAT_FAKE_MODELS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users (one thread each).")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per user.")
+        parser.add_argument('--history-ratio', type=float, default=0.3,
+                            help="Share of requests that read the chat history instead of sending a turn.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--real', action='store_true',
+                            help="Allow running against the real model providers (billed).")
+        parser.add_argument('--keep-users', action='store_true',
+                            help="Keep the load-test users and their conversations afterwards.")
+
+    def handle(self, *args, **options):
+        if not settings.CHAT_FAKE_MODELS and not options['real']:
+            raise CommandError("CHAT_FAKE_MODELS is not set; pass --real to load test the real providers")
+        register_components()
+
+        run_id = uuid.uuid4().hex[:8]
+        users = []
+        for i in range(options['users']):
+            user = User.objects.create_user(username=f"loadtest-{run_id}-{i}")
+            users.append(VirtualUser(
+                user, Token.objects.create(user=user), options['requests'], options['history_ratio'],
+                seed=options['seed'] + i,
+            ))
+
+        start = time.perf_counter()
+        try:
+            if len(users) == 1:
+                users[0].run()
+            else:
+                threads = [threading.Thread(target=user.run, name=f"loadtest-{i}") for i, user in enumerate(users)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            elapsed = time.perf_counter() - start
+            self._report([sample for user in users for sample in user.samples], elapsed)
+        finally:
+            if not options['keep_users']:
+                self._wait_for_jobs(run_id)
+                User.objects.filter(username__startswith=f"loadtest-{run_id}-").delete()
+
+    def _wait_for_jobs(self, run_id, timeout=10):
+        # Let in-process workers finish the users' title/summary jobs before
+        # their conversations are deleted. Inside a transaction (e.g. a test)
+        # the on_commit dispatch never fires, so nothing would run them.
+        if settings.CHAT_JOB_WORKER_THREADS <= 0 or connection.in_atomic_block:
+            return
+        jobs = BackgroundJob.objects.filter(
+            Q(status=BackgroundJob.STATUS_RUNNING)
+            | Q(status=BackgroundJob.STATUS_PENDING, run_after__lte=timezone.now()),
+            conversation__user__username__startswith=f"loadtest-{run_id}-",
+        )
+        deadline = time.perf_counter() + timeout
+        while jobs.exists() and time.perf_counter() < deadline:
+            time.sleep(0.1)
+
+    def _report(self, samples, elapsed):
+        if not samples:
+            self.stdout.write("No requests were sent.")
+            return
+        self.stdout.write(
+            f"{len(samples)} requests in {elapsed:.2f}s: {len(samples) / elapsed:.1f} requests/s"
+        )
+        for endpoint in sorted({sample[0] for sample in samples}):
+            rows = [sample for sample in samples if sample[0] == endpoint]
+            latencies = [seconds * 1000 for _, _, seconds, _ in rows]
+            statuses = {}
+            for _, status_code, _, _ in rows:
+                statuses[status_code] = statuses.get(status_code, 0) + 1
+            self.stdout.write(
+                f"{endpoint}: {len(rows)} requests, "
+                f"p50 {percentile(latencies, 50):.1f}ms, p95 {percentile(latencies, 95):.1f}ms, "
+                f"p99 {percentile(latencies, 99):.1f}ms, "
+                f"{sum(queries for *_, queries in rows) / len(rows):.1f} queries/request, "
+                f"statuses {dict(sorted(statuses.items()))}"
+            )
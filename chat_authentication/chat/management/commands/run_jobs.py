@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import jobs
+
+
+class Command(BaseCommand):
+    help = "Process background jobs (e.g. conversation titles) from the DB-backed queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        while True:
+            processed = jobs.run_pending()
+            if processed:
+                self.stdout.write(f"Processed {processed} job(s)")
+            purged = jobs.maybe_purge()
+            if purged:
+                self.stdout.write(f"Deleted {purged} finished job(s)")
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
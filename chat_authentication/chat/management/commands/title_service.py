@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.title_service import TitleBatcher, make_server
+from chat.titles import generate_titles
+
+
+class Command(BaseCommand):
+    help = "Run the shared micro-batching title-generation service."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--max-batch-size', type=int, default=settings.TITLE_SERVICE_MAX_BATCH_SIZE)
+        parser.add_argument('--max-wait-ms', type=int, default=settings.TITLE_SERVICE_MAX_WAIT_MS)
+
+    def handle(self, *args, **options):
+        # Load the model before accepting requests
+        generate_titles(["warmup"])
+
+        batcher = TitleBatcher(
+            max_batch_size=options['max_batch_size'],
+            max_wait_ms=options['max_wait_ms'],
+        )
+        server = make_server(options['host'], options['port'], batcher, settings.TITLE_SERVICE_TIMEOUT)
+        self.stdout.write(
+            f"Title service listening on http://{options['host']}:{options['port']} "
+            f"(max batch {options['max_batch_size']}, max wait {options['max_wait_ms']} ms)"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.components import register_components
+
+
+class Command(BaseCommand):
+    help = (
+        "Build lazy chat components (LLM clients, vector store, chains, models) in this "
+        "process and report how long each took. Servers warm themselves at boot with "
+        "CHAT_WARMUP_ON_START; this command checks that the components load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'components', nargs='*',
+            help="Components to load. Defaults to CHAT_WARMUP_COMPONENTS.",
+        )
+
+    def handle(self, *args, **options):
+        registry = register_components()
+        names = options['components'] or settings.CHAT_WARMUP_COMPONENTS
+
+        unknown = set(names) - set(registry.names())
+        if unknown:
+            raise CommandError(f"Unknown component(s): {', '.join(sorted(unknown))}. "
+                               f"Available: {', '.join(registry.names())}")
+
+        for name, seconds in registry.warmup(names).items():
+            self.stdout.write(f"{name}: {seconds:.2f}s")
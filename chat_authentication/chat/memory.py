@@ -0,0 +1,125 @@
+# chat/memory.py
+"""
+Long-term semantic memory across a user's conversations.
+
+Every stored turn is embedded by a background job (`run_embed_job`, queued
+after each reply) into a TurnEmbedding row. On each request, `recall` embeds
+the new input and looks up the user's most similar past turns, which
+chat.chatbot adds to the prompt. Turns still in the current history window are
+left out, since the prompt already has them.
+
+The vectors are searched per user by one of the chat.vectors stores: the
+HNSW-indexed pgvector column (migration 0011) or an in-memory NumPy index for
+development databases and tests.
+"""
+import logging
+
+from django.conf import settings
+from langchain_core.messages import SystemMessage
+
+from .components import registry
+from .models import ChatMessage, TurnEmbedding
+from .vectors import build_vector_store, to_bytes
+
+logger = logging.getLogger(__name__)
+
+# Longer turns are cut when added to the prompt
+MAX_TURN_CHARS = 1000
+
+
+def turn_text(user_response, ai_response):
+    """
+    The text embedded for a turn.
+    """
+    lines = []
+    if user_response:
+        lines.append(f"Human: {user_response}")
+    if ai_response:
+        lines.append(f"AI: {ai_response}")
+    return "\n".join(lines)
+
+
+def _build_memory_store():
+    return build_vector_store(settings.CHAT_MEMORY_STORE, TurnEmbedding, 'user_id', 'message_id')
+
+
+registry.register('memory_store', _build_memory_store)
+
+
+def run_embed_job(job):
+    """
+    Background job handler: embed the conversation's turns that have no
+    TurnEmbedding yet, in one batched embedding request.
+    """
+    conversation = job.conversation
+    rows = list(
+        ChatMessage.objects.filter(conversation=conversation, embedding__isnull=True)
+        .order_by('id').values_list('id', 'user_response', 'ai_response')
+    )
+    if not rows:
+        return
+
+    vectors = registry.get('embedding').embed_documents([turn_text(user, ai) for _, user, ai in rows])
+    embeddings = [
+        TurnEmbedding(message_id=message_id, user_id=conversation.user_id, conversation=conversation, vector=to_bytes(v))
+        for (message_id, _, _), v in zip(rows, vectors)
+    ]
+    # A concurrent job may have embedded some of the same turns
+    TurnEmbedding.objects.bulk_create(embeddings, ignore_conflicts=True)
+    # ignore_conflicts leaves the ids unset, so read back the rows that were written
+    stored = TurnEmbedding.objects.filter(message_id__in=[message_id for message_id, _, _ in rows])
+    registry.get('memory_store').add(list(stored))
+    logger.info(f"Embedded {len(rows)} turn(s) of conversation {conversation.id}")
+
+
+def recall(conversation, query, window=(), k=None):
+    """
+    The user's past turns most similar to `query`, from any of their
+    conversations.
+
+    Args:
+        conversation (Conversation): The current conversation.
+        query (str): The new user input.
+        window (list[BaseMessage]): The history already in the prompt; turns
+            of the current conversation found in it are skipped.
+        k (int): Maximum number of turns (default CHAT_MEMORY_TOP_K).
+
+    Returns:
+        list[ChatMessage]: Best match first.
+    """
+    k = k or settings.CHAT_MEMORY_TOP_K
+    # Nothing to find, so don't pay for embedding the query
+    if not TurnEmbedding.objects.filter(user_id=conversation.user_id).exists():
+        return []
+    in_window = {message.content for message in window}
+    vector = registry.get('embedding').embed_query(query)
+    # Over-fetch, as some hits may be turns the prompt already has
+    hits = registry.get('memory_store').search(conversation.user_id, vector, k + len(in_window))
+    scores = {message_id: score for message_id, score in hits if score >= settings.CHAT_MEMORY_MIN_SCORE}
+    if not scores:
+        return []
+
+    messages = ChatMessage.objects.filter(id__in=scores).select_related('conversation').only(
+        'user_response', 'ai_response', 'timestamp', 'conversation__title',
+    )
+    recalled = [
+        m for m in messages
+        if not (m.conversation_id == conversation.id and (m.user_response in in_window or m.ai_response in in_window))
+    ]
+    recalled.sort(key=lambda m: -scores[m.id])
+    return recalled[:k]
+
+
+def memory_messages(turns):
+    """
+    Format recalled turns as the prompt's `memory` messages.
+    """
+    if not turns:
+        return []
+    parts = ["Possibly relevant excerpts from the user's earlier conversations:"]
+    for turn in turns:
+        parts.append(
+            f"[{turn.conversation.title}, {turn.timestamp:%Y-%m-%d}]\n"
+            + turn_text((turn.user_response or '')[:MAX_TURN_CHARS], (turn.ai_response or '')[:MAX_TURN_CHARS])
+        )
+    return [SystemMessage(content="\n\n".join(parts))]
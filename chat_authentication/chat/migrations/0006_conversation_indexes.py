@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, Max, OuterRef, Subquery
+
+
+def backfill_last_activity(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    latest = (
+        ChatMessage.objects.filter(conversation=OuterRef('pk'))
+        .values('conversation').annotate(latest=Max('timestamp')).values('latest')
+    )
+    has_messages = Exists(ChatMessage.objects.filter(conversation=OuterRef('pk')))
+    Conversation.objects.filter(has_messages).update(last_activity=Subquery(latest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_conversation_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversation',
+            name='title',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_conv_ts_idx'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='conversation',
+            field=models.ForeignKey(db_index=False, default=None, on_delete=django.db.models.deletion.CASCADE, to='chat.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'last_activity'], name='chat_conv_user_activity_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('user', 'title'), name='chat_conversation_user_title_uniq'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+from django.db.models import Q
+
+BATCH_SIZE = 1000
+
+
+def merge_turn_rows(apps, schema_editor):
+    """
+    Fold each AI-only row into the human-only row right before it in the same
+    conversation, so every complete turn is stored as one row.
+
+    Rows are read a page at a time (keyset on the history index) and each
+    page's merges are written before the next page is read, so memory stays
+    bounded by BATCH_SIZE however large the table is.
+    """
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    rows = (
+        ChatMessage.objects
+        .order_by('conversation_id', 'timestamp', 'id')
+        .values_list('id', 'conversation_id', 'timestamp', 'user_response', 'ai_response')
+    )
+    previous = None
+    last = None
+    while True:
+        page = rows
+        if last is not None:
+            conversation_id, timestamp, row_id = last
+            page = page.filter(
+                Q(conversation_id__gt=conversation_id)
+                | Q(conversation_id=conversation_id, timestamp__gt=timestamp)
+                | Q(conversation_id=conversation_id, timestamp=timestamp, id__gt=row_id)
+            )
+        # A list, not an open cursor: SQLite cannot safely modify a table mid-iteration
+        page = list(page[:BATCH_SIZE])
+        if not page:
+            break
+        last = page[-1][1], page[-1][2], page[-1][0]
+
+        merged, merged_away = [], []
+        for row in page:
+            row_id, conversation_id, _, user_response, ai_response = row
+            if (
+                previous is not None
+                and previous[1] == conversation_id
+                and previous[3] is not None and previous[4] is None
+                and user_response is None and ai_response is not None
+            ):
+                merged.append(ChatMessage(id=previous[0], ai_response=ai_response))
+                merged_away.append(row_id)
+                previous = None
+                continue
+            previous = row
+        if merged:
+            ChatMessage.objects.bulk_update(merged, ['ai_response'])
+            ChatMessage.objects.filter(id__in=merged_away).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_conversation_indexes'),
+    ]
+
+    operations = [
+        # Split rows are still read correctly, so there is nothing to undo
+        migrations.RunPython(merge_turn_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+
+def backfill_conversation_list_fields(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    messages = ChatMessage.objects.filter(conversation=OuterRef('pk'))
+    per_conversation = messages.values('conversation')
+    Conversation.objects.filter(Exists(messages)).update(
+        message_count=Subquery(
+            per_conversation.annotate(n=Count('user_response') + Count('ai_response')).values('n')
+        ),
+        last_message_at=Subquery(per_conversation.annotate(latest=Max('timestamp')).values('latest')),
+        last_message_preview=Subquery(
+            messages.order_by('-timestamp', '-id')
+            .annotate(preview=Substr(Coalesce('ai_response', 'user_response', Value('')), 1, 200))
+            .values('preview')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_merge_turn_rows'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='chat_conv_user_activity_idx',
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_conversation_list_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'last_activity', 'id'], include=('title', 'last_message_at', 'message_count', 'last_message_preview'), name='chat_conv_user_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+"""
+Full-text search over ChatMessage (see chat.search). The search structures live
+outside the Django model because they differ per database:
+
+- PostgreSQL: a stored generated `search_vector` tsvector column, which the
+  database keeps current on every INSERT/UPDATE, with a GIN index.
+- SQLite: an external-content FTS5 table kept in sync by triggers.
+"""
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE chat_chatmessage ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('english', coalesce(user_response, '') || ' ' || coalesce(ai_response, ''))
+    ) STORED
+    """,
+    "CREATE INDEX chat_msg_search_idx ON chat_chatmessage USING GIN (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS chat_msg_search_idx",
+    "ALTER TABLE chat_chatmessage DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE chat_chatmessage_fts USING fts5(
+        user_response, ai_response, content='chat_chatmessage', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_fts_insert AFTER INSERT ON chat_chatmessage BEGIN
+        INSERT INTO chat_chatmessage_fts (rowid, user_response, ai_response)
+        VALUES (new.id, new.user_response, new.ai_response);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_fts_delete AFTER DELETE ON chat_chatmessage BEGIN
+        INSERT INTO chat_chatmessage_fts (chat_chatmessage_fts, rowid, user_response, ai_response)
+        VALUES ('delete', old.id, old.user_response, old.ai_response);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_fts_update AFTER UPDATE ON chat_chatmessage BEGIN
+        INSERT INTO chat_chatmessage_fts (chat_chatmessage_fts, rowid, user_response, ai_response)
+        VALUES ('delete', old.id, old.user_response, old.ai_response);
+        INSERT INTO chat_chatmessage_fts (rowid, user_response, ai_response)
+        VALUES (new.id, new.user_response, new.ai_response);
+    END
+    """,
+    "INSERT INTO chat_chatmessage_fts (chat_chatmessage_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_chatmessage_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_chatmessage_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_chatmessage_fts_update",
+    "DROP TABLE IF EXISTS chat_chatmessage_fts",
+]
+
+STATEMENTS = {
+    'postgresql': (POSTGRES_FORWARD, POSTGRES_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def _run(schema_editor, backward):
+    # Other databases fall back to a plain (unindexed) search in chat.search
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+    if statements:
+        for sql in statements[backward]:
+            schema_editor.execute(sql)
+
+
+def forward(apps, schema_editor):
+    _run(schema_editor, backward=False)
+
+
+def backward(apps, schema_editor):
+    _run(schema_editor, backward=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatmessage_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
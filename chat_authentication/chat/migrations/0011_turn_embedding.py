@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:35
+"""
+Long-term memory embeddings (see chat.memory). On PostgreSQL servers with the
+pgvector extension, TurnEmbedding also gets an `embedding vector(n)` column
+with an HNSW index, searched by the pgvector memory store.
+"""
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+TABLE = 'chat_turnembedding'
+# Frozen here, not read from chat.vectors or settings, so later changes to
+# either can't alter what this migration does
+DIMENSIONS = 1536
+
+
+def add_pgvector_column(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    schema_editor.execute(f"ALTER TABLE {TABLE} ADD COLUMN embedding vector({DIMENSIONS})")
+    schema_editor.execute(f"CREATE INDEX {TABLE}_hnsw_idx ON {TABLE} USING hnsw (embedding vector_cosine_ops)")
+
+
+def drop_pgvector_column(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS embedding")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('title', 'Generate conversation title'), ('summary', 'Update rolling summary'), ('embed', 'Embed new turns for long-term memory')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='TurnEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='chat.conversation')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding', to='chat.chatmessage')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='chat_turn_emb_user_idx')],
+            },
+        ),
+        migrations.RunPython(add_pgvector_column, drop_pgvector_column),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:38
+"""
+Local retrieval collections (see chat.retrievers). As in 0011, PostgreSQL
+servers with pgvector also get an HNSW-indexed `embedding vector(n)` column.
+"""
+from django.db import migrations, models
+
+TABLE = 'chat_documentchunk'
+# Frozen, as in 0011
+DIMENSIONS = 1536
+
+
+def add_pgvector_column(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    schema_editor.execute(f"ALTER TABLE {TABLE} ADD COLUMN embedding vector({DIMENSIONS})")
+    schema_editor.execute(f"CREATE INDEX {TABLE}_hnsw_idx ON {TABLE} USING hnsw (embedding vector_cosine_ops)")
+
+
+def drop_pgvector_column(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS embedding")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_turn_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='use_rag',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.CharField(max_length=100)),
+                ('content', models.TextField()),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('vector', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['collection', 'id'], name='chat_chunk_collection_idx')],
+            },
+        ),
+        migrations.RunPython(add_pgvector_column, drop_pgvector_column),
+    ]
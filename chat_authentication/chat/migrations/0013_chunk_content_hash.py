@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:41
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_hashes(apps, schema_editor):
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    chunks = DocumentChunk.objects.order_by('id').only('id', 'content', 'metadata')
+    last_id = 0
+    while True:
+        # A page at a time, written before the next is read (no open cursor
+        # while the table changes, which SQLite cannot handle)
+        page = list(chunks.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not page:
+            break
+        last_id = page[-1].id
+        for chunk in page:
+            chunk.source = str(chunk.metadata.get('source', ''))[:500]
+            chunk.content_hash = hashlib.sha256(chunk.content.encode('utf-8')).hexdigest()
+        DocumentChunk.objects.bulk_update(page, ['source', 'content_hash'])
+
+    # The new unique constraint allows one copy; keep the oldest, in one DELETE
+    oldest = (
+        DocumentChunk.objects.values('collection', 'source', 'content_hash')
+        .annotate(oldest=Min('id')).values('oldest')
+    )
+    DocumentChunk.objects.exclude(id__in=oldest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_document_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='source',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.RunPython(backfill_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='documentchunk',
+            constraint=models.UniqueConstraint(fields=('collection', 'source', 'content_hash'), name='chat_chunk_source_hash_uniq'),
+        ),
+    ]
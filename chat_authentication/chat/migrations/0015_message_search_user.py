@@ -0,0 +1,77 @@
+"""
+Search by user on PostgreSQL (see chat.search). ChatMessage gets a
+`search_user_id` column, copied from its conversation by a trigger, so a
+user's matches are found in one index scan instead of matching every user's
+messages first:
+
+- with the btree_gin extension, one GIN index over (search_user_id,
+  search_vector) replaces the search_vector index of 0010;
+- without it, a btree index on search_user_id sits next to that index, and
+  the planner picks whichever is more selective for the query.
+
+Other databases are left alone; the column stays out of the Django model,
+like `search_vector`.
+"""
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "ALTER TABLE chat_chatmessage ADD COLUMN search_user_id integer",
+    """
+    UPDATE chat_chatmessage m SET search_user_id = c.user_id
+    FROM chat_conversation c WHERE c.id = m.conversation_id
+    """,
+    """
+    CREATE FUNCTION chat_chatmessage_search_user() RETURNS trigger AS $$
+    BEGIN
+        SELECT user_id INTO NEW.search_user_id FROM chat_conversation WHERE id = NEW.conversation_id;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER chat_chatmessage_search_user BEFORE INSERT OR UPDATE OF conversation_id
+    ON chat_chatmessage FOR EACH ROW EXECUTE FUNCTION chat_chatmessage_search_user()
+    """,
+]
+WITH_BTREE_GIN = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    "CREATE INDEX chat_msg_user_search_idx ON chat_chatmessage USING GIN (search_user_id, search_vector)",
+    "DROP INDEX IF EXISTS chat_msg_search_idx",
+]
+WITHOUT_BTREE_GIN = [
+    "CREATE INDEX chat_msg_search_user_idx ON chat_chatmessage (search_user_id)",
+]
+POSTGRES_BACKWARD = [
+    "CREATE INDEX IF NOT EXISTS chat_msg_search_idx ON chat_chatmessage USING GIN (search_vector)",
+    "DROP TRIGGER IF EXISTS chat_chatmessage_search_user ON chat_chatmessage",
+    "DROP FUNCTION IF EXISTS chat_chatmessage_search_user()",
+    # Drops its indexes too
+    "ALTER TABLE chat_chatmessage DROP COLUMN IF EXISTS search_user_id",
+]
+
+
+def forward(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'btree_gin'")
+        has_btree_gin = cursor.fetchone() is not None
+    for sql in POSTGRES_FORWARD + (WITH_BTREE_GIN if has_btree_gin else WITHOUT_BTREE_GIN):
+        schema_editor.execute(sql)
+
+
+def backward(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRES_BACKWARD:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_job_run_after'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -2,20 +2,162 @@
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+PREVIEW_LENGTH = 200
 
 class Conversation(models.Model):
-    title = models.CharField(max_length=100, unique=True)
+    # Unique per user, see Meta.constraints
+    title = models.CharField(max_length=100)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Bumped whenever a turn is stored; conversation lists are ordered by it
+    last_activity = models.DateTimeField(default=timezone.now)
+    # Denormalized for the conversation list, kept current by the chat history
+    # in the same transaction as the messages it stores
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    # Rolling summary of the turns that fell out of the history window,
+    # covering every ChatMessage up to and including `summarized_through`
+    summary = models.TextField(blank=True, default='')
+    summarized_through = models.IntegerField(default=0)
+    # Answer from the document collection (chat.retrievers) unless a request
+    # says otherwise with its own `use_rag`
+    use_rag = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'title'], name='chat_conversation_user_title_uniq'),
+        ]
+        indexes = [
+            # Covers the conversation list (on PostgreSQL, which supports INCLUDE)
+            models.Index(
+                fields=['user', 'last_activity', 'id'],
+                include=['title', 'last_message_at', 'message_count', 'last_message_preview'],
+                name='chat_conv_user_activity_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username}: {self.title}"
 
 class ChatMessage(models.Model):
     id = models.AutoField(primary_key=True)
-    conversation = models.ForeignKey(Conversation, default=None, on_delete=models.CASCADE)
+    # Indexed by chat_msg_conv_ts_idx, which has conversation as its leading column
+    conversation = models.ForeignKey(Conversation, default=None, on_delete=models.CASCADE, db_index=False)
     user_response = models.TextField(null=True, blank=True)  # Allows blank responses
     ai_response = models.TextField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so imports can keep the original times
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # History reads filter by conversation and walk it in (timestamp, id) order
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_conv_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.conversation}: {self.id}"
+
+
+class BackgroundJob(models.Model):
+    """
+    A unit of deferred work kept in a DB-backed queue, processed off the
+    request path by `chat.jobs` (in-process threads or `manage.py run_jobs`).
+    """
+    KIND_TITLE = 'title'
+    KIND_SUMMARY = 'summary'
+    KIND_EMBED = 'embed'
+    KIND_CHOICES = [
+        (KIND_TITLE, 'Generate conversation title'),
+        (KIND_SUMMARY, 'Update rolling summary'),
+        (KIND_EMBED, 'Embed new turns for long-term memory'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    # Not claimed before this time; pushed back after each failed attempt
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='chat_job_status_created_idx'),
+            models.Index(fields=['status', 'run_after'], name='chat_job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
+
+
+class TurnEmbedding(models.Model):
+    """
+    Embedding of one stored turn (ChatMessage), for the user's long-term
+    memory (see chat.memory). Kept in its own table so ChatMessage, and the
+    search triggers on it, are left alone.
+    """
+    message = models.OneToOneField(ChatMessage, on_delete=models.CASCADE, related_name='embedding')
+    # Denormalized so a user's index is read without joining through the conversation
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, db_index=False)
+    # float32 bytes (chat.vectors); PostgreSQL with pgvector also gets an
+    # HNSW-indexed `embedding` column, added by migration 0011
+    vector = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Per-user index loads, and their incremental top-ups, walk this by id
+            models.Index(fields=['user', 'id'], name='chat_turn_emb_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Embedding of message {self.message_id}"
+
+
+class DocumentChunk(models.Model):
+    """
+    A chunk of a source document in a retrieval collection, searched by the
+    local vector stores in chat.retrievers.
+    """
+    collection = models.CharField(max_length=100)
+    # Where the chunk came from (file path or URL), and the SHA-256 of its
+    # content: `manage.py ingest` skips chunks it already has
+    source = models.CharField(max_length=500, blank=True, default='')
+    content_hash = models.CharField(max_length=64, default='')
+    content = models.TextField()
+    metadata = models.JSONField(default=dict, blank=True)
+    # float32 bytes (chat.vectors); PostgreSQL with pgvector also gets an
+    # HNSW-indexed `embedding` column, added by migration 0012
+    vector = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also serves the per-source hash lookups of incremental ingestion
+            models.UniqueConstraint(
+                fields=['collection', 'source', 'content_hash'], name='chat_chunk_source_hash_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['collection', 'id'], name='chat_chunk_collection_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.collection}: chunk {self.id}"
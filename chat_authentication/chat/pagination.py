@@ -0,0 +1,180 @@
+# chat/pagination.py
+"""
+Keyset (cursor) pagination for chat history and conversation lists.
+
+A cursor is an opaque token for one row's `(timestamp, id)`, so a page is one
+index range scan (`chat_msg_conv_ts_idx`, `chat_conv_user_activity_idx`)
+however many rows there are, and rows written between requests never shift a
+page.
+"""
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(value):
+    """
+    Returns:
+        tuple: (timestamp, id) of the row the cursor points at.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed.
+    """
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+        timestamp = parse_datetime(timestamp)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor(f"Invalid cursor: {value}") from None
+    if timestamp is None or not isinstance(message_id, int):
+        raise InvalidCursor(f"Invalid cursor: {value}")
+    return timestamp, message_id
+
+
+def _page_limit(params, default, maximum):
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        raise InvalidCursor("limit must be an integer") from None
+    return max(1, min(limit, maximum))
+
+
+class HistoryPage:
+    """
+    One page of a conversation's messages, selected by the request's query
+    parameters:
+
+        (none)          the newest messages
+        before=<cursor> messages older than the cursor
+        after=<cursor>  messages newer than the cursor
+        since=<cursor>  like `after`, for delta sync: the response leaves out
+                        the conversation details
+        limit=<n>       page size, capped at CHAT_HISTORY_MAX_PAGE_SIZE
+    """
+
+    def __init__(self, messages, params):
+        """
+        Args:
+            messages (QuerySet): The conversation's ChatMessages.
+            params (QueryDict): The request's GET parameters.
+
+        Raises:
+            InvalidCursor: If a cursor or the limit is malformed.
+        """
+        self.limit = _page_limit(params, settings.CHAT_HISTORY_PAGE_SIZE, settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+        self.delta = 'since' in params
+
+        forward = params.get('since') or params.get('after')
+        self.cursor = forward
+        if forward:
+            timestamp, message_id = decode_cursor(forward)
+            newer = Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+            self.newest_first = False
+            self.queryset = messages.filter(newer).order_by('timestamp', 'id')
+        else:
+            self.newest_first = True
+            self.queryset = messages.order_by('-timestamp', '-id')
+            if params.get('before'):
+                timestamp, message_id = decode_cursor(params['before'])
+                older = Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+                self.queryset = self.queryset.filter(older)
+
+    def slice(self):
+        # One extra row tells whether there is more beyond this page
+        return self.queryset[:self.limit + 1]
+
+    def build(self, rows):
+        """
+        Args:
+            rows (list[ChatMessage]): The evaluated `slice()`.
+
+        Returns:
+            tuple: (messages oldest first, pagination dict for the response).
+        """
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if self.newest_first:
+            rows = rows[::-1]
+        return rows, {
+            'has_more': has_more,
+            # Cursors for the next page in either direction; `next` is what a
+            # client polls with `since=` (unchanged when nothing is new)
+            'previous': encode_cursor(rows[0].timestamp, rows[0].id) if rows else self.cursor,
+            'next': encode_cursor(rows[-1].timestamp, rows[-1].id) if rows else self.cursor,
+        }
+
+
+class ConversationPage:
+    """
+    One page of a user's conversations, most recently active first:
+
+        (none)          the most recently active conversations
+        before=<cursor> conversations active before the cursor
+        limit=<n>       page size, capped at CHAT_CONVERSATIONS_MAX_PAGE_SIZE
+
+    Only the columns in `chat_conv_user_activity_idx` are read, so on
+    PostgreSQL a page is an index-only scan.
+    """
+    FIELDS = ('id', 'title', 'last_activity', 'last_message_at', 'message_count', 'last_message_preview')
+
+    def __init__(self, conversations, params):
+        """
+        Args:
+            conversations (QuerySet): The user's Conversations.
+            params (QueryDict): The request's GET parameters.
+
+        Raises:
+            InvalidCursor: If the cursor or the limit is malformed.
+        """
+        self.limit = _page_limit(
+            params, settings.CHAT_CONVERSATIONS_PAGE_SIZE, settings.CHAT_CONVERSATIONS_MAX_PAGE_SIZE,
+        )
+        self.queryset = conversations.order_by('-last_activity', '-id').values(*self.FIELDS)
+        if params.get('before'):
+            last_activity, conversation_id = decode_cursor(params['before'])
+            self.queryset = self.queryset.filter(
+                Q(last_activity__lt=last_activity) | Q(last_activity=last_activity, id__lt=conversation_id)
+            )
+
+    def slice(self):
+        return self.queryset[:self.limit + 1]
+
+    def build(self, rows):
+        """
+        Args:
+            rows (list[dict]): The evaluated `slice()`.
+
+        Returns:
+            tuple: (conversation dicts, pagination dict for the response).
+        """
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        last = rows[-1] if rows else None
+        return rows, {
+            'has_more': has_more,
+            'next': encode_cursor(last['last_activity'], last['id']) if has_more else None,
+        }
+
+
+def history_etag(conversation, params):
+    """
+    ETag of a history response. Every stored turn bumps `last_activity`, so it
+    changes exactly when the response could.
+    """
+    key = (
+        f"{conversation.id}:{conversation.last_activity.isoformat()}:{conversation.title}:"
+        f"{conversation.summarized_through}:{params.urlencode()}"
+    )
+    return hashlib.md5(key.encode('utf-8'), usedforsecurity=False).hexdigest()
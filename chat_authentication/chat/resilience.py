@@ -0,0 +1,415 @@
+# chat/resilience.py
+"""
+Deadlines, hedging, retries and fallbacks around the chat models.
+
+`ResilientChatModel` is what `registry.get('llm')` returns (see chat.chatbot).
+It wraps a chain of chat models (primary first, then fallbacks) and, for
+each call:
+
+    deadline - gives up on an attempt without a first token after
+               FIRST_TOKEN_TIMEOUT seconds, and on the whole call after TIMEOUT
+    hedging  - after HEDGE_DELAY seconds without a first token, sends the same
+               request again and streams whichever attempt answers first
+    retries  - retries failed or timed-out attempts MAX_RETRIES times with
+               jittered exponential backoff, then moves on to the next model;
+               errors retrying can't fix (e.g. a 401 or 400) move on at once
+
+Once the first token has been passed on, the answer is committed: a later
+error or deadline is raised to the caller rather than retried. Calls run
+through the Runnable config helpers, so callbacks and tracing see this step
+with each attempt's model run nested under it.
+"""
+import asyncio
+import contextvars
+import logging
+import queue
+import random
+import threading
+import time
+
+from langchain_core.messages import AIMessage, message_chunk_to_message
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import patch_config
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class LLMTimeout(TimeoutError):
+    pass
+
+
+def _transport_errors():
+    errors = (TimeoutError, ConnectionError)
+    try:
+        import openai
+    except ImportError:
+        return errors
+    return errors + (openai.APIConnectionError, openai.APITimeoutError)
+
+
+def retryable(error):
+    """
+    Whether an attempt that failed with `error` may be retried: timeouts,
+    connection errors, rate limits and server errors. Anything else (bad
+    requests, programming errors) is raised at once.
+    """
+    if isinstance(error, _transport_errors()):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return isinstance(status_code, int) and (status_code in (408, 409, 429) or status_code >= 500)
+
+
+def backoff(retry, base, cap):
+    """
+    Full-jitter exponential backoff: a random delay up to base * 2**retry.
+    """
+    return random.uniform(0, min(cap, base * 2 ** retry))
+
+
+def _model_name(llm):
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', None) or type(llm).__name__
+
+
+class ResilientChatModel(Runnable):
+    def __init__(self, models, timeout=60, first_token_timeout=15, hedge_delay=None,
+                 max_retries=2, backoff_base=0.5, backoff_max=8):
+        """
+        Args:
+            models (list): Chat models to try in order (primary, fallbacks).
+            timeout (float): Deadline in seconds for a whole call.
+            first_token_timeout (float): Deadline for an attempt's first token.
+            hedge_delay (float): Seconds without a first token before a hedge
+                request; None disables hedging.
+            max_retries (int): Retries per model before falling back.
+            backoff_base (float): Base of the retry backoff, in seconds.
+            backoff_max (float): Cap of the retry backoff, in seconds.
+        """
+        self.models = list(models)
+        self.timeout = timeout
+        self.first_token_timeout = first_token_timeout
+        self.hedge_delay = hedge_delay
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # The response cache keys answers by the primary model's name (and
+        # leaves out answers tagged with `fallback_model`, see `_tag`)
+        self.model_name = _model_name(self.models[0])
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ['calls', 'attempts', 'timeouts', 'errors', 'retries', 'fallbacks', 'hedges', 'hedge_wins', 'failures'], 0,
+        )
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _fall_back(self, llm):
+        self._count('fallbacks')
+        logger.warning(f"Falling back to chat model {_model_name(llm)}")
+
+    def _tag(self, llm, chunk):
+        # Mark the first chunk of an answer that did not come from the primary
+        if llm is not self.models[0]:
+            chunk.response_metadata = {**chunk.response_metadata, 'fallback_model': _model_name(llm)}
+        return chunk
+
+    def _failed(self, llm, error, retry):
+        self._count('timeouts' if isinstance(error, LLMTimeout) else 'errors')
+        logger.warning(f"Chat model {_model_name(llm)} attempt {retry + 1} failed: {error!r}")
+
+    ########### SYNC ###############
+
+    def _first_chunk(self, llm, input, config, kwargs, deadline):
+        """
+        Race one attempt (plus a hedge) to the first chunk.
+
+        Returns:
+            tuple: The first chunk (or _END) and an iterator over the rest.
+
+        Raises:
+            LLMTimeout or the attempt's error, before any chunk was produced.
+        """
+        out = queue.Queue()
+        cancelled = []
+
+        def pump(tag):
+            stream = llm.stream(input, config, **kwargs)
+            try:
+                for chunk in stream:
+                    if cancelled[tag].is_set():
+                        return
+                    out.put((tag, chunk, None))
+                out.put((tag, _END, None))
+            except Exception as e:
+                out.put((tag, None, e))
+            finally:
+                # Closes the upstream response of an abandoned attempt
+                stream.close()
+
+        def launch():
+            # One thread per attempt, not a shared pool: an attempt abandoned
+            # at a deadline or lost to a hedge stays blocked in its read until
+            # the client's read timeout (see chatbot._chat_model), and must not
+            # hold up the attempts of other requests meanwhile
+            cancelled.append(threading.Event())
+            self._count('attempts')
+            # In a copy of the caller's context, as LangChain's own executors
+            # do, so context-scoped callbacks and tracers follow the attempt
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(pump, len(cancelled) - 1), name='chat-llm', daemon=True,
+            ).start()
+
+        def cancel_all():
+            for event in cancelled:
+                event.set()
+
+        start = time.perf_counter()
+        first_deadline = min(start + self.first_token_timeout, deadline)
+        hedge_at = start + self.hedge_delay if self.hedge_delay is not None else None
+        launch()
+        running = 1
+        while True:
+            now = time.perf_counter()
+            wait_until = min(first_deadline, hedge_at) if hedge_at is not None else first_deadline
+            try:
+                tag, chunk, error = out.get(timeout=max(0, wait_until - now))
+            except queue.Empty:
+                now = time.perf_counter()
+                if hedge_at is not None and now < first_deadline:
+                    hedge_at = None
+                    self._count('hedges')
+                    launch()
+                    running += 1
+                    continue
+                cancel_all()
+                raise LLMTimeout(f"no first token after {now - start:.1f}s")
+            if error is not None:
+                running -= 1
+                if running == 0:
+                    raise error
+                continue
+            winner = tag
+            break
+
+        if winner:
+            self._count('hedge_wins')
+        for tag, event in enumerate(cancelled):
+            if tag != winner:
+                event.set()
+
+        def rest():
+            try:
+                while True:
+                    try:
+                        tag, chunk, error = out.get(timeout=max(0, deadline - time.perf_counter()))
+                    except queue.Empty:
+                        raise LLMTimeout("chat model call exceeded its deadline") from None
+                    if tag != winner:
+                        continue
+                    if error is not None:
+                        raise error
+                    if chunk is _END:
+                        return
+                    yield chunk
+            finally:
+                cancel_all()
+
+        return chunk, rest()
+
+    def _stream(self, input, config, kwargs):
+        self._count('calls')
+        deadline = time.perf_counter() + self.timeout
+        error = None
+        for index, llm in enumerate(self.models):
+            if time.perf_counter() >= deadline:
+                break
+            if index:
+                self._fall_back(llm)
+            for retry in range(self.max_retries + 1):
+                if retry:
+                    self._count('retries')
+                    time.sleep(min(backoff(retry - 1, self.backoff_base, self.backoff_max),
+                                   max(0, deadline - time.perf_counter())))
+                if time.perf_counter() >= deadline:
+                    break
+                try:
+                    first, rest = self._first_chunk(llm, input, config, kwargs, deadline)
+                except Exception as e:
+                    error = e
+                    self._failed(llm, e, retry)
+                    if not retryable(e):
+                        # Retrying this model won't help; the next one may
+                        break
+                    continue
+                if first is not _END:
+                    yield self._tag(llm, first)
+                    yield from rest
+                return
+        self._count('failures')
+        raise error or LLMTimeout("chat model call exceeded its deadline")
+
+    def _transform(self, inputs, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        for input in inputs:
+            yield from self._stream(input, config, kwargs)
+
+    def _invoke(self, input, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        message = None
+        for chunk in self._stream(input, config, kwargs):
+            message = chunk if message is None else message + chunk
+        return message_chunk_to_message(message) if message is not None else AIMessage(content="")
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self._transform_stream_with_config(iter([input]), self._transform, config, **kwargs)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    ########### ASYNC ###############
+
+    async def _afirst_chunk(self, llm, input, config, kwargs, deadline):
+        """
+        Async `_first_chunk`; losing attempts are cancelled.
+        """
+        out = asyncio.Queue()
+        tasks = []
+
+        async def pump(tag):
+            try:
+                async for chunk in llm.astream(input, config, **kwargs):
+                    await out.put((tag, chunk, None))
+                await out.put((tag, _END, None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await out.put((tag, None, e))
+
+        def launch():
+            self._count('attempts')
+            tasks.append(asyncio.ensure_future(pump(len(tasks))))
+
+        def cancel_all():
+            for task in tasks:
+                task.cancel()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # `deadline` is on the perf_counter clock
+        first_deadline = start + min(self.first_token_timeout, deadline - time.perf_counter())
+        hedge_at = start + self.hedge_delay if self.hedge_delay is not None else None
+        launch()
+        running = 1
+        try:
+            while True:
+                now = loop.time()
+                wait_until = min(first_deadline, hedge_at) if hedge_at is not None else first_deadline
+                try:
+                    tag, chunk, error = await asyncio.wait_for(out.get(), max(0, wait_until - now))
+                except asyncio.TimeoutError:
+                    now = loop.time()
+                    if hedge_at is not None and now < first_deadline:
+                        hedge_at = None
+                        self._count('hedges')
+                        launch()
+                        running += 1
+                        continue
+                    raise LLMTimeout(f"no first token after {now - start:.1f}s") from None
+                if error is not None:
+                    running -= 1
+                    if running == 0:
+                        raise error
+                    continue
+                winner = tag
+                break
+        except BaseException:
+            cancel_all()
+            raise
+
+        if winner:
+            self._count('hedge_wins')
+        for tag, task in enumerate(tasks):
+            if tag != winner:
+                task.cancel()
+
+        async def rest():
+            try:
+                while True:
+                    try:
+                        tag, chunk, error = await asyncio.wait_for(
+                            out.get(), max(0, deadline - time.perf_counter()),
+                        )
+                    except asyncio.TimeoutError:
+                        raise LLMTimeout("chat model call exceeded its deadline") from None
+                    if tag != winner:
+                        continue
+                    if error is not None:
+                        raise error
+                    if chunk is _END:
+                        return
+                    yield chunk
+            finally:
+                cancel_all()
+
+        return chunk, rest()
+
+    async def _astream(self, input, config, kwargs):
+        self._count('calls')
+        deadline = time.perf_counter() + self.timeout
+        error = None
+        for index, llm in enumerate(self.models):
+            if time.perf_counter() >= deadline:
+                break
+            if index:
+                self._fall_back(llm)
+            for retry in range(self.max_retries + 1):
+                if retry:
+                    self._count('retries')
+                    await asyncio.sleep(min(backoff(retry - 1, self.backoff_base, self.backoff_max),
+                                            max(0, deadline - time.perf_counter())))
+                if time.perf_counter() >= deadline:
+                    break
+                try:
+                    first, rest = await self._afirst_chunk(llm, input, config, kwargs, deadline)
+                except Exception as e:
+                    error = e
+                    self._failed(llm, e, retry)
+                    if not retryable(e):
+                        break
+                    continue
+                if first is not _END:
+                    yield self._tag(llm, first)
+                    async for chunk in rest:
+                        yield chunk
+                return
+        self._count('failures')
+        raise error or LLMTimeout("chat model call exceeded its deadline")
+
+    async def _atransform(self, inputs, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        async for input in inputs:
+            async for chunk in self._astream(input, config, kwargs):
+                yield chunk
+
+    async def _ainvoke(self, input, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        message = None
+        async for chunk in self._astream(input, config, kwargs):
+            message = chunk if message is None else message + chunk
+        return message_chunk_to_message(message) if message is not None else AIMessage(content="")
+
+    async def astream(self, input, config=None, **kwargs):
+        async def inputs():
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(inputs(), self._atransform, config, **kwargs):
+            yield chunk
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
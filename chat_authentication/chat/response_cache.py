@@ -0,0 +1,360 @@
+# chat/response_cache.py
+"""
+Cache of LLM answers for the chat chains.
+
+`CachedChatModel` stands in for the LLM at the end of `runnable` and
+`question_answer_chain` (see chat.chatbot), so it sees the final prompt and
+cached answers go back through the same invoke/stream path as fresh ones.
+Two levels are looked up:
+
+    exact    - SHA-256 of the model and every prompt message (system prompt,
+               recalled memory or retrieved context, trimmed history, input)
+    semantic - opt-in, for turns without history: the most similar cached
+               input under the same system messages, above a cosine threshold;
+               the input is only embedded once the exact level has missed
+
+Entries live in a SQLite database (a file, or shared in-memory) with a TTL
+and LRU eviction beyond MAX_ENTRIES. Lookups skip expired entries; deleting
+them and the overflow is batched (see `EVICT_EVERY`).
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from itertools import count
+
+import numpy as np
+from django.conf import settings
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import patch_config
+
+from .components import registry
+from .vectors import from_bytes, to_bytes
+
+_memory_databases = count()
+
+# Writes between evictions, even below the cap: expired entries are deleted
+# then, as are entries other processes sharing the file have added
+EVICT_EVERY = 100
+
+
+def _digest(data):
+    return hashlib.sha256(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+class ResponseKey:
+    """
+    Cache keys of one prompt.
+    """
+
+    def __init__(self, model, prompt):
+        messages = prompt.to_messages()
+        self.key = _digest([model, [(m.type, m.content) for m in messages]])
+        # Only turns whose prompt is system messages plus the input qualify
+        # for the semantic level; they are matched among answers given under
+        # the same system messages, so recalled memory never crosses users
+        self.semantic = (
+            bool(messages) and messages[-1].type == 'human'
+            and all(m.type == 'system' for m in messages[:-1])
+        )
+        self.partition = _digest([model, [m.content for m in messages[:-1]]]) if self.semantic else None
+        self.query = messages[-1].content if self.semantic else None
+        self.vector = None
+
+
+class ResponseCache:
+    def __init__(self, path=None, ttl=86400, max_entries=10000, semantic=False, semantic_threshold=0.95):
+        """
+        Args:
+            path (str): SQLite file, or None for a database in memory.
+            ttl (int): Seconds an answer stays valid.
+            max_entries (int): Least recently used answers beyond this are dropped.
+            semantic (bool): Enable the semantic level.
+            semantic_threshold (float): Minimum cosine similarity of inputs.
+        """
+        if path is None:
+            # Shared between this process's connections, gone when they close
+            self.path, self.uri = f"file:chat-responses-{next(_memory_databases)}?mode=memory&cache=shared", True
+        else:
+            self.path, self.uri = str(path), False
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Shared-cache in-memory databases fail instead of waiting on locks,
+        # so database access is serialized (it is all local and short)
+        self._db_lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # Also keeps an in-memory database alive
+        self._keepalive = self._connection()
+        with self._keepalive as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, partition TEXT, vector BLOB, "
+                "answer TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_partition ON responses (partition)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+            # Estimated entry count (replaced entries count again), recounted on eviction
+            self._entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self._writes = 0
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, uri=self.uri, timeout=30, check_same_thread=False)
+            if not self.uri:
+                db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def _count(self, kind):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+
+    def wants_vector(self, key):
+        """
+        Whether a miss of `key` at the exact level goes on to the semantic
+        level, which needs `key.vector`.
+        """
+        return self.semantic and key.semantic
+
+    def get(self, key):
+        """
+        Exact lookup.
+
+        Returns:
+            str or None: The cached answer for the prompt.
+        """
+        now = time.time()
+        with self._db_lock, self._connection() as db:
+            row = db.execute(
+                "SELECT answer FROM responses WHERE key = ? AND created > ?", [key.key, now - self.ttl],
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE responses SET used = ? WHERE key = ?", [now, key.key])
+        if row is not None:
+            self._count('exact_hits')
+            return row[0]
+        if not self.wants_vector(key):
+            self._count('misses')
+        return None
+
+    def get_similar(self, key):
+        """
+        Semantic lookup, after an exact miss; `key.vector` must be set.
+
+        Returns:
+            str or None: The answer to the most similar cached input.
+        """
+        now = time.time()
+        with self._db_lock, self._connection() as db:
+            row = self._nearest(db, key, now)
+            if row is not None:
+                db.execute("UPDATE responses SET used = ? WHERE key = ?", [now, row[0]])
+        self._count('semantic_hits' if row is not None else 'misses')
+        return row[1] if row is not None else None
+
+    def _nearest(self, db, key, now):
+        rows = db.execute(
+            "SELECT key, answer, vector FROM responses WHERE partition = ? AND vector IS NOT NULL AND created > ?",
+            [key.partition, now - self.ttl],
+        ).fetchall()
+        if not rows:
+            return None
+        matrix = np.vstack([from_bytes(vector) for _, _, vector in rows])
+        query = np.asarray(key.vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        scores = matrix @ query / np.maximum(norms, 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] < self.semantic_threshold:
+            return None
+        return rows[best][:2]
+
+    def set(self, key, answer):
+        now = time.time()
+        vector = to_bytes(key.vector) if key.vector is not None else None
+        with self._db_lock, self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, partition, vector, answer, created, used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [key.key, key.partition, vector, answer, now, now],
+            )
+            self._entries += 1
+            self._writes += 1
+            if self._entries > self.max_entries or self._writes >= EVICT_EVERY:
+                self._evict(db, now)
+
+    def _evict(self, db, now):
+        """
+        Delete expired entries and the least recently used ones beyond
+        `max_entries`. Called with the database lock held.
+        """
+        db.execute("DELETE FROM responses WHERE created <= ?", [now - self.ttl])
+        db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            [self.max_entries],
+        )
+        self._entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self._writes = 0
+
+    def clear(self):
+        with self._db_lock, self._connection() as db:
+            db.execute("DELETE FROM responses")
+            self._entries = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hits per level, misses and the overall hit rate.
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
+
+
+def _build_response_cache():
+    config = settings.CHAT_RESPONSE_CACHE
+    if not config:
+        return None
+    return ResponseCache(
+        path=config.get('PATH'),
+        ttl=config['TTL'],
+        max_entries=config['MAX_ENTRIES'],
+        semantic=config.get('SEMANTIC', False),
+        semantic_threshold=config.get('SEMANTIC_THRESHOLD', 0.95),
+    )
+
+
+registry.register('response_cache', _build_response_cache)
+
+
+class CachedChatModel(Runnable):
+    """
+    Runnable wrapper that answers from the response cache when it can and
+    otherwise calls (and streams) the wrapped chat model, caching its answer.
+    Calls run through the Runnable config helpers, so callbacks and tracing
+    see this step with the chat model's run nested under it.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.model = f"{type(llm).__name__}:{getattr(llm, 'model_name', None) or getattr(llm, 'model', '')}"
+
+    def _lookup(self, cache, prompt):
+        key = ResponseKey(self.model, prompt)
+        answer = cache.get(key)
+        if answer is None and cache.wants_vector(key):
+            # Only embedded when the exact level missed
+            key.vector = registry.get('embedding').embed_query(key.query)
+            answer = cache.get_similar(key)
+        return key, answer
+
+    async def _alookup(self, cache, prompt):
+        key = ResponseKey(self.model, prompt)
+        answer = await asyncio.to_thread(cache.get, key)
+        if answer is None and cache.wants_vector(key):
+            key.vector = await registry.get('embedding').aembed_query(key.query)
+            answer = await asyncio.to_thread(cache.get_similar, key)
+        return key, answer
+
+    @staticmethod
+    def _cacheable(chunks):
+        # Answers from a fallback model (see chat.resilience) are not cached
+        # under the primary model's key
+        return not any(chunk.response_metadata.get('fallback_model') for chunk in chunks)
+
+    ########### SYNC ###############
+
+    def _invoke(self, input, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        cache = registry.get('response_cache')
+        if cache is None:
+            return self.llm.invoke(input, config, **kwargs)
+        key, answer = self._lookup(cache, input)
+        if answer is not None:
+            return AIMessage(content=answer)
+        message = self.llm.invoke(input, config, **kwargs)
+        if self._cacheable([message]):
+            cache.set(key, message.content)
+        return message
+
+    def _transform(self, inputs, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        cache = registry.get('response_cache')
+        for input in inputs:
+            if cache is None:
+                yield from self.llm.stream(input, config, **kwargs)
+                continue
+            key, answer = self._lookup(cache, input)
+            if answer is not None:
+                yield AIMessageChunk(content=answer)
+                continue
+            chunks = []
+            for chunk in self.llm.stream(input, config, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            if self._cacheable(chunks):
+                cache.set(key, "".join(chunk.content for chunk in chunks))
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self._transform_stream_with_config(iter([input]), self._transform, config, **kwargs)
+
+    ########### ASYNC ###############
+
+    async def _ainvoke(self, input, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        cache = registry.get('response_cache')
+        if cache is None:
+            return await self.llm.ainvoke(input, config, **kwargs)
+        key, answer = await self._alookup(cache, input)
+        if answer is not None:
+            return AIMessage(content=answer)
+        message = await self.llm.ainvoke(input, config, **kwargs)
+        if self._cacheable([message]):
+            await asyncio.to_thread(cache.set, key, message.content)
+        return message
+
+    async def _atransform(self, inputs, run_manager, config, **kwargs):
+        config = patch_config(config, callbacks=run_manager.get_child())
+        cache = registry.get('response_cache')
+        async for input in inputs:
+            if cache is None:
+                async for chunk in self.llm.astream(input, config, **kwargs):
+                    yield chunk
+                continue
+            key, answer = await self._alookup(cache, input)
+            if answer is not None:
+                yield AIMessageChunk(content=answer)
+                continue
+            chunks = []
+            async for chunk in self.llm.astream(input, config, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            if self._cacheable(chunks):
+                await asyncio.to_thread(cache.set, key, "".join(chunk.content for chunk in chunks))
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    async def astream(self, input, config=None, **kwargs):
+        async def inputs():
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(inputs(), self._atransform, config, **kwargs):
+            yield chunk
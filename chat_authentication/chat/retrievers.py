@@ -0,0 +1,122 @@
+# chat/retrievers.py
+"""
+Local vector store for retrieval-augmented answers.
+
+DjangoVectorStore is a LangChain VectorStore over the DocumentChunk table, so
+`as_retriever(search_type="similarity_score_threshold", ...)` and the chains in
+chat.chatbot work with it unchanged. Searches run in the application database
+through a chat.vectors store: the HNSW-indexed pgvector column (migration
+0012) or an in-memory NumPy index, which needs no network and suits tests.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from .models import DocumentChunk
+from .vectors import build_vector_store, to_bytes
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chunk_source(metadata):
+    return str(metadata.get('source', ''))[:DocumentChunk._meta.get_field('source').max_length]
+
+
+class DjangoVectorStore(VectorStore):
+    def __init__(self, embedding, collection, store=None):
+        """
+        Args:
+            embedding (Embeddings): Embeds queries and added texts.
+            collection (str): The DocumentChunk collection to search.
+            store: A chat.vectors store; defaults to the CHAT_VECTOR_STORE one.
+        """
+        self.embedding = embedding
+        self.collection = collection
+        self.store = store or build_vector_store(settings.CHAT_VECTOR_STORE, DocumentChunk, 'collection', 'id')
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        chunks = self.upsert(texts, metadatas, self.embedding.embed_documents(texts))
+        ids = {(chunk.source, chunk.content_hash): chunk.id for chunk in chunks}
+        return [
+            str(ids[(chunk_source(metadata), content_hash(text))])
+            for text, metadata in zip(texts, metadatas)
+        ]
+
+    def upsert(self, texts, metadatas, vectors):
+        """
+        Store already-embedded chunks in one INSERT. A chunk the collection
+        already has for the same source (same content hash) is left as is.
+
+        Returns:
+            list[DocumentChunk]: The stored rows for the given chunks.
+        """
+        chunks = [
+            DocumentChunk(
+                collection=self.collection, source=chunk_source(metadata), content_hash=content_hash(text),
+                content=text, metadata=metadata, vector=to_bytes(vector),
+            )
+            for text, metadata, vector in zip(texts, metadatas, vectors)
+        ]
+        DocumentChunk.objects.bulk_create(chunks, ignore_conflicts=True)
+        # ignore_conflicts leaves the ids unset, so read back the rows. The
+        # same content may also be stored under other sources, which must not
+        # be returned (or have their vectors rewritten by the store)
+        keys = {(chunk.source, chunk.content_hash) for chunk in chunks}
+        stored = [
+            chunk for chunk in DocumentChunk.objects.filter(
+                collection=self.collection,
+                source__in={source for source, _ in keys},
+                content_hash__in={content_hash for _, content_hash in keys},
+            )
+            if (chunk.source, chunk.content_hash) in keys
+        ]
+        self.store.add(stored)
+        return stored
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, collection=None, **kwargs):
+        store = cls(embedding, collection or settings.CHAT_RAG_COLLECTION)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def similarity_search_by_vector_with_score(self, vector, k=4):
+        """
+        Returns:
+            list[tuple]: Up to `k` (Document, cosine similarity), best first.
+        """
+        hits = self.store.search(self.collection, vector, k)
+        chunks = DocumentChunk.objects.in_bulk([chunk_id for chunk_id, _ in hits])
+        return [
+            (Document(page_content=chunks[chunk_id].content, metadata=chunks[chunk_id].metadata), score)
+            for chunk_id, score in hits
+            if chunk_id in chunks
+        ]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    async def asimilarity_search_with_score(self, query, k=4, **kwargs):
+        # The database part runs on the thread that owns the ORM connection
+        vector = await self.embedding.aembed_query(query)
+        return await sync_to_async(self.similarity_search_by_vector_with_score)(vector, k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores already are cosine similarities, which the score threshold is meant for
+        return lambda score: score
@@ -0,0 +1,203 @@
+# chat/rewrite.py
+"""
+History-aware retrieval with a fast path for the question rewrite.
+
+LangChain's `create_history_aware_retriever` asks the LLM to rewrite every
+question that has history into a standalone one before retrieving, a full
+serial round-trip per RAG turn. Here the rewrite is skipped when there is no
+history or the question looks self-contained (`needs_rewrite`, a cheap local
+heuristic). With CHAT_RAG_PARALLEL_RETRIEVAL, questions that are rewritten are
+also retrieved as asked while the LLM works, and both result lists are merged.
+The rewritten question is embedded as soon as the LLM returns it, still off
+the calling thread, so only its database search follows the rewrite.
+
+`rewrite_stats` counts skipped rewrites and estimates the latency they saved
+(reported by api/metrics/).
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+# Words that usually point back into the conversation
+_REFERENCE_WORDS = {
+    'it', 'its', 'this', 'that', 'these', 'those', 'they', 'them', 'their',
+    'he', 'she', 'him', 'her', 'his', 'there', 'above', 'previous', 'earlier',
+    'same', 'former', 'latter', 'one', 'ones', 'else', 'more', 'again', 'also',
+}
+_FOLLOW_UP_STARTS = ('and ', 'but ', 'so ', 'or ', 'what about', 'how about', 'why not')
+# Questions this short rarely stand on their own ("Why?", "In Python?")
+_MIN_WORDS = 4
+
+
+def needs_rewrite(question, history):
+    """
+    Whether `question` should be rewritten into a standalone question before
+    retrieval. Errs towards rewriting.
+    """
+    if not history:
+        return False
+    text = question.strip().lower()
+    words = re.findall(r"[a-z0-9']+", text)
+    if len(words) < _MIN_WORDS or text.startswith(_FOLLOW_UP_STARTS):
+        return True
+    return any(word in _REFERENCE_WORDS for word in words)
+
+
+class RewriteStats:
+    """
+    Thread-safe counters of rewrite decisions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.no_history = 0
+            self.self_contained = 0
+            self.rewritten = 0
+            self.rewrite_seconds = 0.0
+
+    def record_skip(self, had_history):
+        with self._lock:
+            if had_history:
+                self.self_contained += 1
+            else:
+                self.no_history += 1
+
+    def record_rewrite(self, seconds):
+        with self._lock:
+            self.rewritten += 1
+            self.rewrite_seconds += seconds
+
+    def report(self):
+        """
+        Returns:
+            dict: Decision counts, the skip rate, and the latency saved
+                estimated from the average rewrite time.
+        """
+        with self._lock:
+            skipped = self.no_history + self.self_contained
+            total = skipped + self.rewritten
+            average = self.rewrite_seconds / self.rewritten if self.rewritten else 0.0
+            return {
+                'turns': total,
+                'skipped_no_history': self.no_history,
+                'skipped_self_contained': self.self_contained,
+                'rewritten': self.rewritten,
+                'skip_rate': skipped / total if total else 0.0,
+                'average_rewrite_seconds': average,
+                'estimated_seconds_saved': skipped * average,
+            }
+
+
+rewrite_stats = RewriteStats()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Runs the rewrite LLM call (and the query embedding) of sync chains while
+    # the calling thread retrieves (the database connection belongs to that thread)
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-rewrite')
+        return _executor
+
+
+def _merge(rewritten_docs, raw_docs, k):
+    merged, seen = [], set()
+    for doc in [*rewritten_docs, *raw_docs]:
+        if doc.page_content not in seen:
+            seen.add(doc.page_content)
+            merged.append(doc)
+    return merged[:k]
+
+
+def _cached_query_embeddings(retriever):
+    """
+    The CachedEmbeddings a vector store retriever embeds its query with, or
+    None. Embedding a question with them elsewhere first makes the retriever's
+    own embedding a cache hit.
+    """
+    from .embedding_cache import CachedEmbeddings
+
+    embeddings = getattr(getattr(retriever, 'vectorstore', None), 'embeddings', None)
+    return embeddings if isinstance(embeddings, CachedEmbeddings) else None
+
+
+def build_history_aware_retriever(llm, retriever, prompt):
+    """
+    Drop-in replacement for `create_history_aware_retriever`: takes
+    {"input", "chat_history"} and returns the retrieved Documents.
+
+    CHAT_RAG_REWRITE is 'always' (rewrite every question with history, as
+    LangChain does) or 'auto' (skip the rewrite for self-contained questions).
+    """
+    rewrite_chain = prompt | llm | StrOutputParser()
+    query_embeddings = _cached_query_embeddings(retriever)
+
+    def should_rewrite(inputs):
+        history = inputs.get("chat_history")
+        if settings.CHAT_RAG_REWRITE == 'always':
+            rewrite = bool(history)
+        else:
+            rewrite = needs_rewrite(inputs["input"], history)
+        if not rewrite:
+            rewrite_stats.record_skip(bool(history))
+        logger.debug(f"Question rewrite {'needed' if rewrite else 'skipped'}: {inputs['input']!r}")
+        return rewrite
+
+    def timed_rewrite(inputs, config):
+        start = time.perf_counter()
+        question = rewrite_chain.invoke(inputs, config)
+        rewrite_stats.record_rewrite(time.perf_counter() - start)
+        return question
+
+    async def atimed_rewrite(inputs, config):
+        start = time.perf_counter()
+        question = await rewrite_chain.ainvoke(inputs, config)
+        rewrite_stats.record_rewrite(time.perf_counter() - start)
+        return question
+
+    def rewrite_and_embed(inputs, config):
+        question = timed_rewrite(inputs, config)
+        if query_embeddings is not None:
+            query_embeddings.embed_query(question)
+        return question
+
+    def retrieve(inputs, config):
+        if not should_rewrite(inputs):
+            return retriever.invoke(inputs["input"], config)
+        if not settings.CHAT_RAG_PARALLEL_RETRIEVAL:
+            return retriever.invoke(timed_rewrite(inputs, config), config)
+        future = _get_executor().submit(rewrite_and_embed, inputs, config)
+        raw_docs = retriever.invoke(inputs["input"], config)
+        return _merge(retriever.invoke(future.result(), config), raw_docs, settings.CHAT_RAG_TOP_K)
+
+    async def aretrieve_rewritten(inputs, config):
+        return await retriever.ainvoke(await atimed_rewrite(inputs, config), config)
+
+    async def aretrieve(inputs, config):
+        if not should_rewrite(inputs):
+            return await retriever.ainvoke(inputs["input"], config)
+        if not settings.CHAT_RAG_PARALLEL_RETRIEVAL:
+            return await retriever.ainvoke(await atimed_rewrite(inputs, config), config)
+        rewritten_docs, raw_docs = await asyncio.gather(
+            aretrieve_rewritten(inputs, config), retriever.ainvoke(inputs["input"], config),
+        )
+        return _merge(rewritten_docs, raw_docs, settings.CHAT_RAG_TOP_K)
+
+    return RunnableLambda(retrieve, afunc=aretrieve, name="chat_retriever_chain")
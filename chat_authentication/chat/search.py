@@ -0,0 +1,123 @@
+# chat/search.py
+"""
+Ranked full-text search over a user's messages.
+
+Uses the structures created by migrations 0010 and 0015: the generated
+`search_vector` column on PostgreSQL, indexed together with the message's
+user, and the FTS5 table on SQLite. Other databases get an unindexed
+`icontains` scan, fine for development only.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatMessage
+
+# Placeholders the database puts around matches; swapped for <mark> tags after
+# the snippet text has been HTML-escaped
+_START, _STOP = '\x02', '\x03'
+
+# `search_user_id` (migration 0015) lets one index scan find the user's
+# matches; headlines are only built for the page of hits, not for every match
+_POSTGRES_SQL = f"""
+    SELECT hit.id, hit.conversation_id, c.title, hit.timestamp, hit.rank,
+           ts_headline('english', coalesce(hit.user_response, '') || ' ' || coalesce(hit.ai_response, ''),
+                       hit.query, 'StartSel={_START}, StopSel={_STOP}, MaxFragments=2, MinWords=5, MaxWords=20')
+    FROM (
+        SELECT m.id, m.conversation_id, m.timestamp, m.user_response, m.ai_response,
+               ts_rank_cd(m.search_vector, query) AS rank, query
+        FROM chat_chatmessage m, websearch_to_tsquery('english', %s) query
+        WHERE m.search_user_id = %s AND m.search_vector @@ query
+        ORDER BY rank DESC, m.timestamp DESC
+        LIMIT %s
+    ) hit
+    JOIN chat_conversation c ON c.id = hit.conversation_id
+    ORDER BY hit.rank DESC, hit.timestamp DESC
+"""
+
+_SQLITE_SQL = f"""
+    SELECT m.id, m.conversation_id, c.title, m.timestamp, -bm25(chat_chatmessage_fts) AS rank,
+           snippet(chat_chatmessage_fts, -1, '{_START}', '{_STOP}', '…', 16)
+    FROM chat_chatmessage_fts
+    JOIN chat_chatmessage m ON m.id = chat_chatmessage_fts.rowid
+    JOIN chat_conversation c ON c.id = m.conversation_id
+    WHERE chat_chatmessage_fts MATCH %s AND c.user_id = %s
+    ORDER BY bm25(chat_chatmessage_fts), m.timestamp DESC
+    LIMIT %s
+"""
+
+
+def _fts5_query(text):
+    # Quote every word so user input can't use (or break) FTS5 query syntax
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def _highlight(snippet):
+    return html.escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _result(message_id, conversation_id, title, timestamp, rank, snippet):
+    if isinstance(timestamp, str):
+        # Raw SQLite cursors return text
+        timestamp = parse_datetime(timestamp)
+    return {
+        'message_id': message_id,
+        'conversation_id': conversation_id,
+        'conversation_title': title,
+        'timestamp': timestamp,
+        'rank': rank,
+        'snippet': _highlight(snippet),
+    }
+
+
+def search_messages(user, text, limit=20):
+    """
+    Search the user's messages.
+
+    Args:
+        user (User): Whose conversations to search.
+        text (str): The search terms (PostgreSQL also understands "quoted
+            phrases", OR and -exclusions).
+        limit (int): Maximum number of results.
+
+    Returns:
+        list[dict]: Best matches first, each with an HTML-safe `snippet` in
+            which matches are wrapped in <mark> tags.
+    """
+    if not text.strip():
+        return []
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(_POSTGRES_SQL, [text, user.id, limit])
+            return [_result(*row) for row in cursor.fetchall()]
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(_SQLITE_SQL, [_fts5_query(text), user.id, limit])
+            return [_result(*row) for row in cursor.fetchall()]
+
+    return _search_unindexed(user, text, limit)
+
+
+def _search_unindexed(user, text, limit):
+    words = text.split()
+    matches = Q()
+    for word in words:
+        matches &= Q(user_response__icontains=word) | Q(ai_response__icontains=word)
+    rows = (
+        ChatMessage.objects.filter(matches, conversation__user=user)
+        .order_by('-timestamp')
+        .values_list('id', 'conversation_id', 'conversation__title', 'timestamp', 'user_response', 'ai_response')
+        [:limit]
+    )
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    results = []
+    for message_id, conversation_id, title, timestamp, user_response, ai_response in rows:
+        text = ' '.join(filter(None, [user_response, ai_response]))
+        snippet = pattern.sub(lambda m: f"{_START}{m.group(0)}{_STOP}", text)
+        results.append(_result(message_id, conversation_id, title, timestamp, 0.0, snippet))
+    return results
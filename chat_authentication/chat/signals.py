@@ -1,11 +1,14 @@
-# # signals.py
-# from django.db.models.signals import post_save
-# from django.dispatch import receiver
-# from .models import ChatMessage
-# 
-# @receiver(post_save, sender=ChatMessage)
-# def log_message_creation(sender, instance, created, **kwargs):
-#     if created:
-#         print(f"New message added: {instance.user_response or instance.ai_response}")
-#     else:
-#         print(f"Message updated: {instance.user_response or instance.ai_response}")
+# chat/signals.py
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .history_cache import get_history_cache
+from .models import Conversation
+
+
+@receiver(post_delete, sender=Conversation)
+def invalidate_history_cache(sender, instance, **kwargs):
+    """
+    Drop the cached history of a deleted conversation.
+    """
+    get_history_cache().delete(instance.id)
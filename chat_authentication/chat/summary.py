@@ -0,0 +1,80 @@
+# chat/summary.py
+import logging
+
+from django.conf import settings
+
+from . import jobs
+from .components import registry
+from .custom_chat_history import DjangoChatMessageHistory
+from .history_cache import get_history_cache
+from .models import BackgroundJob, ChatMessage, Conversation
+
+logger = logging.getLogger(__name__)
+
+
+def _format_lines(rows):
+    lines = []
+    for user_response, ai_response in rows:
+        if user_response:
+            lines.append(f"Human: {user_response}")
+        if ai_response:
+            lines.append(f"AI: {ai_response}")
+    return "\n".join(lines)
+
+
+def run_summary_job(job):
+    """
+    Background job handler: fold the turns that fell out of the history window
+    since the last run into the conversation's rolling summary.
+
+    Only rows newer than `Conversation.summarized_through` are sent to the LLM,
+    together with the current summary, so the summary is never rebuilt from scratch.
+    At most CHAT_SUMMARY_MAX_ROWS rows are folded per run; if more are left, a
+    follow-up job is queued for them.
+    """
+    from .chatbot import summary_prompt
+
+    conversation = job.conversation
+    window_start = DjangoChatMessageHistory(conversation_id=conversation.id).load_window().start_row_id()
+
+    rows = ChatMessage.objects.filter(conversation=conversation, id__gt=conversation.summarized_through)
+    if window_start is not None:
+        rows = rows.filter(id__lt=window_start)
+    max_rows = settings.CHAT_SUMMARY_MAX_ROWS
+    rows = list(rows.order_by('timestamp', 'id').values_list('id', 'user_response', 'ai_response')[:max_rows + 1])
+    more = len(rows) > max_rows
+    rows = rows[:max_rows]
+    if not rows:
+        return
+
+    response = (summary_prompt | registry.get('llm')).invoke({
+        'summary': conversation.summary or "(none)",
+        'new_lines': _format_lines((user, ai) for _, user, ai in rows),
+    })
+
+    # Guard against a concurrent job having moved the summary on meanwhile
+    updated = Conversation.objects.filter(
+        id=conversation.id, summarized_through=conversation.summarized_through,
+    ).update(summary=response.content.strip(), summarized_through=rows[-1][0])
+    if updated:
+        # Cached entries carry the old summary
+        get_history_cache().delete(conversation.id)
+        logger.info(f"Folded {len(rows)} message(s) into the summary of conversation {conversation.id}")
+        if more:
+            jobs.enqueue(conversation, BackgroundJob.KIND_SUMMARY)
+
+
+def summary_due(conversation):
+    """
+    Whether rows have left the history window without being folded into the
+    rolling summary yet. The window is read from the history cache when it
+    holds the conversation.
+    """
+    window_start = DjangoChatMessageHistory(
+        conversation_id=conversation.id, conversation=conversation,
+    ).window_start_row_id()
+    if window_start is None:
+        return False
+    return ChatMessage.objects.filter(
+        conversation=conversation, id__gt=conversation.summarized_through, id__lt=window_start,
+    ).exists()
@@ -6,20 +6,71 @@ from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
-from .models import Conversation, ChatMessage
-from .custom_chat_history import DjangoChatMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage
-from .views import generate_title
-from .chatbot import runnable_with_history
+from .models import Conversation, ChatMessage, BackgroundJob, TurnEmbedding, DocumentChunk
+from .custom_chat_history import DjangoChatMessageHistory, AsyncDjangoChatMessageHistory, _build_history_tokenizer
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.language_models import FakeListChatModel
+from django.test import override_settings
+from . import chatbot
+from .titles import generate_title, temporary_title, run_title_job, TEMPORARY_TITLE_PREFIX
+from .title_service import TitleBatcher, make_server
+from . import jobs
+from .components import ComponentRegistry, registry
+from .summary import run_summary_job, summary_due
+from .history_cache import LocalHistoryCache, get_history_cache
+from .archive import import_lines
+from .memory import recall
+from .vectors import NumpyVectorStore
+from .retrievers import DjangoVectorStore
+from .ingest import ingest
+from .embedding_cache import CachedEmbeddings, SqliteEmbeddingStore
+from .rewrite import build_history_aware_retriever, needs_rewrite, rewrite_stats
+from .response_cache import CachedChatModel, ResponseCache, ResponseKey
+from .gateway import GatewayOverloaded, LLMGateway
+from .fakes import FakeLLMError, LatencyFakeChatModel
+from .resilience import ResilientChatModel
+import asyncio
+import json
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+import threading
+import os
+import urllib.error
+import urllib.request
+import tempfile
+from langchain_core.embeddings import Embeddings
+from langchain_core.tracers.context import collect_runs
 from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from unittest import mock
+import gzip
+import numpy as np
 import time
 
 
+# Offline stand-ins for the hosted models (see chat.fakes)
+FAKE_MODELS = {
+    'TTFT': 0.0,
+    'TOKENS_PER_SECOND': None,
+    'RESPONSES': [
+        "AI is the field of building systems that learn from data.",
+        "It works by training a learning algorithm on many examples.",
+    ],
+}
+
+
+@override_settings(CHAT_FAKE_MODELS=FAKE_MODELS, CHAT_EMBEDDING_CACHE=None)
 class HandleMessageTestCase(APITestCase):
     def setUp(self):
         """
         Set up test data and environment for testing the handle_message view.
         """
+        # Rebuild the chains on the fake models
+        registry.reset()
+
         # Create a test user
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         
@@ -37,7 +88,7 @@ class HandleMessageTestCase(APITestCase):
         """
         Helper method to invoke a message using runnable_with_history and return the AI response.
         """
-        return runnable_with_history.invoke(
+        return chatbot.runnable_with_history.invoke(
             {"input": input_message},
             config={"configurable": {"session_id": conversation_id}}
         )
@@ -77,13 +128,11 @@ class HandleMessageTestCase(APITestCase):
         print(f"Stored Messages After Continuation: {[(msg.user_response, msg.ai_response) for msg in stored_messages]}")  # Debug output
 
         # Verify the number of stored messages
-        self.assertEqual(len(stored_messages), 4)  # Initial 2 messages + 2 from this test
+        self.assertEqual(len(stored_messages), 2)  # One row per turn
 
         # Verify user and AI messages are stored correctly
-        self._assert_stored_message(stored_messages[0], "Tell me about AI.", None)
-        self._assert_stored_message(stored_messages[1], None, response_1.content.strip())
-        self._assert_stored_message(stored_messages[2], "How does it work?", None)
-        self._assert_stored_message(stored_messages[3], None, response_2.content.strip())
+        self._assert_stored_message(stored_messages[0], "Tell me about AI.", response_1.content.strip())
+        self._assert_stored_message(stored_messages[1], "How does it work?", response_2.content.strip())
 
     def _assert_stored_message(self, message, expected_user_response, expected_ai_response):
         """
@@ -118,8 +167,1242 @@ class HandleMessageTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("error", response.json())
 
+    def test_handle_message_stream_missing_input(self):
+        """
+        Test that the streaming endpoint rejects a request without an input message.
+        """
+        response = self.client.post(
+            reverse('handle_message_stream'),
+            {'conversation_id': str(self.conversation.id)},  # Missing input_message
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("error", response.json())
+
+    def test_handle_message_stream_sends_tokens_then_done(self):
+        """
+        Test that the streaming endpoint sends the answer as token events, ends with a done event and stores the turn.
+        """
+        response = self.client.post(
+            reverse('handle_message_stream'),
+            {'input_message': "Tell me about AI.", 'conversation_id': str(self.conversation.id)},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = []
+        for raw in b"".join(response.streaming_content).decode().split("\n\n"):
+            if raw:
+                event, data = raw.split("\n")
+                events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        tokens = [data['content'] for event, data in events if event == 'token']
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual("".join(tokens), FAKE_MODELS['RESPONSES'][0])
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(events[-1][1]['conversation_id'], self.conversation.id)
+
+        turn = ChatMessage.objects.get(conversation=self.conversation)
+        self.assertEqual((turn.user_response, turn.ai_response), ("Tell me about AI.", FAKE_MODELS['RESPONSES'][0]))
+
+    def test_async_handle_message_missing_input(self):
+        """
+        Test that the async endpoint authenticates the token and validates input.
+        """
+        response = self.client.post(
+            reverse('ahandle_message'),
+            {'conversation_id': str(self.conversation.id)},  # Missing input_message
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("error", response.json())
+
+        self.client.credentials()  # Drop the token
+        response = self.client.get(reverse('aget_conversations'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def tearDown(self):
         """
         Clean up after tests.
         """
-        self.client.credentials()  # Reset client authentication
\ No newline at end of file
+        self.client.credentials()  # Reset client authentication
+        registry.reset()
+
+class AsyncChatMessageHistoryTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a user and an empty conversation.
+        """
+        self.user = User.objects.create_user(username='asyncuser', password='testpassword')
+        self.conversation = Conversation.objects.create(title='Async Conversation', user=self.user)
+        get_history_cache().clear()
+
+    async def test_add_get_and_clear_messages(self):
+        """
+        Test that a turn is stored as one row and read back in order.
+        """
+        history = AsyncDjangoChatMessageHistory(conversation_id=self.conversation.id)
+        await history.aadd_messages([HumanMessage(content="Hi"), AIMessage(content="Hello!")])
+        self.assertEqual(await ChatMessage.objects.filter(conversation=self.conversation).acount(), 1)
+
+        messages = await history.aget_messages()
+        self.assertEqual(messages, [HumanMessage(content="Hi"), AIMessage(content="Hello!")])
+
+        await history.aclear()
+        self.assertEqual(await history.aget_messages(), [])
+
+    @override_settings(CHAT_HISTORY_MAX_TOKENS=3000)
+    async def test_tokenizer_is_built_off_the_event_loop(self):
+        """
+        Test that the first async history read builds the token counter on a worker thread.
+        """
+        threads = []
+
+        def build_tokenizer():
+            threads.append(threading.current_thread())
+            return lambda text: len(text)
+
+        registry.register('history_tokenizer', build_tokenizer)
+        registry.reset('history_tokenizer')
+        try:
+            history = AsyncDjangoChatMessageHistory(conversation_id=self.conversation.id)
+            await history.aadd_messages([HumanMessage(content="Hi"), AIMessage(content="Hello!")])
+            self.assertEqual(len(await history.aget_messages()), 2)
+        finally:
+            registry.register('history_tokenizer', _build_history_tokenizer)
+            registry.reset('history_tokenizer')
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+@override_settings(CHAT_FAKE_MODELS=FAKE_MODELS)
+class TitleJobTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a conversation that still has a temporary title.
+        """
+        self.user = User.objects.create_user(username='titleuser', password='testpassword')
+        self.conversation = Conversation.objects.create(title=temporary_title(), user=self.user)
+
+    def test_title_job_replaces_temporary_title(self):
+        """
+        Test that a queued title job is processed off the request path.
+        """
+        jobs.enqueue(self.conversation, BackgroundJob.KIND_TITLE, text="Neural networks learn by gradient descent.")
+        self.assertTrue(jobs.is_pending(self.conversation, BackgroundJob.KIND_TITLE))
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        self.conversation.refresh_from_db()
+        self.assertNotIn(TEMPORARY_TITLE_PREFIX, self.conversation.title)
+        self.assertFalse(jobs.is_pending(self.conversation, BackgroundJob.KIND_TITLE))
+
+    @override_settings(CHAT_JOB_WORKER_THREADS=0, CHAT_JOB_MAX_ATTEMPTS=2)
+    @mock.patch('chat.titles.generate_title', side_effect=RuntimeError("model unavailable"))
+    def test_failed_title_job_backs_off_then_falls_back(self, _):
+        """
+        Test that a failed job waits out its retry delay and the last failure sets a fallback title.
+        """
+        job = jobs.enqueue(self.conversation, BackgroundJob.KIND_TITLE, text="Neural networks   learn by gradient descent.")
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+        # Not due yet
+        self.assertEqual(jobs.run_pending(), 0)
+
+        BackgroundJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.conversation.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_FAILED)
+        self.assertEqual(self.conversation.title, "Neural networks learn by gradient descent.")
+
+    @override_settings(CHAT_JOB_MAX_ATTEMPTS=2)
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self):
+        """
+        Test that a job left running is requeued, unless that was its last attempt, which fails it and falls back.
+        """
+        retried = jobs.enqueue(self.conversation, BackgroundJob.KIND_SUMMARY)
+        exhausted = jobs.enqueue(self.conversation, BackgroundJob.KIND_TITLE, text="Neural networks learn.")
+        old = timezone.now() - timedelta(hours=1)
+        BackgroundJob.objects.filter(id=retried.id).update(status=BackgroundJob.STATUS_RUNNING, attempts=1, updated_at=old)
+        BackgroundJob.objects.filter(id=exhausted.id).update(status=BackgroundJob.STATUS_RUNNING, attempts=2, updated_at=old)
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.conversation.refresh_from_db()
+        self.assertEqual(retried.status, BackgroundJob.STATUS_PENDING)
+        self.assertEqual(exhausted.status, BackgroundJob.STATUS_FAILED)
+        self.assertEqual(self.conversation.title, "Neural networks learn.")
+
+    @override_settings(CHAT_JOB_DONE_RETENTION=60, CHAT_JOB_FAILED_RETENTION=3600)
+    def test_finished_jobs_are_purged_after_retention(self):
+        """
+        Test that done and failed jobs are deleted once past their retention, and open jobs are kept.
+        """
+        old = timezone.now() - timedelta(minutes=10)
+        for status in [BackgroundJob.STATUS_DONE, BackgroundJob.STATUS_FAILED, BackgroundJob.STATUS_PENDING]:
+            job = jobs.enqueue(self.conversation, BackgroundJob.KIND_SUMMARY)
+            BackgroundJob.objects.filter(id=job.id).update(status=status, created_at=old)
+        recent = jobs.enqueue(self.conversation, BackgroundJob.KIND_SUMMARY)
+        BackgroundJob.objects.filter(id=recent.id).update(status=BackgroundJob.STATUS_DONE)
+
+        self.assertEqual(jobs.purge_finished(), 1)
+        self.assertEqual(
+            sorted(BackgroundJob.objects.values_list('status', flat=True)),
+            [BackgroundJob.STATUS_DONE, BackgroundJob.STATUS_FAILED, BackgroundJob.STATUS_PENDING],
+        )
+
+    @mock.patch('chat.titles.generate_title', return_value="Gradient Descent")
+    def test_title_conflicts_are_per_user(self, _):
+        """
+        Test that a generated title only gets a suffix if the same user already uses it.
+        """
+        Conversation.objects.create(title="Gradient Descent", user=self.user)
+        other_user = User.objects.create_user(username='othertitleuser', password='testpassword')
+        other_conversation = Conversation.objects.create(title=temporary_title(), user=other_user)
+
+        for conversation in (self.conversation, other_conversation):
+            run_title_job(BackgroundJob(conversation=conversation, kind=BackgroundJob.KIND_TITLE, payload={'text': "..."}))
+
+        self.conversation.refresh_from_db()
+        other_conversation.refresh_from_db()
+        self.assertTrue(self.conversation.title.startswith("Gradient Descent_"))
+        self.assertEqual(other_conversation.title, "Gradient Descent")
+
+
+class TitleBatcherTestCase(TestCase):
+    def test_concurrent_requests_are_batched(self):
+        """
+        Test that concurrent title requests share one generate call, in order.
+        """
+        batches = []
+
+        def fake_generate(texts):
+            batches.append(list(texts))
+            return [text.upper() for text in texts]
+
+        batcher = TitleBatcher(max_batch_size=4, max_wait_ms=200, generate=fake_generate)
+        futures = [batcher.submit(f"title {i}") for i in range(6)]
+
+        self.assertEqual([f.result(timeout=5) for f in futures], [f"TITLE {i}" for i in range(6)])
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+
+    def test_invalid_text_is_rejected_before_batching(self):
+        """
+        Test that the HTTP service answers 400 for a missing, non-string or blank text.
+        """
+        generate = mock.Mock(side_effect=lambda texts: [text.upper() for text in texts])
+        server = make_server('127.0.0.1', 0, TitleBatcher(max_wait_ms=10, generate=generate))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/generate"
+
+        def post(body):
+            request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        for body in [{}, {'text': None}, {'text': 42}, {'text': ['a']}, {'text': '  '}]:
+            self.assertEqual(post(body), 400, body)
+        generate.assert_not_called()
+        self.assertEqual(post({'text': 'gradient descent'}), 200)
+
+
+class ComponentRegistryTestCase(TestCase):
+    def test_components_are_built_once_on_first_use(self):
+        """
+        Test that factories run lazily and only once.
+        """
+        calls = []
+        components = ComponentRegistry()
+        components.register('thing', lambda: calls.append(1) or object())
+
+        self.assertEqual(calls, [])
+        self.assertEqual(components.status(), {'thing': False})
+
+        first = components.get('thing')
+        self.assertIs(components.get('thing'), first)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(components.status(), {'thing': True})
+
+    @override_settings(CHAT_READY_COMPONENTS=['runnable_with_history'])
+    def test_readiness_follows_the_boot_warmup(self):
+        """
+        Test that the readiness endpoint reports 503 while the background warmup loads the components,
+        and 200 when no warmup was started (components load lazily).
+        """
+        loading = threading.Event()
+        components = ComponentRegistry()
+        components.register('runnable_with_history', lambda: loading.wait(5) and object())
+        with mock.patch('chat.views.register_components', return_value=components):
+            response = self.client.get(reverse('readiness'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['warmup']['state'], 'not started')
+
+            thread = components.start_warmup(['runnable_with_history'])
+            response = self.client.get(reverse('readiness'))
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response.json()['warmup']['state'], 'running')
+
+            loading.set()
+            thread.join()
+            response = self.client.get(reverse('readiness'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['warmup']['state'], 'done')
+        self.assertNotIn('llm_gateway', response.json())
+
+    def test_metrics_are_for_staff_only(self):
+        """
+        Test that the metrics endpoint needs a staff token.
+        """
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+        client = APIClient()
+        user = User.objects.create_user(username='metricsuser', password='testpassword')
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        self.assertEqual(client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.json()), {'rag_rewrite', 'response_cache', 'llm_gateway', 'llm'})
+
+
+class HistoryWindowTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a conversation with 30 stored turns.
+        """
+        self.user = User.objects.create_user(username='windowuser', password='testpassword')
+        self.conversation = Conversation.objects.create(title='Long Conversation', user=self.user)
+        get_history_cache().clear()
+        rows = []
+        for i in range(30):
+            rows.append(ChatMessage(conversation=self.conversation, user_response=f"Question {i}", ai_response=f"Answer {i}"))
+        ChatMessage.objects.bulk_create(rows)
+
+    @override_settings(CHAT_SUMMARY_ENABLED=False)
+    def test_turn_window_loads_only_recent_rows(self):
+        """
+        Test that the last N turns are fetched with a single LIMIT query.
+        """
+        history = DjangoChatMessageHistory(conversation_id=self.conversation.id, max_turns=3, max_tokens=None)
+        with self.assertNumQueries(1):
+            messages = history.messages
+
+        self.assertEqual([m.content for m in messages], [
+            "Question 27", "Answer 27", "Question 28", "Answer 28", "Question 29", "Answer 29",
+        ])
+
+    def test_token_budget_starts_window_at_a_question(self):
+        """
+        Test that the token budget trims old messages without leaving an orphaned answer.
+        """
+        history = DjangoChatMessageHistory(conversation_id=self.conversation.id, max_turns=None, max_tokens=15)
+        messages = history.messages
+
+        self.assertTrue(messages)
+        self.assertIsInstance(messages[0], HumanMessage)
+        self.assertEqual(messages[-1].content, "Answer 29")
+        self.assertLess(len(messages), 60)
+
+
+class RollingSummaryTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a conversation longer than the history window, and a fake LLM.
+        """
+        self.user = User.objects.create_user(username='summaryuser', password='testpassword')
+        self.conversation = Conversation.objects.create(title='Summarized Conversation', user=self.user)
+        get_history_cache().clear()
+        rows = []
+        for i in range(8):
+            rows.append(ChatMessage(conversation=self.conversation, user_response=f"Question {i}", ai_response=f"Answer {i}"))
+        ChatMessage.objects.bulk_create(rows)
+        registry.set('llm', FakeListChatModel(responses=["First summary", "Second summary"]))
+
+    def tearDown(self):
+        registry.reset('llm')
+
+    @override_settings(CHAT_HISTORY_MAX_TURNS=5, CHAT_HISTORY_MAX_TOKENS=None)
+    def test_summary_folds_only_new_turns(self):
+        """
+        Test that turns leaving the window are folded in incrementally and injected into history.
+        """
+        run_summary_job(BackgroundJob(conversation=self.conversation, kind=BackgroundJob.KIND_SUMMARY))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "First summary")
+        first_boundary = self.conversation.summarized_through
+
+        # Nothing new has left the window, so the summary is left alone
+        run_summary_job(BackgroundJob(conversation=self.conversation, kind=BackgroundJob.KIND_SUMMARY))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summarized_through, first_boundary)
+
+        messages = DjangoChatMessageHistory(conversation_id=self.conversation.id).messages
+        self.assertIsInstance(messages[0], SystemMessage)
+        self.assertIn("First summary", messages[0].content)
+        self.assertEqual(messages[1].content, "Question 3")
+
+    @override_settings(CHAT_HISTORY_MAX_TURNS=5, CHAT_HISTORY_MAX_TOKENS=None, CHAT_SUMMARY_MAX_ROWS=2)
+    def test_summary_runs_in_bounded_batches(self):
+        """
+        Test that a backlog longer than the batch cap is folded a batch per job, with a follow-up job queued.
+        """
+        first_id = ChatMessage.objects.filter(conversation=self.conversation).order_by('id').first().id
+        run_summary_job(BackgroundJob(conversation=self.conversation, kind=BackgroundJob.KIND_SUMMARY))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summarized_through, first_id + 1)
+        self.assertTrue(jobs.is_pending(self.conversation, BackgroundJob.KIND_SUMMARY))
+
+        run_summary_job(BackgroundJob(conversation=self.conversation, kind=BackgroundJob.KIND_SUMMARY))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "Second summary")
+        self.assertEqual(self.conversation.summarized_through, first_id + 2)
+        self.assertEqual(BackgroundJob.objects.filter(kind=BackgroundJob.KIND_SUMMARY).count(), 1)
+
+    @override_settings(CHAT_HISTORY_MAX_TURNS=5, CHAT_HISTORY_MAX_TOKENS=None)
+    def test_summary_due_only_when_turns_left_the_window(self):
+        """
+        Test that a summary is only due while rows older than the window are unsummarized.
+        """
+        self.assertTrue(summary_due(self.conversation))
+        run_summary_job(BackgroundJob(conversation=self.conversation, kind=BackgroundJob.KIND_SUMMARY))
+        self.conversation.refresh_from_db()
+        self.assertFalse(summary_due(self.conversation))
+
+        with override_settings(CHAT_HISTORY_MAX_TURNS=10):
+            short = Conversation.objects.create(title='Short Conversation', user=self.user)
+            ChatMessage.objects.create(conversation=short, user_response="Hi", ai_response="Hello")
+            self.assertFalse(summary_due(short))
+
+
+class HandleMessageQueryCountTestCase(APITestCase):
+    def setUp(self):
+        """
+        Set up an authenticated client and a fake LLM behind runnable_with_history.
+        """
+        self.user = User.objects.create_user(username='queryuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(title='Counted Conversation', user=self.user)
+        get_history_cache().clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        registry.set('llm', FakeListChatModel(responses=["A short answer."]))
+        registry.set('embedding', KeywordEmbeddings())
+        registry.set('memory_store', NumpyVectorStore(TurnEmbedding, 'user_id', 'message_id'))
+        registry.reset('runnable')
+        registry.reset('runnable_with_history')
+
+    def tearDown(self):
+        for name in ('llm', 'embedding', 'memory_store', 'runnable', 'runnable_with_history'):
+            registry.reset(name)
+        self.client.credentials()
+
+    def test_history_load_is_a_single_query(self):
+        """
+        Test that loading history with the already-fetched conversation runs one query.
+        """
+        history = DjangoChatMessageHistory(conversation_id=self.conversation.id, conversation=self.conversation)
+        history.add_messages([HumanMessage(content="Hi"), AIMessage(content="Hello!")])
+        with self.assertNumQueries(1):
+            history.messages
+
+    @override_settings(CHAT_MEMORY_ENABLED=True)
+    def test_handle_message_query_count(self):
+        """
+        Test the exact number of queries for one turn of an existing conversation:
+        token auth, conversation, history window, the check for embedded turns
+        (there are none, so no recall), one INSERT for the turn, the
+        last_activity UPDATE, the window read and unsummarized-rows check that
+        find no summary due, and queueing the embedding job (pending check +
+        INSERT).
+        """
+        with self.assertNumQueries(10):
+            response = self.client.post(
+                reverse('handle_message'),
+                {'input_message': 'Tell me about AI.', 'conversation_id': str(self.conversation.id)},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ChatMessage.objects.filter(conversation=self.conversation).count(), 1)
+
+
+class KeywordEmbeddings(Embeddings):
+    """
+    Bag-of-words embeddings over a tiny vocabulary, so related texts are similar.
+    """
+    VOCABULARY = ['vector', 'index', 'hnsw', 'pasta', 'recipe', 'tomato', 'gradient', 'learning']
+
+    def embed_query(self, text):
+        words = text.lower().replace('?', ' ').replace('.', ' ').split()
+        return [float(words.count(term)) for term in self.VOCABULARY] + [0.1]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+@override_settings(CHAT_MEMORY_ENABLED=True, CHAT_MEMORY_MIN_SCORE=0.5)
+class LongTermMemoryTestCase(TestCase):
+    def setUp(self):
+        """
+        Set up a user with turns in two conversations, embedded by the job.
+        """
+        self.user = User.objects.create_user(username='memoryuser', password='testpassword')
+        self.old = Conversation.objects.create(title='Databases', user=self.user)
+        self.current = Conversation.objects.create(title='Cooking', user=self.user)
+        get_history_cache().clear()
+        registry.set('embedding', KeywordEmbeddings())
+        registry.set('memory_store', NumpyVectorStore(TurnEmbedding, 'user_id', 'message_id'))
+        for conversation, question, answer in [
+            (self.old, "What is an HNSW index?", "A graph index for approximate vector search."),
+            (self.old, "Any good pasta recipe?", "Tomato pasta is quick."),
+            (self.current, "How do I cook pasta?", "Boil it in salted water."),
+        ]:
+            DjangoChatMessageHistory(conversation_id=conversation.id).add_messages(
+                [HumanMessage(content=question), AIMessage(content=answer)]
+            )
+            jobs.enqueue(conversation, BackgroundJob.KIND_EMBED)
+        jobs.run_pending()
+
+    def tearDown(self):
+        registry.reset('embedding')
+        registry.reset('memory_store')
+
+    def test_turns_are_embedded_once(self):
+        """
+        Test that the embed job stores one embedding per turn and skips embedded ones.
+        """
+        self.assertEqual(TurnEmbedding.objects.filter(user=self.user).count(), 3)
+        jobs.enqueue(self.old, BackgroundJob.KIND_EMBED)
+        jobs.run_pending()
+        self.assertEqual(TurnEmbedding.objects.filter(user=self.user).count(), 3)
+
+    def test_recall_across_conversations(self):
+        """
+        Test that relevant turns from other conversations are recalled, skipping the history window.
+        """
+        turns = recall(self.current, "Which vector index is fastest?")
+        self.assertEqual([t.user_response for t in turns], ["What is an HNSW index?"])
+
+        window = DjangoChatMessageHistory(conversation_id=self.current.id).messages
+        turns = recall(self.current, "A tomato pasta recipe please", window=window)
+        self.assertEqual([t.user_response for t in turns], ["Any good pasta recipe?"])
+
+        inputs = chatbot._with_memory(
+            {"input": "Which vector index is fastest?", "history": window},
+            chatbot.history_config(self.current),
+        )
+        self.assertIn("What is an HNSW index?", inputs["memory"][0].content)
+
+    def test_user_without_embeddings_is_not_embedded_for(self):
+        """
+        Test that recall skips the embeddings call when the user has nothing to recall.
+        """
+        other = User.objects.create_user(username='newmemoryuser', password='testpassword')
+        conversation = Conversation.objects.create(title='New', user=other)
+        with mock.patch.object(KeywordEmbeddings, 'embed_query') as embed:
+            self.assertEqual(recall(conversation, "Which vector index is fastest?"), [])
+        embed.assert_not_called()
+
+
+    def test_deleted_turns_are_not_recalled(self):
+        """
+        Test that a loaded memory partition drops the turns of a deleted conversation.
+        """
+        store = registry.get('memory_store')
+        vector = KeywordEmbeddings().embed_query("Which vector index is fastest?")
+        self.assertEqual(len(store.search(self.user.id, vector, 10)), 3)
+        self.old.delete()
+        current_ids = set(ChatMessage.objects.filter(conversation=self.current).values_list('id', flat=True))
+        self.assertEqual({item for item, _ in store.search(self.user.id, vector, 10)}, current_ids)
+
+
+class RagTestCase(APITestCase):
+    RAG_COMPONENTS = (
+        'llm', 'embedding', 'vstore', 'retriever', 'history_aware_retriever',
+        'question_answer_chain', 'rag_chain', 'rag_chain_with_history',
+    )
+
+    def setUp(self):
+        """
+        Set up a local document collection and a fake LLM behind rag_chain.
+        """
+        self.user = User.objects.create_user(username='raguser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(title='Docs Conversation', user=self.user)
+        get_history_cache().clear()
+        registry.set('llm', FakeListChatModel(responses=["HNSW is a graph index."]))
+        vstore = DjangoVectorStore(
+            KeywordEmbeddings(), 'test_docs', store=NumpyVectorStore(DocumentChunk, 'collection', 'id'),
+        )
+        vstore.add_texts(
+            ["HNSW builds a layered graph for vector index search.", "Tomato pasta recipe."],
+            metadatas=[{'source': 'hnsw.pdf'}, {'source': 'pasta.pdf'}],
+        )
+        registry.set('vstore', vstore)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def tearDown(self):
+        for name in self.RAG_COMPONENTS:
+            registry.reset(name)
+        self.client.credentials()
+
+    def test_retriever_keeps_score_threshold(self):
+        """
+        Test that only chunks above the similarity threshold are retrieved.
+        """
+        docs = chatbot.retriever.invoke("How does an HNSW vector index work?")
+        self.assertEqual([d.metadata['source'] for d in docs], ['hnsw.pdf'])
+
+    def test_use_rag_flag_answers_from_documents(self):
+        """
+        Test that a request with use_rag goes through rag_chain and stores the turn.
+        """
+        response = self.client.post(
+            reverse('handle_message'),
+            {'input_message': 'How does an HNSW vector index work?',
+             'conversation_id': str(self.conversation.id), 'use_rag': True},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['response'], "HNSW is a graph index.")
+        self.assertEqual(response.json()['sources'], ['hnsw.pdf'])
+        row = ChatMessage.objects.get(conversation=self.conversation)
+        self.assertEqual(row.ai_response, "HNSW is a graph index.")
+
+    def test_rewrite_fast_path(self):
+        """
+        Test that self-contained questions skip the rewrite and parallel retrieval merges both results.
+        """
+        history = [HumanMessage(content="Tell me about indexes"), AIMessage(content="Sure.")]
+        self.assertFalse(needs_rewrite("How does an HNSW vector index work?", history))
+        self.assertTrue(needs_rewrite("Why is it fast?", history))
+        self.assertFalse(needs_rewrite("Why is it fast?", []))
+
+        llm = FakeListChatModel(responses=["How does an HNSW vector index work?"])
+        retriever = build_history_aware_retriever(llm, chatbot.retriever, chatbot.contextualize_q_prompt)
+        rewrite_stats.reset()
+        docs = retriever.invoke({"input": "How does an HNSW vector index work?", "chat_history": history})
+        self.assertEqual([d.metadata['source'] for d in docs], ['hnsw.pdf'])
+        self.assertEqual(rewrite_stats.report()['skipped_self_contained'], 1)
+
+        with override_settings(CHAT_RAG_PARALLEL_RETRIEVAL=True):
+            docs = retriever.invoke({"input": "Why is it fast?", "chat_history": history})
+        self.assertEqual([d.metadata['source'] for d in docs], ['hnsw.pdf'])
+        report = rewrite_stats.report()
+        self.assertEqual((report['rewritten'], report['skip_rate']), (1, 0.5))
+
+    @override_settings(CHAT_RAG_PARALLEL_RETRIEVAL=True)
+    def test_parallel_retrieval_embeds_the_rewrite_off_the_calling_thread(self):
+        """
+        Test that the rewritten question is embedded by the rewrite task, so the caller's embedding is a cache hit.
+        """
+        model = KeywordEmbeddings()
+        model.embed_query = mock.Mock(wraps=model.embed_query)
+        embeddings = CachedEmbeddings(model)
+        retriever = DjangoVectorStore(
+            embeddings, 'test_docs', store=NumpyVectorStore(DocumentChunk, 'collection', 'id'),
+        ).as_retriever(search_type="similarity_score_threshold", search_kwargs={"k": 2, "score_threshold": 0.5})
+        llm = FakeListChatModel(responses=["How does an HNSW vector index work?"])
+        retriever = build_history_aware_retriever(llm, retriever, chatbot.contextualize_q_prompt)
+
+        history = [HumanMessage(content="Tell me about indexes"), AIMessage(content="Sure.")]
+        docs = retriever.invoke({"input": "Why is it fast?", "chat_history": history})
+        self.assertEqual([d.metadata['source'] for d in docs], ['hnsw.pdf'])
+        self.assertEqual(model.embed_query.call_count, 2)
+        self.assertEqual(embeddings.memory_hits, 1)
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        """
+        Set up a directory of text files and a collection with counting embeddings.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.embedding = KeywordEmbeddings()
+        self.embedding.embed_documents = mock.Mock(wraps=self.embedding.embed_documents)
+        self.vstore = DjangoVectorStore(
+            self.embedding, 'ingest_docs', store=NumpyVectorStore(DocumentChunk, 'collection', 'id'),
+        )
+        self._write('a.txt', "HNSW vector index.\n\nGradient learning.")
+        self._write('b.txt', "Tomato pasta recipe.")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, name, text):
+        with open(os.path.join(self.directory.name, name), 'w') as f:
+            f.write(text)
+
+    def _ingest(self):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(chunk_size=20, chunk_overlap=0)
+        return ingest(self.vstore, [self.directory.name], splitter=splitter, batch_size=2, concurrency=2)
+
+    def test_reingest_only_embeds_the_delta(self):
+        """
+        Test that re-runs skip unchanged chunks, embed changed ones and remove stale ones.
+        """
+        report = self._ingest()
+        self.assertEqual((report.sources, report.chunks, report.embedded), (2, 3, 3))
+        self.assertEqual(DocumentChunk.objects.filter(collection='ingest_docs').count(), 3)
+
+        self.embedding.embed_documents.reset_mock()
+        report = self._ingest()
+        self.assertEqual((report.embedded, report.skipped, report.removed), (0, 3, 0))
+        self.embedding.embed_documents.assert_not_called()
+
+        self._write('a.txt', "HNSW vector index.\n\nNew learning notes.")
+        report = self._ingest()
+        self.assertEqual((report.embedded, report.skipped, report.removed), (1, 2, 1))
+        self.assertEqual(
+            sorted(DocumentChunk.objects.filter(collection='ingest_docs').values_list('content', flat=True)),
+            ["HNSW vector index.", "New learning notes.", "Tomato pasta recipe."],
+        )
+        docs = self.vstore.similarity_search("pasta recipe", k=1)
+        self.assertEqual(docs[0].metadata['source'], os.path.join(self.directory.name, 'b.txt'))
+
+    def test_failed_upsert_keeps_the_stale_chunks(self):
+        """
+        Test that a source's old chunks are only removed once its new chunks are stored.
+        """
+        self._ingest()
+        self._write('a.txt', "HNSW vector index.\n\nNew learning notes.")
+        self.embedding.embed_documents.side_effect = RuntimeError("embedding service down")
+        with self.assertRaises(RuntimeError):
+            self._ingest()
+        self.assertTrue(DocumentChunk.objects.filter(collection='ingest_docs', content="Gradient learning.").exists())
+
+    def test_same_content_in_another_source_is_left_alone(self):
+        """
+        Test that add_texts returns the rows of its own sources when other sources share the content.
+        """
+        first = self.vstore.add_texts(["Shared chunk.", "Only in a."], metadatas=[{'source': 'a'}, {'source': 'a'}])
+        with mock.patch.object(self.vstore.store, 'add', wraps=self.vstore.store.add) as add:
+            second = self.vstore.add_texts(["Shared chunk."], metadatas=[{'source': 'b'}])
+        self.assertNotIn(second[0], first)
+        self.assertEqual([chunk.source for chunk in add.call_args[0][0]], ['b'])
+
+
+class EmbeddingCacheTestCase(TestCase):
+    def setUp(self):
+        """
+        Set up counting embeddings and a temporary SQLite cache file.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'embeddings.sqlite3')
+        self.model = KeywordEmbeddings()
+        self.model.embed_documents = mock.Mock(wraps=self.model.embed_documents)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_misses_are_batched_and_hits_skip_the_model(self):
+        """
+        Test that only distinct misses reach the model and later lookups hit memory, then disk.
+        """
+        cached = CachedEmbeddings(self.model, store=SqliteEmbeddingStore(self.path))
+        vectors = cached.embed_documents(["pasta recipe", "vector index", "pasta recipe"])
+        self.model.embed_documents.assert_called_once_with(["pasta recipe", "vector index"])
+        self.assertEqual(vectors[0], vectors[2])
+
+        self.model.embed_documents.reset_mock()
+        self.assertEqual(cached.embed_documents(["vector index"]), [vectors[1]])
+        self.assertEqual(cached.stats()['memory_hits'], 1)
+        self.assertTrue(all(vector.dtype == np.float32 for vector in cached._memory.values()))
+
+        # A new process only has the disk tier
+        reloaded = CachedEmbeddings(self.model, store=SqliteEmbeddingStore(self.path))
+        # Stored as float32
+        self.assertTrue(np.allclose(reloaded.embed_documents(["pasta recipe", "gradient learning"])[0], vectors[0]))
+        self.model.embed_documents.assert_called_once_with(["gradient learning"])
+        self.assertEqual(reloaded.stats()['disk_hits'], 1)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        """
+        Set up a cached fake LLM behind the chat prompt.
+        """
+        registry.set('embedding', KeywordEmbeddings())
+        registry.set('response_cache', ResponseCache(max_entries=2, semantic=True, semantic_threshold=0.9))
+        self.llm = FakeListChatModel(responses=["First answer.", "Second answer.", "Third answer."])
+        self.chain = chatbot.prompt_template | CachedChatModel(self.llm)
+
+    def tearDown(self):
+        registry.reset('embedding')
+        registry.reset('response_cache')
+
+    def _ask(self, text, history=()):
+        return self.chain.invoke({"input": text, "history": list(history)}).content
+
+    def test_exact_and_semantic_hits(self):
+        """
+        Test that repeated and similar history-free questions are answered from the cache.
+        """
+        self.assertEqual(self._ask("How does a vector index work?"), "First answer.")
+        self.assertEqual(self._ask("How does a vector index work?"), "First answer.")
+        streamed = [chunk.content for chunk in self.chain.stream({"input": "How does a vector index work?", "history": []})]
+        self.assertEqual(streamed, ["First answer."])
+        # Same embedding, different text
+        self.assertEqual(self._ask("Explain the vector index"), "First answer.")
+        # Turns with history only use the exact level
+        history = [HumanMessage(content="Hi"), AIMessage(content="Hello!")]
+        self.assertEqual(self._ask("Explain the vector index", history), "Second answer.")
+
+        stats = registry.get('response_cache').stats()
+        self.assertEqual((stats['exact_hits'], stats['semantic_hits'], stats['misses']), (2, 1, 2))
+
+        # LRU: the oldest of three entries is gone with max_entries=2
+        self.assertEqual(self._ask("A tomato pasta recipe?"), "Third answer.")
+        self._ask("How does a vector index work?")
+        self.assertEqual(registry.get('response_cache').stats()['misses'], 4)
+
+    def test_exact_hit_skips_embedding_and_is_traced(self):
+        """
+        Test that only exact misses embed the input and the model call is nested under the cache step.
+        """
+        embedding = registry.get('embedding')
+        with mock.patch.object(embedding, 'embed_query', wraps=embedding.embed_query) as embed, collect_runs() as runs:
+            self._ask("How does a vector index work?")
+            self._ask("How does a vector index work?")
+        self.assertEqual(embed.call_count, 1)
+
+        cached = [run for run in runs.traced_runs[0].child_runs if run.name == 'CachedChatModel']
+        self.assertEqual([run.name for run in cached[0].child_runs], ['FakeListChatModel'])
+        cached = [run for run in runs.traced_runs[1].child_runs if run.name == 'CachedChatModel']
+        self.assertEqual((cached[0].outputs['output'].content, cached[0].child_runs), ("First answer.", []))
+
+
+    def test_eviction_only_runs_over_the_cap(self):
+        """
+        Test that writes below the cap skip the eviction queries and going over it trims the LRU entries.
+        """
+        cache = ResponseCache(max_entries=3)
+        statements = []
+        cache._connection().set_trace_callback(statements.append)
+        keys = []
+        for i in range(3):
+            keys.append(ResponseKey('model', ChatPromptValue(messages=[HumanMessage(content=f"Question {i}")])))
+            cache.set(keys[-1], f"Answer {i}")
+        self.assertFalse([sql for sql in statements if sql.startswith('DELETE')])
+
+        cache.get(keys[0])
+        cache.set(ResponseKey('model', ChatPromptValue(messages=[HumanMessage(content="Question 3")])), "Answer 3")
+        self.assertTrue([sql for sql in statements if sql.startswith('DELETE')])
+        self.assertEqual((cache.get(keys[0]), cache.get(keys[1])), ("Answer 0", None))
+
+
+class GatewayTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='gatewayuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def tearDown(self):
+        registry.reset('llm_gateway')
+
+    def test_round_robin_between_users(self):
+        """
+        Test that queued turns are served one user at a time and per-user queues are bounded.
+        """
+        gateway = LLMGateway(max_concurrency=1, max_queue_per_user=2, queue_timeout=5)
+        gateway.acquire('main')
+        order = []
+
+        def turn(user_id):
+            gateway.acquire(user_id)
+            order.append(user_id)
+            gateway.release()
+
+        threads = []
+        for user_id in ['a', 'a', 'b']:
+            queued = gateway.stats()['queue_depth']
+            threads.append(threading.Thread(target=turn, args=(user_id,)))
+            threads[-1].start()
+            while gateway.stats()['queue_depth'] == queued:
+                time.sleep(0.001)
+        with self.assertRaises(GatewayOverloaded):
+            gateway.acquire('a')
+
+        gateway.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['a', 'b', 'a'])
+        stats = gateway.stats()
+        self.assertEqual((stats['active'], stats['admitted'], stats['rejected'], stats['max_queue_depth']), (0, 4, 1, 3))
+
+    def test_failed_stream_setup_releases_its_slot(self):
+        """
+        Test that an error before streaming starts hands the slot back.
+        """
+        gateway = LLMGateway(max_concurrency=1)
+        registry.set('llm_gateway', gateway)
+        self.client.raise_request_exception = False
+        response = self.client.post(
+            reverse('handle_message_stream'), {'input_message': 'Hello', 'conversation_id': 'abc'}, format='json',
+        )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(gateway.stats()['active'], 0)
+
+    def test_overloaded_turn_is_refused_before_any_write(self):
+        """
+        Test that a full gateway answers 429 with Retry-After and creates no conversation.
+        """
+        registry.set('llm_gateway', LLMGateway(max_concurrency=0, max_queue=0))
+        for name in ['handle_message', 'handle_message_stream', 'ahandle_message']:
+            response = self.client.post(reverse(name), {'input_message': 'Hello'}, format='json')
+            self.assertEqual(response.status_code, 429)
+            self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertFalse(Conversation.objects.filter(user=self.user).exists())
+
+
+class ResilientChatModelTestCase(TestCase):
+    def test_hedged_request_wins_over_slow_attempt(self):
+        """
+        Test that a hedge is sent after the delay and the first attempt to answer is used.
+        """
+        for use_async in (False, True):
+            fake = LatencyFakeChatModel(responses=["Slow answer.", "Fast answer."], first_token_latency=[0.5, 0.0])
+            llm = ResilientChatModel([fake], first_token_timeout=2, hedge_delay=0.05)
+            if use_async:
+                message = asyncio.run(llm.ainvoke("Hello"))
+            else:
+                message = llm.invoke("Hello")
+            self.assertEqual(message.content, "Fast answer.")
+            self.assertEqual(fake.calls, 2)
+            self.assertEqual((llm.stats()['hedges'], llm.stats()['hedge_wins']), (1, 1))
+
+    def test_timeouts_and_errors_retry_then_fall_back(self):
+        """
+        Test that stalled or failing attempts are retried, then the fallback model answers.
+        """
+        primary = LatencyFakeChatModel(first_token_latency=[0.5, 0.0], failures=[None, FakeLLMError()])
+        fallback = LatencyFakeChatModel(responses=["Fallback answer."])
+        llm = ResilientChatModel([primary, fallback], first_token_timeout=0.1, max_retries=1, backoff_base=0.01)
+
+        with collect_runs() as runs:
+            chunks = list(llm.stream("Hello"))
+        self.assertEqual("".join(chunk.content for chunk in chunks), "Fallback answer.")
+        # Traced as one step, with every attempt nested under it
+        self.assertEqual(runs.traced_runs[0].name, 'ResilientChatModel')
+        self.assertEqual(len(runs.traced_runs[0].child_runs), 3)
+        self.assertEqual(len(chunks), 2)
+        # Tagged so the response cache leaves the answer out
+        self.assertEqual(chunks[0].response_metadata['fallback_model'], "fake-latency")
+        stats = llm.stats()
+        self.assertEqual((stats['timeouts'], stats['errors'], stats['retries'], stats['fallbacks']), (1, 1, 1, 1))
+
+        # Bad requests are not retried, but the fallback is still tried
+        bad = LatencyFakeChatModel(failures=[FakeLLMError(status_code=401)])
+        self.assertEqual(ResilientChatModel([bad, fallback]).invoke("Hello").content, "Fallback answer.")
+        self.assertEqual(bad.calls, 1)
+        broken = LatencyFakeChatModel(failures=[ValueError("bug")])
+        with self.assertRaises(ValueError):
+            asyncio.run(ResilientChatModel([broken]).ainvoke("Hello"))
+        self.assertEqual(broken.calls, 1)
+
+
+@override_settings(CHAT_FAKE_MODELS=FAKE_MODELS, CHAT_EMBEDDING_CACHE=None, CHAT_JOB_WORKER_THREADS=0)
+class LoadTestCommandTestCase(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def tearDown(self):
+        registry.reset()
+
+    def test_report_and_cleanup(self):
+        """
+        Test that the load test reports latency and queries per endpoint and removes its users.
+        """
+        out = StringIO()
+        call_command('loadtest', users=1, requests=6, history_ratio=0.5, seed=1, stdout=out)
+        report = out.getvalue()
+
+        self.assertIn("6 requests in", report)
+        self.assertRegex(report, r"handle-message: \d+ requests, p50 [\d.]+ms, p95 [\d.]+ms, p99 [\d.]+ms, [\d.]+ queries/request, statuses \{200: \d+\}")
+        self.assertIn("chat-history:", report)
+        self.assertFalse(User.objects.filter(username__startswith='loadtest-').exists())
+
+        with override_settings(CHAT_FAKE_MODELS=None), self.assertRaises(CommandError):
+            call_command('loadtest', users=1, requests=1, stdout=out)
+
+
+@override_settings(CHAT_HISTORY_CACHE={'BACKEND': 'local', 'MAX_ENTRIES': 100, 'MAX_BYTES': 1024 * 1024})
+class HistoryCacheTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a conversation with 5 stored turns and start from an empty cache.
+        """
+        registry.reset('history_cache')
+        self.user = User.objects.create_user(username='cacheuser', password='testpassword')
+        self.conversation = Conversation.objects.create(title='Cached Conversation', user=self.user)
+        rows = []
+        for i in range(5):
+            rows.append(ChatMessage(conversation=self.conversation, user_response=f"Question {i}", ai_response=f"Answer {i}"))
+        ChatMessage.objects.bulk_create(rows)
+        get_history_cache().clear()
+
+    def tearDown(self):
+        registry.reset('history_cache')
+
+    def _history(self):
+        return DjangoChatMessageHistory(
+            conversation_id=self.conversation.id, conversation=self.conversation, max_turns=3, max_tokens=None,
+        )
+
+    def test_lru_is_bounded_by_entries_and_bytes(self):
+        """
+        Test that the least recently used entries are evicted first.
+        """
+        cache = LocalHistoryCache(max_entries=2, max_bytes=10_000)
+        cache.set(1, {'rows': [(1, "a", "b")], 'summary': None})
+        cache.set(2, {'rows': [(2, "a", "b")], 'summary': None})
+        cache.get(1)
+        cache.set(3, {'rows': [(3, "a", "b")], 'summary': None})
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+
+        # Too big to share the byte budget with anything else
+        cache.set(4, {'rows': [(4, "x" * 9_800, "")], 'summary': None})
+        self.assertIsNotNone(cache.get(4))
+        self.assertIsNone(cache.get(1))
+        self.assertIsNone(cache.get(3))
+
+    def test_hot_conversation_skips_the_database(self):
+        """
+        Test that a new turn is written through to the cached window.
+        """
+        self.assertEqual(len(self._history().messages), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._history().add_messages([HumanMessage(content="Question 5"), AIMessage(content="Answer 5")])
+
+        with self.assertNumQueries(0):
+            messages = self._history().messages
+        self.assertEqual([m.content for m in messages], [
+            "Question 3", "Answer 3", "Question 4", "Answer 4", "Question 5", "Answer 5",
+        ])
+
+    def test_clear_and_delete_invalidate(self):
+        """
+        Test that clearing or deleting a conversation drops its cached history.
+        """
+        history = self._history()
+        history.messages
+        history.clear()
+        self.assertIsNone(get_history_cache().get(self.conversation.id))
+        self.assertEqual(self._history().messages, [])
+
+        conversation_id = self.conversation.id
+        self.conversation.delete()
+        self.assertIsNone(get_history_cache().get(conversation_id))
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=4)
+class ChatHistoryPaginationTestCase(APITestCase):
+    def setUp(self):
+        """
+        Set up an authenticated client and a conversation with 10 turns.
+        """
+        self.user = User.objects.create_user(username='pageuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(title='Paged Conversation', user=self.user)
+        ChatMessage.objects.bulk_create(
+            ChatMessage(conversation=self.conversation, user_response=f"Question {i}", ai_response=f"Answer {i}")
+            for i in range(10)
+        )
+        self.url = reverse('chat-history', args=[self.conversation.id])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def _questions(self, response):
+        return [m['user_response'] for m in response.json()['messages']]
+
+    def test_pages_back_and_fetches_only_new_messages(self):
+        """
+        Test the newest page, paging back with `before`, and delta sync with `since`.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(self._questions(response), [f"Question {i}" for i in range(6, 10)])
+        pagination = response.json()['pagination']
+        self.assertTrue(pagination['has_more'])
+
+        older = self.client.get(self.url, {'before': pagination['previous']})
+        self.assertEqual(self._questions(older), [f"Question {i}" for i in range(2, 6)])
+
+        unchanged = self.client.get(self.url, {'since': pagination['next']})
+        self.assertEqual(unchanged.json()['messages'], [])
+        self.assertNotIn('conversation', unchanged.json())
+
+        DjangoChatMessageHistory(conversation_id=self.conversation.id).add_messages(
+            [HumanMessage(content="Question 10"), AIMessage(content="Answer 10")]
+        )
+        delta = self.client.get(self.url, {'since': pagination['next']})
+        self.assertEqual(self._questions(delta), ["Question 10"])
+
+    def test_unchanged_history_returns_304(self):
+        """
+        Test that the ETag only changes once a new turn is stored.
+        """
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        DjangoChatMessageHistory(conversation_id=self.conversation.id).add_messages(
+            [HumanMessage(content="Question 10"), AIMessage(content="Answer 10")]
+        )
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_invalid_cursor_and_other_users(self):
+        """
+        Test that bad cursors are rejected and other users' conversations are hidden.
+        """
+        self.assertEqual(self.client.get(self.url, {'before': 'nonsense'}).status_code, 400)
+
+        other = User.objects.create_user(username='otherpageuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other).key)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(CHAT_CONVERSATIONS_PAGE_SIZE=2)
+class ConversationListTestCase(APITestCase):
+    def setUp(self):
+        """
+        Set up an authenticated client and three conversations.
+        """
+        self.user = User.objects.create_user(username='listuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.conversations = [
+            Conversation.objects.create(title=f'Conversation {i}', user=self.user) for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_message_writes_keep_list_fields_current(self):
+        """
+        Test that storing and clearing messages updates the count and preview.
+        """
+        history = DjangoChatMessageHistory(conversation_id=self.conversations[0].id)
+        history.add_messages([HumanMessage(content="Hi"), AIMessage(content="Hello there!")])
+        history.add_messages([HumanMessage(content="Bye")])
+
+        conversation = Conversation.objects.get(id=self.conversations[0].id)
+        self.assertEqual(conversation.message_count, 3)
+        self.assertEqual(conversation.last_message_preview, "Bye")
+        self.assertIsNotNone(conversation.last_message_at)
+
+        history.clear()
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.last_message_preview), (0, ''))
+
+    def test_list_is_paginated_by_last_activity(self):
+        """
+        Test that the most recently active conversations come first, one query per page.
+        """
+        DjangoChatMessageHistory(conversation_id=self.conversations[0].id).add_messages(
+            [HumanMessage(content="Hi"), AIMessage(content="Hello there!")]
+        )
+
+        with self.assertNumQueries(2):  # token auth + the page
+            response = self.client.get(reverse('get_conversations'))
+        data = response.json()
+        self.assertEqual([c['title'] for c in data['conversations']], ['Conversation 0', 'Conversation 2'])
+        self.assertEqual(data['conversations'][0]['last_message_preview'], "Hello there!")
+        self.assertTrue(data['pagination']['has_more'])
+
+        response = self.client.get(reverse('get_conversations'), {'before': data['pagination']['next']})
+        data = response.json()
+        self.assertEqual([c['title'] for c in data['conversations']], ['Conversation 1'])
+        self.assertFalse(data['pagination']['has_more'])
+
+
+class ArchiveTestCase(APITestCase):
+    def setUp(self):
+        """
+        Set up an authenticated client and a conversation with a rolling summary.
+        """
+        self.user = User.objects.create_user(username='exportuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(title='Exported Conversation', user=self.user)
+        history = DjangoChatMessageHistory(conversation_id=self.conversation.id)
+        for i in range(3):
+            history.add_messages([HumanMessage(content=f"Question {i}"), AIMessage(content=f"Answer {i}")])
+        first = ChatMessage.objects.filter(conversation=self.conversation).order_by('id').first()
+        Conversation.objects.filter(id=self.conversation.id).update(summary="Talked about 0", summarized_through=first.id)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_export_and_import_round_trip(self):
+        """
+        Test that a gzipped export streams and imports into another account intact.
+        """
+        response = self.client.get(reverse('export_conversations'), {'compression': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = gzip.decompress(b"".join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 4)
+
+        other = User.objects.create_user(username='importuser', password='testpassword')
+        Conversation.objects.create(title='Exported Conversation', user=other)
+        self.assertEqual(import_lines(other, lines, batch_size=2), (1, 3))
+
+        imported = Conversation.objects.get(user=other, title='Exported Conversation (2)')
+        self.assertEqual(imported.message_count, 6)
+        self.assertEqual(imported.last_message_preview, "Answer 2")
+        rows = list(imported.chatmessage_set.order_by('timestamp', 'id'))
+        self.assertEqual([r.user_response for r in rows], ["Question 0", "Question 1", "Question 2"])
+        self.assertEqual(imported.summarized_through, rows[0].id)
+        original = ChatMessage.objects.filter(conversation=self.conversation).order_by('id').first()
+        self.assertEqual(rows[0].timestamp, original.timestamp)
+
+
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        """
+        Set up an authenticated client and messages for two users.
+        """
+        self.user = User.objects.create_user(username='searchuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(title='Searchable Conversation', user=self.user)
+        DjangoChatMessageHistory(conversation_id=self.conversation.id).add_messages([
+            HumanMessage(content="How does gradient descent work?"),
+            AIMessage(content="Gradient descent follows the negative gradient while x<y & \"downhill\"."),
+        ])
+        DjangoChatMessageHistory(conversation_id=self.conversation.id).add_messages([
+            HumanMessage(content="And backpropagation?"),
+            AIMessage(content="It computes the gradient layer by layer."),
+        ])
+        other = User.objects.create_user(username='othersearchuser', password='testpassword')
+        other_conversation = Conversation.objects.create(title='Private Conversation', user=other)
+        DjangoChatMessageHistory(conversation_id=other_conversation.id).add_messages([
+            HumanMessage(content="My secret gradient notes"),
+        ])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_ranked_results_with_highlighted_snippets(self):
+        """
+        Test that only the user's messages are found, best match first, with escaped snippets.
+        """
+        response = self.client.get(reverse('search'), {'q': 'gradient descent'})
+        results = response.json()['results']
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['conversation_id'], self.conversation.id)
+        self.assertIn('<mark>', results[0]['snippet'])
+        self.assertIn('x&lt;y &amp; &quot;', results[0]['snippet'])
+
+        results = self.client.get(reverse('search'), {'q': 'gradient'}).json()['results']
+        self.assertEqual(len(results), 2)
+
+        self.assertEqual(self.client.get(reverse('search')).status_code, 400)
@@ -0,0 +1,132 @@
+# chat/title_service.py
+"""
+Standalone title-generation service.
+
+Holds a single copy of the title model and serves `POST /generate` over HTTP
+on localhost. Concurrent requests are collected into padded batches (up to
+`max_batch_size`, waiting at most `max_wait_ms` for the batch to fill) so one
+`model.generate` call titles many conversations at once. Run it with
+`python manage.py title_service` and point `TITLE_SERVICE_URL` at it.
+"""
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+import time
+
+from .titles import generate_titles
+
+logger = logging.getLogger(__name__)
+
+
+class TitleBatcher:
+    """
+    Collects title requests from many threads and runs them in batches on a
+    single worker thread.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait_ms=20, generate=generate_titles):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.generate = generate
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='title-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """
+        Queue a prompt for the next batch.
+
+        Returns:
+            Future: Resolves to the generated title.
+        """
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _next_batch(self):
+        # Block for the first request, then wait briefly for the batch to fill
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for text, _ in batch]
+            try:
+                titles = self.generate(texts)
+            except Exception as e:
+                logger.exception(f"Title batch of size {len(batch)} failed")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            logger.info(f"Generated {len(titles)} title(s) in one batch")
+            for (_, future), title in zip(batch, titles):
+                future.set_result(title)
+
+
+class TitleRequestHandler(BaseHTTPRequestHandler):
+    # Set on the server by `make_server`
+    batcher = None
+    timeout_seconds = 30
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        if self.path != '/generate':
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            text = json.loads(self.rfile.read(length))['text']
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': 'Expected a JSON body with a "text" field.'})
+            return
+        # Anything else would fail the whole batch it lands in
+        if not isinstance(text, str) or not text.strip():
+            self._send_json(400, {'error': '"text" must be a non-empty string.'})
+            return
+
+        try:
+            title = self.batcher.submit(text).result(timeout=self.timeout_seconds)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'title': title})
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_server(host, port, batcher, timeout_seconds=30):
+    """
+    Build an HTTP server whose handler threads feed `batcher`.
+    """
+    handler = type('BoundTitleRequestHandler', (TitleRequestHandler,), {
+        'batcher': batcher,
+        'timeout_seconds': timeout_seconds,
+    })
+    return ThreadingHTTPServer((host, port), handler)
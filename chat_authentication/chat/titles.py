@@ -0,0 +1,147 @@
+# chat/titles.py
+import json
+import logging
+import urllib.request
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, OuterRef, Value, When
+
+from .components import registry
+from .models import Conversation
+
+logger = logging.getLogger(__name__)
+
+TEMPORARY_TITLE_PREFIX = "temporary_title"
+TITLE_MODEL_NAME = "czearing/article-title-generator"
+TITLE_MAX_LENGTH = Conversation._meta.get_field('title').max_length
+FALLBACK_TITLE_LENGTH = 50
+
+
+
+def _build_title_model():
+    # Processes that talk to the title service never load this
+    from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+    tokenizer = AutoTokenizer.from_pretrained(TITLE_MODEL_NAME)
+    model = AutoModelForSeq2SeqLM.from_pretrained(TITLE_MODEL_NAME)
+    return tokenizer, model
+
+
+registry.register('title_model', _build_title_model)
+
+
+def generate_titles(prompts):
+    """
+    Generate titles for a batch of prompts in a single padded `model.generate` call.
+
+    Args:
+        prompts (list[str]): Texts to title.
+
+    Returns:
+        list[str]: One title per prompt, in order.
+    """
+    if settings.CHAT_FAKE_MODELS:
+        from .fakes import fake_title
+        return [fake_title(prompt) for prompt in prompts]
+    tokenizer, model = registry.get('title_model')
+    inputs = tokenizer(prompts, return_tensors="pt", max_length=100, truncation=True, padding=True)
+    outputs = model.generate(**inputs, max_length=64, num_beams=5, early_stopping=True)
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+def generate_title(prompt):
+    """
+    Generate a title for `prompt`. With `TITLE_SERVICE_URL` set this is a thin
+    client of the shared title service (`manage.py title_service`), otherwise
+    the model is loaded in this process.
+    """
+    if settings.CHAT_FAKE_MODELS or not settings.TITLE_SERVICE_URL:
+        return generate_titles([prompt])[0]
+
+    request = urllib.request.Request(
+        settings.TITLE_SERVICE_URL.rstrip('/') + '/generate',
+        data=json.dumps({'text': prompt}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    with urllib.request.urlopen(request, timeout=settings.TITLE_SERVICE_TIMEOUT) as response:
+        return json.loads(response.read())['title']
+
+
+def temporary_title():
+    """
+    A unique placeholder title, kept until the title job has run.
+    """
+    return f"{TEMPORARY_TITLE_PREFIX}_{uuid.uuid4().hex[:8]}"
+
+
+def run_title_job(job):
+    """
+    Background job handler: replace the conversation's temporary title with
+    one generated from `job.payload['text']`.
+    """
+    conversation = job.conversation
+    if TEMPORARY_TITLE_PREFIX not in conversation.title:
+        # Already titled (e.g. by an earlier job for the same conversation)
+        return
+
+    generated_title = generate_title(job.payload['text'])[:TITLE_MAX_LENGTH]
+
+    try:
+        updated = _set_title(conversation, generated_title)
+    except IntegrityError:
+        # A concurrent job took the title between our check and write
+        updated = _set_title(conversation, _suffixed(generated_title))
+    if updated:
+        conversation.refresh_from_db(fields=['title'])
+        logger.info(f"Updated conversation {conversation.id} title to: {conversation.title}")
+
+
+def fallback_title(text, conversation):
+    """
+    A deterministic title for when generation keeps failing: the start of the
+    first message, or the conversation number.
+    """
+    words = " ".join(text.split())
+    if not words:
+        return f"Conversation {conversation.id}"
+    if len(words) > FALLBACK_TITLE_LENGTH:
+        words = words[:FALLBACK_TITLE_LENGTH].rsplit(' ', 1)[0] + "..."
+    return words
+
+
+def fallback_title_job(job):
+    """
+    Failure handler of title jobs: don't leave the temporary title forever.
+    """
+    conversation = job.conversation
+    title = fallback_title(job.payload.get('text', ''), conversation)
+    try:
+        updated = _set_title(conversation, title)
+    except IntegrityError:
+        updated = _set_title(conversation, _suffixed(title))
+    if updated:
+        logger.info(f"Gave conversation {conversation.id} a fallback title after title generation failed")
+
+
+def _suffixed(title):
+    return f"{title[:TITLE_MAX_LENGTH - 9]}_{uuid.uuid4().hex[:8]}"
+
+
+def _set_title(conversation, title):
+    """
+    Replace the temporary title in a single UPDATE that appends a random suffix
+    when the user already has a conversation with that title.
+
+    Returns:
+        int: 1 if the title was set, 0 if the conversation was already titled.
+    """
+    taken = Conversation.objects.filter(user_id=OuterRef('user_id'), title=title).exclude(id=OuterRef('id'))
+    with transaction.atomic():
+        return Conversation.objects.filter(
+            id=conversation.id, title__contains=TEMPORARY_TITLE_PREFIX,
+        ).update(title=Case(
+            When(Exists(taken), then=Value(_suffixed(title))),
+            default=Value(title),
+        ))
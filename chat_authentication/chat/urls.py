@@ -3,7 +3,17 @@ from . import views
 
 urlpatterns = [
     path('api/handle-message/', views.handle_message, name='handle_message'),
+    path('api/handle-message/stream/', views.handle_message_stream, name='handle_message_stream'),
     path('api/get-conversations/', views.get_conversations, name='get_conversations'),  # Updated path
     path('api/create-conversation/', views.create_conversation, name='create_conversation'),  # Updated path
     path('api/chat-history/<int:conversation_id>/', views.ChatHistoryAPIView.as_view(), name='chat-history'),
+    path('api/conversation-title/<int:conversation_id>/', views.get_conversation_title, name='conversation_title'),
+    path('api/ready/', views.readiness, name='readiness'),
+    path('api/metrics/', views.metrics, name='metrics'),
+    path('api/search/', views.search, name='search'),
+    path('api/export/', views.export_conversations, name='export_conversations'),
+    # Native async endpoints for ASGI deployments
+    path('api/async/handle-message/', views.ahandle_message, name='ahandle_message'),
+    path('api/async/get-conversations/', views.aget_conversations, name='aget_conversations'),
+    path('api/async/chat-history/<int:conversation_id>/', views.AsyncChatHistoryView.as_view(), name='async-chat-history'),
 ]
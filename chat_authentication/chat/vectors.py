@@ -0,0 +1,212 @@
+# chat/vectors.py
+"""
+Vector search shared by long-term memory (chat.memory) and document
+retrieval (chat.retrievers).
+
+Vectors are always kept as float32 bytes in a BinaryField, so every database
+can hold them and the NumPy stores can load them. On PostgreSQL with the
+pgvector extension, migrations add a `vector` column with an HNSW index next
+to it, and the pgvector stores search that instead.
+
+Both stores search the rows of one partition (a user's turns, a document
+collection) and return `(item id, cosine similarity)` pairs, best first.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+
+def to_bytes(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_bytes(data):
+    return np.frombuffer(bytes(data), dtype=np.float32)
+
+
+def pgvector_literal(vector):
+    """
+    Text form of a vector for `%s::vector` query parameters.
+    """
+    return '[' + ','.join(repr(float(x)) for x in vector) + ']'
+
+
+def has_pgvector_column(table, column='embedding'):
+    """
+    Whether the migrations could add the pgvector column to `table` (the
+    extension may be unavailable on the server).
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            [table, column],
+        )
+        return cursor.fetchone() is not None
+
+
+class NumpyIndex:
+    """
+    Exact cosine-similarity search over an in-memory matrix. Rows can be
+    appended; the matrix is rebuilt lazily on the next search.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self._rows = []
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids, vectors):
+        for row_id, vector in zip(ids, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            self.ids.append(row_id)
+            self._rows.append(vector / norm if norm else vector)
+        self._matrix = None
+
+    def search(self, vector, k, exclude=None):
+        """
+        Returns:
+            list[tuple]: Up to `k` (id, cosine similarity) pairs, best first,
+                skipping ids for which `exclude(id)` is true.
+        """
+        if not self.ids:
+            return []
+        if self._matrix is None:
+            self._matrix = np.vstack(self._rows)
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self._matrix @ query
+        results = []
+        for i in np.argsort(-scores):
+            row_id = self.ids[i]
+            if exclude is not None and exclude(row_id):
+                continue
+            results.append((row_id, float(scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+
+class NumpyVectorStore:
+    """
+    Exact cosine search over per-partition NumPy indexes of a model's
+    `vector` column. A partition is loaded on first use and then only fetches
+    rows newer than the last one it has; the least recently used partitions
+    are dropped beyond `max_partitions`.
+
+    Rows deleted since the load (by any process, or by a cascade or raw SQL
+    that sends no signals) show up as a lower row count, and the partition is
+    then loaded afresh.
+    """
+
+    def __init__(self, model, partition_field, item_field, max_partitions=100):
+        """
+        Args:
+            model: The model with the `vector` BinaryField.
+            partition_field (str): Field whose value selects a partition.
+            item_field (str): Field returned as the item id of a hit.
+            max_partitions (int): Partitions kept in memory at once.
+        """
+        self.model = model
+        self.partition_field = partition_field
+        self.item_field = item_field
+        self.max_partitions = max_partitions
+        self._indexes = OrderedDict()  # partition -> (NumpyIndex, last row id)
+        self._lock = threading.Lock()
+
+    def add(self, rows):
+        # Picked up by the next search's incremental load
+        pass
+
+    def _index(self, partition):
+        with self._lock:
+            index, last_id = self._indexes.pop(partition, (NumpyIndex(), 0))
+            queryset = self.model.objects.filter(**{self.partition_field: partition})
+            if last_id and queryset.filter(id__lte=last_id).count() != len(index):
+                index, last_id = NumpyIndex(), 0
+            rows = list(
+                queryset.filter(id__gt=last_id).order_by('id').values_list('id', self.item_field, 'vector')
+            )
+            if rows:
+                index.add([item for _, item, _ in rows], [from_bytes(v) for _, _, v in rows])
+                last_id = rows[-1][0]
+            self._indexes[partition] = (index, last_id)
+            while len(self._indexes) > self.max_partitions:
+                self._indexes.popitem(last=False)
+            return index
+
+    def search(self, partition, vector, k):
+        return self._index(partition).search(vector, k)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+class PgvectorVectorStore:
+    """
+    Nearest-neighbour search on a table's `embedding vector` column through
+    its HNSW index (cosine distance).
+
+    HNSW applies the partition filter to the candidates its scan returns (at
+    most hnsw.ef_search, 40 by default), so a partition holding a small share
+    of the rows can get fewer than k hits; raise hnsw.ef_search or enable
+    hnsw.iterative_scan (pgvector 0.8+) if that matters.
+    """
+
+    def __init__(self, table, partition_column, item_column):
+        self.table = table
+        self.search_sql = f"""
+            SELECT {item_column}, 1 - (embedding <=> %s::vector) AS score
+            FROM {table}
+            WHERE {partition_column} = %s AND embedding IS NOT NULL
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+        """
+
+    def add(self, rows):
+        """
+        Copy the new rows' vectors into the pgvector column.
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {self.table} SET embedding = %s::vector WHERE id = %s",
+                [(pgvector_literal(from_bytes(row.vector)), row.id) for row in rows],
+            )
+
+    def search(self, partition, vector, k):
+        literal = pgvector_literal(vector)
+        with connection.cursor() as cursor:
+            cursor.execute(self.search_sql, [literal, partition, literal, k])
+            return [(item, float(score)) for item, score in cursor.fetchall()]
+
+    def clear(self):
+        pass
+
+
+def build_vector_store(backend, model, partition_field, item_field):
+    """
+    Build the store named by a CHAT_*_STORE setting: 'pgvector', 'numpy' or
+    'auto' (pgvector when the table has the column).
+    """
+    table = model._meta.db_table
+    if backend == 'auto':
+        backend = 'pgvector' if has_pgvector_column(table) else 'numpy'
+    if backend == 'pgvector':
+        return PgvectorVectorStore(
+            table, model._meta.get_field(partition_field.removesuffix('_id')).column,
+            model._meta.get_field(item_field.removesuffix('_id')).column,
+        )
+    if backend == 'numpy':
+        return NumpyVectorStore(model, partition_field, item_field, settings.CHAT_VECTOR_NUMPY_MAX_PARTITIONS)
+    raise ValueError(f"Unknown vector store: {backend}")
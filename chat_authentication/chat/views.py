@@ -1,44 +1,146 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.core.exceptions import ObjectDoesNotExist
-from .models import ChatMessage, Conversation
+from .models import ChatMessage, Conversation, BackgroundJob
 from .serializers import ChatMessageSerializer, ConversationSerializer
-from langchain.memory.chat_message_histories.in_memory import ChatMessageHistory
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
 import os
-from .chatbot import runnable_with_history
+from . import chatbot
 from .custom_chat_history import DjangoChatMessageHistory
+from .titles import temporary_title, TEMPORARY_TITLE_PREFIX
+from .components import register_components, registry
+from django.conf import settings
+from . import jobs
 from langchain_core.messages import HumanMessage, AIMessage
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 import logging
 import uuid
+import json
 from django.shortcuts import get_object_or_404
 from rest_framework.parsers import JSONParser
+from rest_framework.authtoken.models import Token
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from django.utils.decorators import method_decorator
+from asgiref.sync import sync_to_async
+from functools import wraps
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from .archive import export_lines, gzip_stream
+from .search import search_messages
+from .summary import summary_due
+from .rewrite import rewrite_stats
+from .gateway import GatewayOverloaded, aacquire_slot, acquire_slot
+from .pagination import ConversationPage, HistoryPage, InvalidCursor, history_etag
 
 
 logger = logging.getLogger(__name__)
 
-# Load the tokenizer and model for title generation
-tokenizer = AutoTokenizer.from_pretrained("czearing/article-title-generator")
-model = AutoModelForSeq2SeqLM.from_pretrained("czearing/article-title-generator")
 
+def _get_or_create_conversation(user, session_id):
+    """
+    Fetch the user's conversation for `session_id`, or create a new one with a
+    temporary title when no ID is given.
+
+    Returns:
+        tuple: (conversation, error_response). Exactly one of them is None.
+    """
+    if session_id:
+        try:
+            conversation = Conversation.objects.get(id=session_id, user=user)
+            logger.info(f"Fetched existing conversation with ID: {session_id}")
+        except Conversation.DoesNotExist:
+            logger.warning(f"Conversation with ID {session_id} not found for user {user}")
+            return None, JsonResponse({'error': 'Conversation not found.'}, status=404)
+        return conversation, None
+
+    # Generate a unique temporary title using UUID
+    title = temporary_title()
+
+    # Attempt to create a new conversation with a unique title
+    try:
+        conversation = Conversation.objects.create(user=user, title=title)
+        logger.info(f"Created a new conversation with ID: {conversation.id} and title: '{title}'")
+    except Exception as e:
+        logger.exception("Error occurred while creating a new conversation")
+        return None, JsonResponse({"error": "Internal server error while creating conversation."}, status=500)
+    return conversation, None
+
+
+def _schedule_summary(conversation):
+    """
+    Queue a rolling-summary update for the conversation once turns have left
+    the history window unsummarized. It runs in the background, after the
+    reply has been returned.
+    """
+    if not settings.CHAT_SUMMARY_ENABLED or not summary_due(conversation):
+        return
+    if not jobs.is_pending(conversation, BackgroundJob.KIND_SUMMARY):
+        jobs.enqueue(conversation, BackgroundJob.KIND_SUMMARY)
+
+
+def _schedule_embedding(conversation):
+    """
+    Queue embedding of the conversation's new turns for long-term memory.
+    """
+    if settings.CHAT_MEMORY_ENABLED and not jobs.is_pending(conversation, BackgroundJob.KIND_EMBED):
+        jobs.enqueue(conversation, BackgroundJob.KIND_EMBED)
+
+
+def _after_turn(conversation, ai_response):
+    """
+    Schedule the background work that follows a completed turn.
 
-def generate_title(prompt):
-    inputs = tokenizer(prompt, return_tensors="pt", max_length=100, truncation=True)
-    outputs = model.generate(**inputs, max_length=64, num_beams=5, early_stopping=True)
-    generated_title = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return generated_title
+    Returns:
+        bool: Whether a title is still pending for the conversation.
+    """
+    _schedule_summary(conversation)
+    _schedule_embedding(conversation)
+    return _schedule_title(conversation, ai_response)
 
 
+def _schedule_title(conversation, ai_response):
+    """
+    If the conversation still has a "temporary_title", queue a background job
+    that replaces it with a title generated from the AI response.
+
+    Returns:
+        bool: Whether a title is still pending for the conversation.
+    """
+    if TEMPORARY_TITLE_PREFIX not in conversation.title:
+        return False
+    if not jobs.is_pending(conversation, BackgroundJob.KIND_TITLE):
+        jobs.enqueue(conversation, BackgroundJob.KIND_TITLE, text=ai_response)
+    return True
+
+
+def _use_rag(data, default):
+    """
+    Whether to answer from the document collection: the request's `use_rag`
+    when given, otherwise `default` (the conversation's setting).
+    """
+    value = data.get('use_rag')
+    if value is None:
+        return default
+    return value in (True, 'true', 'True', '1', 1)
+
+
+def _overloaded_response(error):
+    response = JsonResponse({'error': 'Too many requests, please retry later.'}, status=429)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _sse_event(event, data):
+    """
+    Format a single Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 
 @api_view(['POST'])
 @authentication_classes([TokenAuthentication])
@@ -60,101 +162,426 @@ def handle_message(request):
         logger.warning("Input message is missing")
         return JsonResponse({'error': 'Input message is required.'}, status=400)
 
-    # Check if a conversation ID is provided
-    if session_id:
-        try:
-            conversation = Conversation.objects.get(id=session_id, user=user)
-            logger.info(f"Fetched existing conversation with ID: {session_id}")
-        except Conversation.DoesNotExist:
-            logger.warning(f"Conversation with ID {session_id} not found for user {user}")
-            return JsonResponse({'error': 'Conversation not found.'}, status=404)
-    else:
-        # Generate a unique temporary title using UUID
-        temporary_title = f"temporary_title_{uuid.uuid4().hex[:8]}"
-        
-        # Attempt to create a new conversation with a unique title
+    # Wait for an LLM slot before any database writes
+    try:
+        slot = acquire_slot(user)
+    except GatewayOverloaded as e:
+        return _overloaded_response(e)
+
+    with slot:
+        conversation, error_response = _get_or_create_conversation(user, session_id)
+        if error_response is not None:
+            return error_response
+        session_id = conversation.id
+
         try:
-            conversation = Conversation.objects.create(user=user, title=temporary_title)
-            session_id = conversation.id
-            logger.info(f"Created a new conversation with ID: {session_id} and title: '{temporary_title}'")
+            logger.info(f"Invoking model with session ID: {str(session_id)} and input_message: {input_message}")
+
+            # Invoke the model with the correct session ID
+            response = chatbot.chain_for(_use_rag(request.data, conversation.use_rag)).invoke(
+                {"input": input_message},
+                config=chatbot.history_config(conversation)
+            )
+            answer = chatbot.answer_text(response)
+
+            logger.debug(f"Model response: {answer}")
+
+            # Update the rolling summary and, for a "temporary_title", generate the title in the background
+            title_pending = _after_turn(conversation, answer)
+
+            return JsonResponse({
+                'response': answer, 
+                'conversation_id': session_id, 
+                'title': conversation.title,
+                'title_pending': title_pending,
+                'sources': chatbot.answer_sources(response),
+            }, status=200)
+
         except Exception as e:
-            logger.exception("Error occurred while creating a new conversation")
-            return JsonResponse({"error": "Internal server error while creating conversation."}, status=500)
+            logger.exception("Error occurred while handling message")
+            return JsonResponse({'error': str(e)}, status=500)
 
-    try:
-        logger.info(f"Invoking model with session ID: {str(session_id)} and input_message: {input_message}")
 
-        # Invoke the model with the correct session ID
-        response = runnable_with_history.invoke(
-            {"input": input_message},
-            config={"configurable": {"session_id": str(session_id)}}
-        )
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def handle_message_stream(request):
+    """
+    Streaming variant of `handle_message` that pushes tokens to the client as
+    Server-Sent Events while the LLM is still generating.
 
-        logger.debug(f"Model response: {response.content}")
-
-          # If a new conversation was created with "temporary_title", update it based on the AI response
-        if "temporary_title" in conversation.title:
-            generated_title = generate_title(response.content)
-            
-            # Ensure the title is unique by appending a random UUID if necessary
-            if Conversation.objects.filter(title=generated_title).exists():
-                generated_title = f"{generated_title}_{uuid.uuid4().hex[:8]}"
-            
-            conversation.title = generated_title
-            conversation.save()
-            logger.info(f"Updated conversation title to: {generated_title}")
-
-        return JsonResponse({
-            'response': response.content, 
-            'conversation_id': session_id, 
-            'title': conversation.title
-        }, status=200)
+    Emits one `token` event per chunk, then a `done` event carrying the
+    conversation ID and (possibly still temporary) title. The human and AI messages are persisted through
+    DjangoChatMessageHistory by the chain (see `chatbot.chain_for`) once the stream ends.
+    """
+    logger.info("handle_message_stream function called")
 
-    except Exception as e:
-        logger.exception("Error occurred while handling message")
-        return JsonResponse({'error': str(e)}, status=500)
+    user = request.user
+    input_message = request.data.get('input_message')
+    session_id = request.data.get('conversation_id')
 
+    if not input_message:
+        logger.warning("Input message is missing")
+        return JsonResponse({'error': 'Input message is required.'}, status=400)
 
+    try:
+        slot = acquire_slot(user)
+    except GatewayOverloaded as e:
+        return _overloaded_response(e)
 
-class ChatHistoryAPIView(APIView):
-    def get(self, request, conversation_id):
-        try:
-            # Fetch the conversation using get_object_or_404
-            conversation = get_object_or_404(Conversation, id=conversation_id)
+    # Until the stream owns the slot, any failure must hand it back
+    try:
+        conversation, error_response = _get_or_create_conversation(user, session_id)
+        if error_response is not None:
+            slot.release()
+            return error_response
+
+        chain = chatbot.chain_for(_use_rag(request.data, conversation.use_rag))
+
+        def event_stream():
+            chunks = []
+            try:
+                for chunk in chain.stream(
+                    {"input": input_message},
+                    config=chatbot.history_config(conversation)
+                ):
+                    content = chatbot.answer_text(chunk)
+                    if content:
+                        chunks.append(content)
+                        yield _sse_event('token', {'content': content})
+
+                title_pending = _after_turn(conversation, "".join(chunks))
+
+                yield _sse_event('done', {
+                    'conversation_id': conversation.id,
+                    'title': conversation.title,
+                    'title_pending': title_pending,
+                })
+            except Exception as e:
+                logger.exception("Error occurred while streaming message")
+                yield _sse_event('error', {'error': str(e)})
+            finally:
+                slot.release()
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop reverse proxies (nginx) from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    except Exception:
+        slot.release()
+        raise
+
+
+
+def _history_data(conversation, messages, pagination, delta):
+    data = {
+        'messages': ChatMessageSerializer(messages, many=True).data,
+        'pagination': pagination,
+    }
+    if not delta:
+        data['conversation'] = ConversationSerializer(conversation).data
+    return data
+
+
+def _with_etag(response, etag):
+    response['ETag'] = etag
+    # Let browsers keep the response but revalidate it every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-            # Serialize the conversation data
-            conversation_data = ConversationSerializer(conversation).data
 
-            # Fetch and serialize messages associated with the conversation
-            messages = ChatMessage.objects.filter(conversation=conversation)
-            messages_data = ChatMessageSerializer(messages, many=True).data
+class ChatHistoryAPIView(APIView):
+    def get(self, request, conversation_id):
+        """
+        Return one page of the user's conversation, newest messages by default.
+        See `chat.pagination.HistoryPage` for the `before`/`after`/`since`
+        cursors. Answers 304 when the `If-None-Match` ETag is still current.
+        """
+        conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+
+        etag = quote_etag(history_etag(conversation, request.GET))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return _with_etag(not_modified, etag)
 
-            # Combine conversation and message data in the response
-            response_data = {
-                'conversation': conversation_data,
-                'messages': messages_data,
-            }
+        try:
+            page = HistoryPage(ChatMessage.objects.filter(conversation=conversation), request.GET)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
-            return JsonResponse(response_data, safe=False, status=200)
+        try:
+            messages, pagination = page.build(list(page.slice()))
+            response = JsonResponse(_history_data(conversation, messages, pagination, page.delta), status=200)
+            return _with_etag(response, etag)
 
         except Exception as e:
             logger.exception("Error fetching chat history")
             return JsonResponse({'error': 'Internal server error while fetching chat history.'}, status=500)
 
 
-
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_conversations(request):
     """
-    Retrieve all existing conversations for the authenticated user.
+    Retrieve a page of the authenticated user's conversations, most recently
+    active first, with their message count and a preview of the last message.
+    See `chat.pagination.ConversationPage` for the parameters.
     """
+    try:
+        page = ConversationPage(Conversation.objects.filter(user=request.user), request.GET)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    conversations, pagination = page.build(list(page.slice()))
+    return JsonResponse({'conversations': conversations, 'pagination': pagination})
+
+
+
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def search(request):
+    """
+    Full-text search across the user's conversations (`?q=...&limit=...`),
+    best matches first with highlighted snippets.
+    """
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return JsonResponse({'error': 'Search query is required.'}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), settings.CHAT_SEARCH_MAX_RESULTS))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    return JsonResponse({'results': search_messages(request.user, query, limit)})
+
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def export_conversations(request):
+    """
+    Stream all of the user's conversations as NDJSON (see `chat.archive`),
+    gzipped with `?compression=gzip`. Rows are read and sent a chunk at a time.
+    """
+    lines = export_lines(request.user)
+    if request.GET.get('compression') == 'gzip':
+        response = StreamingHttpResponse(gzip_stream(lines), content_type='application/gzip')
+        filename = 'conversations.ndjson.gz'
+    else:
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        filename = 'conversations.ndjson'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def get_conversation_title(request, conversation_id):
+    """
+    Poll the title of a conversation while its title job is pending.
+    """
+    conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+    return JsonResponse({
+        'conversation_id': conversation.id,
+        'title': conversation.title,
+        'pending': jobs.is_pending(conversation, BackgroundJob.KIND_TITLE),
+    })
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def readiness(request):
+    """
+    Readiness probe. While a boot warmup (CHAT_WARMUP_ON_START) is running or
+    has failed, 503 until the components in CHAT_READY_COMPONENTS are loaded
+    in this process. Without one they are built on first use, so the process
+    is ready right away.
+    """
+    components_registry = register_components()
+    components = components_registry.status()
+    warmup = components_registry.warmup_status()
+    ready = warmup['state'] == 'not started' or all(
+        components.get(name) for name in settings.CHAT_READY_COMPONENTS
+    )
+    return JsonResponse({
+        'ready': ready,
+        'components': components,
+        'warmup': warmup,
+    }, status=200 if ready else 503)
+
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """
+    Operational counters of the components loaded in this process (query
+    rewrites, response cache, LLM gateway, model retries and fallbacks), for
+    staff users only. Components not loaded yet report None.
+    """
+    llm = registry.get('llm') if registry.is_loaded('llm') else None
+    return JsonResponse({
+        'rag_rewrite': rewrite_stats.report(),
+        'response_cache': registry.get('response_cache').stats() if registry.is_loaded('response_cache') else None,
+        'llm_gateway': registry.get('llm_gateway').stats() if registry.is_loaded('llm_gateway') else None,
+        'llm': llm.stats() if hasattr(llm, 'stats') else None,
+    })
+
+
+########### ASYNC VIEWS ###############
+# Native coroutine views for ASGI deployments. They hold no worker thread
+# while waiting on the LLM, so one ASGI worker can keep many conversations
+# in flight. DRF function views are sync-only, so token authentication is
+# done here on the async ORM.
+
+async def _aget_token_user(request):
+    """
+    Resolve the user for a DRF-style `Authorization: Token <key>` header.
+
+    Returns:
+        User or None: The active user owning the token, or None.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        return None
+    if not token.user.is_active:
+        return None
+    return token.user
+
+
+def async_token_required(view_func):
+    """
+    Decorator for async views: authenticate with a token and set `request.user`,
+    or answer 401 like DRF's IsAuthenticated would.
+    """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await _aget_token_user(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+@async_token_required
+async def ahandle_message(request):
+    """
+    Async version of `handle_message` using `ainvoke` and the async ORM.
+    """
+    logger.info("ahandle_message function called")
+
     user = request.user
-    conversations = Conversation.objects.filter(user=user)
-    serialized_conversations = ConversationSerializer(conversations, many=True)
-    return JsonResponse(serialized_conversations.data, safe=False)
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body.'}, status=400)
+
+    input_message = data.get('input_message')
+    session_id = data.get('conversation_id')
 
+    if not input_message:
+        logger.warning("Input message is missing")
+        return JsonResponse({'error': 'Input message is required.'}, status=400)
+
+    try:
+        slot = await aacquire_slot(user)
+    except GatewayOverloaded as e:
+        return _overloaded_response(e)
+
+    async with slot:
+        if session_id:
+            try:
+                conversation = await Conversation.objects.aget(id=session_id, user=user)
+            except Conversation.DoesNotExist:
+                logger.warning(f"Conversation with ID {session_id} not found for user {user}")
+                return JsonResponse({'error': 'Conversation not found.'}, status=404)
+        else:
+            title = temporary_title()
+            try:
+                conversation = await Conversation.objects.acreate(user=user, title=title)
+                logger.info(f"Created a new conversation with ID: {conversation.id} and title: '{title}'")
+            except Exception as e:
+                logger.exception("Error occurred while creating a new conversation")
+                return JsonResponse({"error": "Internal server error while creating conversation."}, status=500)
+
+        try:
+            response = await chatbot.chain_for(_use_rag(data, conversation.use_rag)).ainvoke(
+                {"input": input_message},
+                config=chatbot.history_config(conversation)
+            )
+            answer = chatbot.answer_text(response)
+
+            title_pending = await sync_to_async(_after_turn)(conversation, answer)
+
+            return JsonResponse({
+                'response': answer,
+                'conversation_id': conversation.id,
+                'title': conversation.title,
+                'title_pending': title_pending,
+                'sources': chatbot.answer_sources(response),
+            }, status=200)
+
+        except Exception as e:
+            logger.exception("Error occurred while handling message")
+            return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(['GET'])
+@async_token_required
+async def aget_conversations(request):
+    """
+    Async version of `get_conversations`.
+    """
+    try:
+        page = ConversationPage(Conversation.objects.filter(user=request.user), request.GET)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    conversations, pagination = page.build([c async for c in page.slice()])
+    return JsonResponse({'conversations': conversations, 'pagination': pagination})
+
+
+@method_decorator(async_token_required, name='dispatch')
+class AsyncChatHistoryView(View):
+    """
+    Async version of `ChatHistoryAPIView`, limited to the user's own conversations.
+    """
+    http_method_names = ['get']
+
+    async def get(self, request, conversation_id):
+        try:
+            conversation = await Conversation.objects.aget(id=conversation_id, user=request.user)
+        except Conversation.DoesNotExist:
+            return JsonResponse({'error': 'Conversation not found.'}, status=404)
+
+        etag = quote_etag(history_etag(conversation, request.GET))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return _with_etag(not_modified, etag)
+
+        try:
+            page = HistoryPage(ChatMessage.objects.filter(conversation=conversation), request.GET)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        try:
+            messages, pagination = page.build([m async for m in page.slice()])
+            response = JsonResponse(_history_data(conversation, messages, pagination, page.delta), status=200)
+            return _with_etag(response, etag)
+
+        except Exception as e:
+            logger.exception("Error fetching chat history")
+            return JsonResponse({'error': 'Internal server error while fetching chat history.'}, status=500)
 
 
 @api_view(['POST'])
@@ -162,27 +589,28 @@ def get_conversations(request):
 @permission_classes([IsAuthenticated])
 def create_conversation(request):
     """
-    Create a new conversation and store it in the database with a generated title.
+    Create a new conversation and store it in the database. With an initial
+    message, its title is generated by a background job.
     """
     user = request.user
     initial_message = request.data.get('initial_message', None)  # Allow initial_message to be optional
-    default_title = "temporary_title"
     try:
-        # Create a placeholder title first
-        new_conversation = Conversation.objects.create(user=user, title=default_title)
+        # Create a unique placeholder title first
+        new_conversation = Conversation.objects.create(
+            user=user, title=temporary_title(), use_rag=_use_rag(request.data, False),
+        )
+        title = new_conversation.title
 
         if initial_message:
-            # Generate a title based on the AI's first response to the initial message
             ai_response = "AI response based on initial_message"  # Placeholder AI response
-            title = generate_title(ai_response)
-            new_conversation.title = title
-            new_conversation.save()
 
             # Store the initial message in ChatMessage
-            ChatMessage.objects.create(conversation=new_conversation, user_response=initial_message, ai_response=ai_response)
-        else:
-            # If no initial message, keep the title as "Temporary Title" or handle differently
-            title = default_title
+            DjangoChatMessageHistory(conversation_id=new_conversation.id, conversation=new_conversation).add_messages(
+                [HumanMessage(content=initial_message), AIMessage(content=ai_response)]
+            )
+
+            # Generate a title based on the AI's first response in the background
+            _schedule_title(new_conversation, ai_response)
 
         # Serialize the response
         response_data = {
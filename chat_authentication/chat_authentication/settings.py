@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -121,6 +122,16 @@ DATABASES = {
     }
 }
 
+# DJANGO_DB=sqlite runs on a local SQLite file instead (no Postgres needed);
+# chat search then uses SQLite's FTS5 instead of a tsvector GIN index
+if os.getenv('DJANGO_DB') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
 
 
 #TEST_RUNNER = 'django.test.runner.DiscoverRunner'
@@ -216,3 +227,176 @@ LOGGING = {
         },
     },
 }
+
+
+# Background jobs (chat.jobs)
+# Threads per process that drain the job queue after each commit. Set to 0
+# when running dedicated `python manage.py run_jobs` worker processes instead.
+CHAT_JOB_WORKER_THREADS = int(os.getenv('CHAT_JOB_WORKER_THREADS', 1))
+CHAT_JOB_MAX_ATTEMPTS = 3
+# Seconds before retrying a failed job, doubling per attempt up to the maximum
+CHAT_JOB_RETRY_DELAY = 5
+CHAT_JOB_RETRY_MAX_DELAY = 300
+# Jobs left "running" longer than this (seconds) are assumed orphaned
+CHAT_JOB_STALE_AFTER = 300
+# Seconds finished jobs are kept before workers delete them (failed ones are
+# kept longer, to look into), and how often a worker checks for them
+CHAT_JOB_DONE_RETENTION = 86400
+CHAT_JOB_FAILED_RETENTION = 7 * 86400
+CHAT_JOB_PURGE_INTERVAL = 3600
+
+# Title generation (chat.titles)
+# URL of the shared micro-batching title service (`python manage.py title_service`).
+# When unset, each process loads its own copy of the title model.
+TITLE_SERVICE_URL = os.getenv('TITLE_SERVICE_URL')
+TITLE_SERVICE_TIMEOUT = 30
+TITLE_SERVICE_MAX_BATCH_SIZE = 16
+TITLE_SERVICE_MAX_WAIT_MS = 20
+
+# Lazy components (chat.components)
+# Built in the background when the app starts with CHAT_WARMUP_ON_START (set
+# it for server processes, not for management commands), and by
+# `python manage.py warmup` when no names are given
+CHAT_WARMUP_ON_START = os.getenv('CHAT_WARMUP_ON_START', '0') == '1'
+CHAT_WARMUP_COMPONENTS = ['llm', 'runnable_with_history', 'history_tokenizer']
+# Components that must be loaded before api/ready/ reports ready, when a boot
+# warmup was started (otherwise they load on first use and the probe passes)
+CHAT_READY_COMPONENTS = ['runnable_with_history']
+
+# Chat history window (chat.custom_chat_history)
+# Only the most recent turns are loaded and sent to the LLM, so prompt size and
+# per-turn latency stay flat as conversations grow. None disables a limit.
+CHAT_HISTORY_MAX_TURNS = 20
+CHAT_HISTORY_MAX_TOKENS = 3000
+CHAT_HISTORY_TOKEN_ENCODING = 'cl100k_base'
+# Fold turns that fall out of the window into a per-conversation rolling
+# summary (updated by a background job after each reply)
+CHAT_SUMMARY_ENABLED = True
+# Rows folded into the summary per job; a longer backlog is spread over
+# follow-up jobs so no single prompt grows with it
+CHAT_SUMMARY_MAX_ROWS = 50
+
+# Cache of loaded history windows (chat.history_cache), so hot conversations
+# skip the history query. 'null' disables it; 'django' uses a CACHES alias
+# shared by the workers (e.g. Redis; not the default per-process LocMemCache);
+# 'local' is a per-process LRU, only correct when a single process serves
+# every request, as other processes' writes would leave it stale.
+CHAT_HISTORY_CACHE = {
+    'BACKEND': os.getenv('CHAT_HISTORY_CACHE_BACKEND', 'null'),
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'ALIAS': 'default',
+    'TIMEOUT': 3600,
+}
+
+# Chat history endpoint pagination (chat.pagination)
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+# Conversation list endpoint pagination
+CHAT_CONVERSATIONS_PAGE_SIZE = 50
+CHAT_CONVERSATIONS_MAX_PAGE_SIZE = 200
+# chat_conv_user_activity_idx covers the list with INCLUDE columns on PostgreSQL;
+# other backends just build it without them
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Full-text search (chat.search)
+CHAT_SEARCH_MAX_RESULTS = 100
+
+# Size of the embeddings (1536 for OpenAI's default). The pgvector columns of
+# migrations 0011 and 0012 are fixed at 1536; another size needs a migration.
+CHAT_EMBEDDING_DIM = 1536
+# Cache of computed embeddings (chat.embedding_cache): an in-process LRU of
+# MAX_ENTRIES float32 vectors (about 6 KB each at 1536 dimensions) in front of
+# a SQLite file at PATH (None: memory only), kept outside the source tree.
+# None disables the cache.
+CHAT_EMBEDDING_CACHE = {
+    'PATH': os.getenv(
+        'CHAT_EMBEDDING_CACHE_PATH',
+        str(Path(os.getenv('XDG_CACHE_HOME', Path.home() / '.cache')) / 'chat_authentication' / 'embeddings.sqlite3'),
+    ),
+    'MAX_ENTRIES': 10000,
+}
+# Partitions (a user's memory, a document collection) each numpy vector store
+# keeps in memory at once
+CHAT_VECTOR_NUMPY_MAX_PARTITIONS = 100
+
+# Long-term semantic memory (chat.memory)
+# Each stored turn is embedded by a background job; on every request the most
+# similar turns from any of the user's conversations are added to the prompt.
+# Off by default: it costs an embeddings call per turn (for users who have
+# embedded turns) and an embedding job per reply.
+CHAT_MEMORY_ENABLED = os.getenv('CHAT_MEMORY_ENABLED', '0') == '1'
+# 'pgvector' (PostgreSQL with the extension), 'numpy' (per-process in-memory
+# index, for development and tests) or 'auto' (pgvector when available)
+CHAT_MEMORY_STORE = os.getenv('CHAT_MEMORY_STORE', 'auto')
+CHAT_MEMORY_TOP_K = 3
+# Cosine similarity below which a past turn is not considered relevant
+CHAT_MEMORY_MIN_SCORE = 0.8
+
+# Retrieval-augmented answers (chat.retrievers)
+# 'astra' uses the remote AstraDB collection; 'pgvector', 'numpy' and 'auto'
+# (see CHAT_MEMORY_STORE) search the local DocumentChunk table, so switch to
+# them only once the documents have been loaded with `manage.py ingest`
+CHAT_VECTOR_STORE = os.getenv('CHAT_VECTOR_STORE', 'astra')
+CHAT_RAG_COLLECTION = 'text_qa_pdf'
+CHAT_RAG_TOP_K = 3
+CHAT_RAG_SCORE_THRESHOLD = 0.5
+# Rewriting a follow-up question into a standalone one costs an LLM call
+# before retrieval. 'auto' skips it for questions that look self-contained
+# (chat.rewrite); 'always' rewrites whenever there is history.
+CHAT_RAG_REWRITE = 'auto'
+# Also retrieve with the question as asked while it is being rewritten, and
+# merge both results
+CHAT_RAG_PARALLEL_RETRIEVAL = False
+
+# Cache of LLM answers (chat.response_cache): exact prompt matches and, with
+# SEMANTIC, history-free questions whose embedding is at least
+# SEMANTIC_THRESHOLD similar to a cached one. PATH is a SQLite file shared by
+# the host's workers; None keeps the cache in memory. None disables it.
+CHAT_RESPONSE_CACHE = {
+    'PATH': os.getenv('CHAT_RESPONSE_CACHE_PATH'),
+    'TTL': 24 * 3600,
+    'MAX_ENTRIES': 10000,
+    'SEMANTIC': False,
+    'SEMANTIC_THRESHOLD': 0.95,
+}
+
+# Admission control for chat turns (chat/gateway.py): at most MAX_CONCURRENCY
+# turns call the LLM at once per process; others wait up to QUEUE_TIMEOUT
+# seconds in per-user queues served round-robin. Beyond MAX_QUEUE waiting
+# turns (MAX_QUEUE_PER_USER for one user) requests get 429 with Retry-After.
+CHAT_LLM_GATEWAY = {
+    'MAX_CONCURRENCY': int(os.getenv('CHAT_LLM_MAX_CONCURRENCY', '8')),
+    'MAX_QUEUE': 64,
+    'MAX_QUEUE_PER_USER': 2,
+    'QUEUE_TIMEOUT': 10,
+}
+
+# Chat model calls (chat/resilience.py). MODEL and FALLBACK_MODELS are "model"
+# or "provider:model" specs, tried in order. An attempt without a first token
+# after FIRST_TOKEN_TIMEOUT seconds, or failing with a retryable error, is
+# retried MAX_RETRIES times (jittered backoff from BACKOFF_BASE up to
+# BACKOFF_MAX seconds) before the next model; the whole call has TIMEOUT
+# seconds. With HEDGE_DELAY set, a second request is sent after that many
+# seconds without a first token and the first to answer is used.
+CHAT_LLM = {
+    'MODEL': os.getenv('CHAT_LLM_MODEL', 'gpt-3.5-turbo-1106'),
+    'FALLBACK_MODELS': [spec for spec in os.getenv('CHAT_LLM_FALLBACK_MODELS', '').split(',') if spec],
+    'TIMEOUT': 60,
+    'FIRST_TOKEN_TIMEOUT': 15,
+    'HEDGE_DELAY': float(os.getenv('CHAT_LLM_HEDGE_DELAY')) if os.getenv('CHAT_LLM_HEDGE_DELAY') else None,
+    'MAX_RETRIES': 2,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 8,
+}
+
+# Deterministic local stand-ins for the chat model, embeddings and title
+# generator (chat/fakes.py), for tests and `manage.py loadtest` without
+# credentials. Answers start after TTFT seconds and stream at
+# TOKENS_PER_SECOND; RESPONSES (None for a default) are used in turn.
+# Set CHAT_FAKE_MODELS=1 in the environment to enable; None uses the real providers.
+CHAT_FAKE_MODELS = {
+    'TTFT': float(os.getenv('CHAT_FAKE_TTFT', '0.2')),
+    'TOKENS_PER_SECOND': float(os.getenv('CHAT_FAKE_TOKENS_PER_SECOND', '50')),
+    'RESPONSES': None,
+} if os.getenv('CHAT_FAKE_MODELS') else None
@@ -1,17 +1,22 @@
-import React, { useState, useCallback } from 'react';
+import React, { useState, useCallback, useRef } from 'react';
 import ConversationList from './components/ConversationList';
 import ChatWindow from './components/ChatWindow';
 import MessageInput from './components/MessageInput';
 import NewChatButton from './components/NewChatButton';
 import './App.css';
 import '@fortawesome/fontawesome-free/css/all.min.css';
-import { getChatHistory, sendMessage } from './services/api'; // Import required functions
+import { getChatHistoryPage, streamMessage } from './services/api'; // Import required functions
 
 const App = () => {
   const [selectedConversation, setSelectedConversation] = useState(null);
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  // Cursor of the newest message we have, so later fetches only get new ones
+  const cursorRef = useRef(null);
+  // Cursor of the oldest message we have, while older pages remain
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
 
   // Function to fetch messages for the selected conversation
   const fetchMessages = useCallback(async () => {
@@ -20,13 +25,16 @@ const App = () => {
     setLoading(true); // Set loading to true before starting the fetch
 
     try {
-      const data = await getChatHistory(selectedConversation.id);
-      if (Array.isArray(data)) {
-        setMessages(data);
-        setError(null); // Clear any previous errors on success
+      const since = cursorRef.current;
+      const data = await getChatHistoryPage(selectedConversation.id, since ? { since } : {});
+      if (since) {
+        setMessages((previous) => [...previous, ...data.messages]);
       } else {
-        throw new Error('Fetched data is not an array');
+        setMessages(data.messages);
+        setOlderCursor(data.pagination.has_more ? data.pagination.previous : null);
       }
+      cursorRef.current = data.pagination.next;
+      setError(null); // Clear any previous errors on success
     } catch (err) {
       console.error("Error fetching chat history:", err);
       setError('Error fetching chat history');
@@ -35,29 +43,60 @@ const App = () => {
     }
   }, [selectedConversation]);
 
+  // Prepend the page before the oldest message shown
+  const loadOlderMessages = async () => {
+    if (!selectedConversation || !olderCursor) return;
+
+    setLoadingOlder(true);
+    try {
+      const data = await getChatHistoryPage(selectedConversation.id, { before: olderCursor });
+      setMessages((previous) => [...data.messages, ...previous]);
+      setOlderCursor(data.pagination.has_more ? data.pagination.previous : null);
+      setError(null);
+    } catch (err) {
+      console.error("Error fetching older messages:", err);
+      setError('Error fetching older messages');
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   // Fetch messages when a new conversation is selected
   const handleSelectConversation = (conversation) => {
     setSelectedConversation(conversation);
     setMessages([]); // Reset messages when a new conversation is selected
+    cursorRef.current = null;
+    setOlderCursor(null);
     fetchMessages(); // Fetch messages for the selected conversation
   };
 
-  // Handle sending a new message
+  // Handle sending a new message: the reply is streamed into the chat as it is generated
   const handleNewMessage = async (message) => {
-    setLoading(true); // Set loading to true before sending the message
+    setLoading(true); // Set loading to true until the first token arrives
+
+    // Shown right away; the AI side fills in token by token
+    setMessages((previous) => [...previous, { user_response: message, ai_response: '' }]);
 
     try {
-      const response = await sendMessage(
+      const response = await streamMessage(
         selectedConversation ? selectedConversation.id : null,
-        message
+        message,
+        (token) => {
+          setLoading(false);
+          setMessages((previous) => {
+            const last = previous[previous.length - 1];
+            return [...previous.slice(0, -1), { ...last, ai_response: last.ai_response + token }];
+          });
+        }
       );
-      if (response && response.response) {
+      if (response && response.conversation_id) {
         setError(null); // Clear any previous errors on success
 
-        // Fetch updated chat history after receiving AI response
-        fetchMessages();
-
-        if (!selectedConversation) {
+        if (selectedConversation) {
+          // Swap the streamed copy for the stored turn, so the history cursor moves past it
+          setMessages((previous) => previous.slice(0, -1));
+          fetchMessages();
+        } else {
           // If no conversation was previously selected, set the new one
           setSelectedConversation({
             id: response.conversation_id,
@@ -69,15 +108,18 @@ const App = () => {
       }
     } catch (error) {
       console.error('Failed to fetch AI response:', error);
+      setMessages((previous) => previous.slice(0, -1)); // The turn was not stored
       setError('Failed to fetch AI response');
     } finally {
-      setLoading(false); // Set loading to false after the message is sent or fails
+      setLoading(false); // Set loading to false after the stream ends or fails
     }
   };
 
   const handleResetChat = () => {
     setSelectedConversation(null);
     setMessages([]);
+    cursorRef.current = null;
+    setOlderCursor(null);
     setError(null); // Clear any previous errors on reset
   };
 
@@ -100,11 +142,12 @@ const App = () => {
             messages={messages} 
             loading={loading} 
             error={error}
+            hasOlder={olderCursor !== null}
+            loadingOlder={loadingOlder}
+            onLoadOlder={loadOlderMessages}
           />
           <MessageInput 
-            conversationId={selectedConversation ? selectedConversation.id : null} 
             onNewMessage={handleNewMessage}
-            setConversationId={setSelectedConversation} // Pass setSelectedConversation as setConversationId
           />
         </div>
       </div>
@@ -161,7 +161,7 @@
 import React from 'react';
 import '../styles/ChatWindow.css';
 
-const ChatWindow = ({ messages, loading, error }) => {
+const ChatWindow = ({ messages, loading, error, hasOlder, loadingOlder, onLoadOlder }) => {
   console.log("Rendering ChatWindow with messages:", messages);
 
   // Ensure messages is an array and not null or undefined
@@ -193,6 +193,16 @@ const ChatWindow = ({ messages, loading, error }) => {
           <div className="messages-container">
             {/* Scrollable message area */}
             <div className="messages-scrollable">
+              {/* Older pages are only fetched on request */}
+              {hasOlder && (
+                <button
+                  className="load-older-btn"
+                  onClick={onLoadOlder}
+                  disabled={loadingOlder}
+                >
+                  {loadingOlder ? 'Loading...' : 'Load older messages'}
+                </button>
+              )}
               {validMessages.length === 0 ? (
                 <p>No messages available.</p>
               ) : (
@@ -1,18 +1,27 @@
 // ConversationList.jsx
-import React, { useEffect, useState } from 'react';
-import { getConversations } from '../services/api'; // Import the API function
+import React, { useEffect, useRef, useState } from 'react';
+import { getConversationsPage } from '../services/api'; // Import the API function
 import '../styles/ConversationList.css'; // Ensure the path to the CSS file is correct
 
+// Start loading the next page this close (in px) to the bottom of the list
+const LOAD_MORE_THRESHOLD = 50;
+
 const ConversationList = ({ onSelectConversation }) => {
   const [conversations, setConversations] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Cursor of the next (older) page, null once everything is loaded
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Scroll events fire faster than state updates; this keeps to one request at a time
+  const loadingMoreRef = useRef(false);
 
   useEffect(() => {
     const fetchConversations = async () => {
       try {
-        const data = await getConversations();
-        setConversations(data);
+        const data = await getConversationsPage();
+        setConversations(data.conversations);
+        setNextCursor(data.pagination.next);
         setLoading(false);
       } catch (error) {
         console.error('Failed to fetch conversations:', error);
@@ -24,9 +33,35 @@ const ConversationList = ({ onSelectConversation }) => {
     fetchConversations();
   }, []);
 
+  // Append the next page of older conversations
+  const loadMore = async () => {
+    if (!nextCursor || loadingMoreRef.current) return;
+
+    loadingMoreRef.current = true;
+    setLoadingMore(true);
+    try {
+      const data = await getConversationsPage({ before: nextCursor });
+      setConversations((previous) => [...previous, ...data.conversations]);
+      setNextCursor(data.pagination.next);
+    } catch (error) {
+      console.error('Failed to fetch more conversations:', error);
+      setError('Failed to load conversations');
+    } finally {
+      loadingMoreRef.current = false;
+      setLoadingMore(false);
+    }
+  };
+
+  const handleScroll = (event) => {
+    const { scrollTop, scrollHeight, clientHeight } = event.currentTarget;
+    if (scrollHeight - scrollTop - clientHeight < LOAD_MORE_THRESHOLD) {
+      loadMore();
+    }
+  };
+
   return (
     <div className="conversation-list-container">
-      <div className="conversation-list">
+      <div className="conversation-list" onScroll={handleScroll}>
         <h2>Conversations</h2>
         {/* Show loading state */}
         {loading && <p>Loading conversations...</p>}
@@ -46,6 +81,17 @@ const ConversationList = ({ onSelectConversation }) => {
             </li>
           ))}
         </ul>
+
+        {/* Older conversations load on scroll, or with the button if the list doesn't scroll yet */}
+        {!loading && !error && nextCursor && (
+          <button
+            className="load-more-btn"
+            onClick={loadMore}
+            disabled={loadingMore}
+          >
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        )}
       </div>
     </div>
   );
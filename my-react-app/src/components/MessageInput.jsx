@@ -1,9 +1,8 @@
 // MessageInput.jsx
 import React, { useState } from 'react';
-import { sendMessage } from '../services/api'; // Import the sendMessage function
 import '../styles/MessageInput.css';
 
-const MessageInput = ({ conversationId, onNewMessage, setConversationId }) => {
+const MessageInput = ({ onNewMessage }) => {
   const [inputMessage, setInputMessage] = useState('');
   const [isSending, setIsSending] = useState(false);
 
@@ -17,16 +16,9 @@ const MessageInput = ({ conversationId, onNewMessage, setConversationId }) => {
     setIsSending(true);
 
     try {
-      // Display the user message immediately
-      onNewMessage(inputMessage);
-
-      // Send message (the function handles creating a new conversation if needed)
-      const response = await sendMessage(conversationId, inputMessage);
-
-      // If a new conversation was created, update the conversationId in the parent component
-      if (!conversationId && response.conversation_id) {
-        setConversationId({ id: response.conversation_id, title: response.title }); // Update with new conversation object
-      }
+      // The parent shows the message, streams the reply and creates the
+      // conversation if needed
+      await onNewMessage(inputMessage);
 
       setInputMessage(''); // Clear the input after sending
     } catch (error) {
@@ -4,10 +4,13 @@ import axios from 'axios';
 // Set the base URL for the Django backend API
 const API_BASE_URL = 'http://localhost:8000/api'; // Replace with your Django backend URL
 
-// Function to get all conversations for the logged-in user
-export const getConversations = async () => {
+// Function to get one page of the logged-in user's conversations, most recently
+// active first, with its `pagination`. Pass { before: pagination.next } from a
+// previous page to load older ones.
+export const getConversationsPage = async (params = {}) => {
   try {
     const response = await axios.get(`${API_BASE_URL}/get-conversations/`, {
+      params,
       headers: {
         Authorization: `Token ${localStorage.getItem('token')}`, // Retrieve the token from localStorage
       },
@@ -19,6 +22,11 @@ export const getConversations = async () => {
   }
 };
 
+export const getConversations = async (params = {}) => {
+  const data = await getConversationsPage(params);
+  return data.conversations;
+};
+
 
 
 export const sendMessage = async (conversationId, inputMessage) => {
@@ -44,17 +52,75 @@ export const sendMessage = async (conversationId, inputMessage) => {
 };
 
 
-export const getChatHistory = async (conversationId) => {
+// Stream the AI reply token by token over Server-Sent Events.
+// `onToken` is called with each text chunk as it arrives; resolves with
+// the final { conversation_id, title } once the stream ends.
+export const streamMessage = async (conversationId, inputMessage, onToken) => {
+  const response = await fetch(`${API_BASE_URL}/handle-message/stream/`, {
+    method: 'POST',
+    headers: {
+      Authorization: `Token ${localStorage.getItem('token')}`,
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      conversation_id: conversationId,
+      input_message: inputMessage,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Error sending message: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach((line) => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+
+      const payload = JSON.parse(data);
+      if (event === 'token') onToken(payload.content);
+      else if (event === 'done') result = payload;
+      else if (event === 'error') throw new Error(payload.error);
+    }
+  }
+
+  return result;
+};
+
+
+// Fetch one page of a conversation's history. Without params this is the newest
+// page; pass { before }, { after } or { since } with a cursor from a previous
+// response's `pagination` to page back or to fetch only new messages.
+export const getChatHistoryPage = async (conversationId, params = {}) => {
   try {
       const response = await axios.get(`${API_BASE_URL}/chat-history/${conversationId}/`, {
+          params,
           headers: {
               Authorization: `Token ${localStorage.getItem('token')}`,
           },
       });
-      
+
       // Check if the fetched data contains 'messages' and if it's an array
       if (response.data && Array.isArray(response.data.messages)) {
-          return response.data.messages;
+          return response.data;
       } else {
           throw new Error('Fetched data is not an array');
       }
@@ -63,3 +129,8 @@ export const getChatHistory = async (conversationId) => {
       throw error;
   }
 };
+
+export const getChatHistory = async (conversationId, params = {}) => {
+  const data = await getChatHistoryPage(conversationId, params);
+  return data.messages;
+};